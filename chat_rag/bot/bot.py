@@ -1,33 +1,209 @@
 import asyncio
 import logging
 import os
+import signal
 
 from aiogram import Bot, Dispatcher
-from config import TELEGRAM_BOT_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from config import (
+    AGENT_MAX_JOBS,
+    AGENT_QUICK_JOBS,
+    AGENT_RECOMMEND_JOBS,
+    BOT_MODE,
+    KB_WATCH_INTERVAL_S,
+    MAX_CONCURRENT_UPDATES,
+    RAG_REQUEST_TIMEOUT_S,
+    RAG_WORKER_THREADS,
+    RAG_WORKERS,
+    SEND_CHAT_INTERVAL_S,
+    SEND_CONCURRENCY,
+    SEND_GLOBAL_RATE,
+    SEND_MAX_RETRIES,
+    SHUTDOWN_DEREGISTER_DELAY,
+    SHUTDOWN_DRAIN_TIMEOUT,
+    TELEGRAM_API_URL,
+    TELEGRAM_BOT_TOKEN,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_SET_ON_STARTUP,
+)
 from handlers import router
-from middlewares import DialogHistoryMiddleware
+from kb_reload import KnowledgeBaseReloader
+from middlewares import ConcurrencyLimitMiddleware, DialogHistoryMiddleware
+from scheduler import QUICK, RECOMMEND, JobScheduler
+from sender import OutboundSender
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from chat_rag.rag.logging_setup import setup_logging
+from chat_rag.rag.worker_pool import ShardedWorkerPool
+
+setup_logging()
 
 TOKEN = os.getenv("BOT_TOKEN")  # Укажите токен через переменную окружения
 
 
+def create_bot() -> Bot:
+    """
+    Создает бота. Если задан TELEGRAM_API_URL, запросы идут на указанный сервер.
+    """
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=True)
+        )
+        return Bot(token=TELEGRAM_BOT_TOKEN, session=session)
+    return Bot(token=TELEGRAM_BOT_TOKEN)
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Создает диспетчер с middleware и роутером.
+    """
+    dp = Dispatcher()
+
+    # Ограничиваем число одновременных обработок и ведём учёт незавершённых
+    concurrency = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES)
+    dp.update.outer_middleware(concurrency)
+    dp["concurrency"] = concurrency
+
+    # Подключаем middleware для хранения историй диалогов
+    dialog_history = DialogHistoryMiddleware()
+    dp.message.middleware(dialog_history)
+    dp["dialog_history"] = dialog_history
+
+    # Приоритеты задач агента: быстрые вопросы впереди подбора курсов
+    scheduler = JobScheduler(
+        {QUICK: AGENT_QUICK_JOBS, RECOMMEND: AGENT_RECOMMEND_JOBS}, AGENT_MAX_JOBS
+    )
+    dp["scheduler"] = scheduler
+
+    # Ответы отправляются из очереди с учётом лимитов Telegram
+    sender = OutboundSender(
+        SEND_GLOBAL_RATE, SEND_CHAT_INTERVAL_S, SEND_CONCURRENCY, SEND_MAX_RETRIES
+    )
+    dp["sender"] = sender
+    dp.startup.register(sender.start)
+
+    dp.include_router(router)
+
+    # Пул процессов для агента: фронтовый процесс занимается только Telegram
+    rag_pool = None
+    if RAG_WORKERS > 0:
+        rag_pool = ShardedWorkerPool(
+            RAG_WORKERS, RAG_WORKER_THREADS, RAG_REQUEST_TIMEOUT_S
+        )
+        dp["rag_pool"] = rag_pool
+
+        async def on_startup():
+            await asyncio.to_thread(rag_pool.start)
+
+        dp.startup.register(on_startup)
+
+    # Перезагрузка базы знаний по /reload и при изменении data/chunks;
+    # наблюдение запускается после старта пула
+    kb_reloader = KnowledgeBaseReloader(rag_pool, KB_WATCH_INTERVAL_S)
+    dp["kb_reloader"] = kb_reloader
+    dp.startup.register(kb_reloader.start)
+
+    async def on_shutdown():
+        await kb_reloader.stop()
+        await concurrency.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        # Планы, построение которых уже подтверждено пользователю
+        await scheduler.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        # Сессия бота закрывается после dp.shutdown — успеваем дослать ответы
+        await sender.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        await sender.stop()
+        if rag_pool:
+            await asyncio.to_thread(rag_pool.stop, SHUTDOWN_DRAIN_TIMEOUT)
+
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """
+    Создает aiohttp-приложение с webhook-обработчиком и health/readiness эндпоинтами.
+    """
+    concurrency: ConcurrencyLimitMiddleware = dp["concurrency"]
+    app = web.Application()
+
+    async def healthz(_: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readyz(_: web.Request) -> web.Response:
+        stats = concurrency.get_stats()
+        return web.json_response(stats, status=200 if stats["accepting"] else 503)
+
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+
+    async def on_startup():
+        if WEBHOOK_SET_ON_STARTUP:
+            url = WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+            logging.info("Setting webhook: %s", url)
+            await bot.set_webhook(url, secret_token=WEBHOOK_SECRET or None)
+
+    dp.startup.register(on_startup)
+
+    # setup_application регистрируется первым, чтобы при остановке ожидание
+    # обработок (dp.shutdown) выполнилось до закрытия сессии бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Запускает бота в webhook-режиме и останавливает его по SIGINT/SIGTERM.
+    """
+    concurrency: ConcurrencyLimitMiddleware = dp["concurrency"]
+    app = create_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    logging.info("Webhook server listening on %s:%d", WEBAPP_HOST, WEBAPP_PORT)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+    # Сначала снимаем готовность и ждём, пока балансировщик заметит 503 на /readyz
+    # и перестанет слать трафик; апдейты, пришедшие за это время, ещё обрабатываются
+    concurrency.accepting = False
+    logging.info(
+        "Readiness withdrawn, waiting %.1fs for deregistration",
+        SHUTDOWN_DEREGISTER_DELAY,
+    )
+    await asyncio.sleep(SHUTDOWN_DEREGISTER_DELAY)
+    # Закрытие listener'а, затем dp.shutdown: ожидание обработок и очередей
+    logging.info("Shutting down webhook server...")
+    await runner.cleanup()
+
+
 async def main():
     """
     Main entry point for the bot.
     """
-    logging.info("Starting Telegram bot...")
+    logging.info("Starting Telegram bot in %s mode...", BOT_MODE)
     try:
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        dp = Dispatcher()
-
-        # Подключаем middleware для хранения историй диалогов
-        dp.message.middleware(DialogHistoryMiddleware())
-
-        dp.include_router(router)
-        await dp.start_polling(bot)
+        bot = create_bot()
+        dp = create_dispatcher()
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
     except (asyncio.CancelledError, RuntimeError) as e:
         logging.error("Bot encountered a runtime error: %s", e)
     except Exception as e:
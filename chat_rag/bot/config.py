@@ -9,3 +9,59 @@ if not TELEGRAM_BOT_TOKEN:
     raise ValueError(
         "TELEGRAM_BOT_TOKEN is not set in the environment variables. Please set it in your .env file."
     )
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+# Базовый URL Bot API. Переопределяется для локального Bot API сервера
+# или фейкового сервера (см. chat_rag/devtools/fake_telegram.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Настройки webhook-режима
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# При нескольких инстансах за балансировщиком webhook регистрирует только один
+WEBHOOK_SET_ON_STARTUP = os.getenv("WEBHOOK_SET_ON_STARTUP", "true").lower() == "true"
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Максимум одновременно обрабатываемых апдейтов в одном процессе
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+# Сколько секунд ждать завершения обработок при остановке
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+# Сколько секунд после снятия готовности (/readyz -> 503) webhook-сервер продолжает
+# принимать апдейты, пока балансировщик не выведет инстанс из ротации
+SHUTDOWN_DEREGISTER_DELAY = float(os.getenv("SHUTDOWN_DEREGISTER_DELAY", "10"))
+
+# Лимиты одновременных задач агента: всего и по классам (быстрые вопросы
+# и подбор курсов); освободившийся слот в первую очередь получают быстрые вопросы
+AGENT_MAX_JOBS = int(os.getenv("AGENT_MAX_JOBS", str(MAX_CONCURRENT_UPDATES)))
+AGENT_QUICK_JOBS = int(os.getenv("AGENT_QUICK_JOBS", str(AGENT_MAX_JOBS)))
+AGENT_RECOMMEND_JOBS = int(os.getenv("AGENT_RECOMMEND_JOBS", "4"))
+
+# Очередь исходящих сообщений: лимит сообщений в секунду на бота, минимальный
+# интервал между сообщениями одного чата, число одновременных отправок и повторов
+# после 429 или сетевой ошибки
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_INTERVAL_S = float(os.getenv("SEND_CHAT_INTERVAL_S", "1"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+
+# Число worker-процессов для RAG (0 — агент работает в процессе бота)
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "0"))
+# Число потоков в каждом worker-процессе (запросы разных пользователей)
+RAG_WORKER_THREADS = int(os.getenv("RAG_WORKER_THREADS", "4"))
+# Сколько секунд ждать ответа worker-процесса на сообщение; по истечении
+# или при падении процесса пользователь получает деградированный ответ
+RAG_REQUEST_TIMEOUT_S = float(os.getenv("RAG_REQUEST_TIMEOUT_S", "120"))
+
+# Период проверки data/chunks для перезагрузки базы знаний, секунды (0 — выключено;
+# перезагрузка по команде /reload доступна всегда)
+KB_WATCH_INTERVAL_S = float(os.getenv("KB_WATCH_INTERVAL_S", "0"))
+
+# ID пользователей Telegram с доступом к служебным командам (/memory, /reload),
+# через запятую
+ADMIN_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()
+}
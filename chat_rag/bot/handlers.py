@@ -1,19 +1,37 @@
-from typing import Optional, Callable, Union
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Callable
 from aiogram import Router, types
-from aiogram.filters import Command
-from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
+from aiogram.filters import Command, CommandObject
+from config import ADMIN_IDS
+from kb_reload import KnowledgeBaseReloader, format_reload_report
+from middlewares import DialogHistoryMiddleware
+from scheduler import QUICK, RECOMMEND, JobScheduler, classify_message
+from sender import OutboundSender, split_message
 
-from chat_rag.rag.rag_agent import process_message
+from chat_rag.rag.commands import run_command
+from chat_rag.rag.history import DialogHistory
+from chat_rag.rag.memory_profile import format_report
+from chat_rag.rag.rag_agent import aprocess_message, degraded_answer
+from chat_rag.rag.worker_pool import ShardedWorkerPool, WorkerUnavailableError
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Подтверждение запроса на подбор курсов: ответ (план или уточняющий вопрос
+# о профиле) готовится в фоне и приходит отдельно
+PLAN_ACK = (
+    "Подбираю для вас курсы, это может занять около минуты. "
+    "Пришлю ответ отдельным сообщением."
+)
+PLAN_FAILED = "Не удалось составить план обучения. Пожалуйста, попробуйте ещё раз."
+
 
 @router.message(Command("start"))
 async def start_handler(
     message: types.Message,
-    user_memory: Optional[
-        Union[ConversationBufferMemory, ConversationBufferWindowMemory]
-    ] = None,
+    user_memory: Optional[DialogHistory] = None,
 ):
     """Обработчик команды /start"""
     await message.answer(
@@ -24,9 +42,7 @@ async def start_handler(
 @router.message(Command("help"))
 async def help_handler(
     message: types.Message,
-    user_memory: Optional[
-        Union[ConversationBufferMemory, ConversationBufferWindowMemory]
-    ] = None,
+    user_memory: Optional[DialogHistory] = None,
 ):
     """Обработчик команды /help"""
     await message.answer(
@@ -37,12 +53,10 @@ async def help_handler(
 @router.message(Command("clear"))
 async def clear_handler(
     message: types.Message,
-    user_memory: Optional[
-        Union[ConversationBufferMemory, ConversationBufferWindowMemory]
-    ] = None,
+    user_memory: Optional[DialogHistory] = None,
 ):
     """Обработчик команды /clear для очистки истории диалога"""
-    if user_memory:
+    if user_memory is not None:
         user_memory.clear()
         await message.answer("История диалога очищена! Можете начать новый разговор.")
     else:
@@ -57,26 +71,133 @@ async def stats_handler(message: types.Message):
     await message.answer("Статистика памяти диалогов временно недоступна.")
 
 
+@router.message(Command("memory"))
+async def memory_handler(
+    message: types.Message,
+    command: CommandObject,
+    dialog_history: Optional[DialogHistoryMiddleware] = None,
+    rag_pool: Optional[ShardedWorkerPool] = None,
+):
+    """
+    Обработчик команды /memory (только для администраторов): размеры компонентов
+    в памяти процессов и истории диалогов.
+
+    /memory               — отчёт по памяти;
+    /memory trace start   — включить tracemalloc;
+    /memory trace diff    — рост выделений с момента включения;
+    /memory trace stop    — выключить tracemalloc.
+    """
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+
+    args = (command.args or "").split()
+    name = "report"
+    if args[:1] == ["trace"]:
+        name = f"trace_{args[1] if len(args) > 1 else 'diff'}"
+    elif args:
+        name = "unknown"
+    try:
+        results: List[Dict[str, Any]] = [await asyncio.to_thread(run_command, name)]
+        if rag_pool:
+            results.extend(await rag_pool.run_command(name))
+    except ValueError:
+        await message.answer("Использование: /memory [trace start|diff|stop]")
+        return
+
+    history = dialog_history.get_history_size_stats() if dialog_history else None
+    await message.answer(
+        format_report(results, history if name == "report" else None)[:4096]
+    )
+
+
+@router.message(Command("reload"))
+async def reload_handler(
+    message: types.Message,
+    kb_reloader: Optional[KnowledgeBaseReloader] = None,
+):
+    """
+    Обработчик команды /reload (только для администраторов): перезагружает
+    базу знаний из data/chunks без остановки бота и сообщает версию и время сборки.
+    """
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+    if not kb_reloader:
+        await message.answer("Перезагрузка базы знаний недоступна.")
+        return
+    await message.answer("Перезагружаю базу знаний...")
+    try:
+        results = await kb_reloader.reload()
+    except Exception as e:
+        logger.error("Knowledge base reload failed: %s", e)
+        await message.answer(f"Не удалось перезагрузить базу знаний: {e}")
+        return
+    await message.answer(format_reload_report(results, kb_reloader.last_total_s))
+
+
 @router.message()
 async def common_messages_handler(
     message: types.Message,
-    user_memory: Optional[
-        Union[ConversationBufferMemory, ConversationBufferWindowMemory]
-    ] = None,
+    user_memory: Optional[DialogHistory] = None,
     update_memory: Optional[Callable[[str, str], None]] = None,
+    rag_pool: Optional[ShardedWorkerPool] = None,
+    scheduler: Optional[JobScheduler] = None,
+    sender: Optional[OutboundSender] = None,
 ):
     """Обработчик обычных сообщений с использованием памяти пользователя"""
     # Используем память пользователя, переданную через middleware
-    if not user_memory:
-        user_memory = ConversationBufferMemory()
+    if user_memory is None:
+        user_memory = DialogHistory()
 
     # Проверяем, что text не None
     user_text = message.text or ""
 
-    response = process_message(user_text, user_memory)
+    async def answer_question() -> str:
+        if rag_pool and message.from_user:
+            # Агент работает в worker-процессе, закреплённом за пользователем
+            try:
+                return await rag_pool.process(
+                    message.from_user.id, user_text, user_memory.pairs()
+                )
+            except WorkerUnavailableError as e:
+                logger.error("RAG worker unavailable: %s", e)
+                return degraded_answer()
+        # Агент асинхронный: модель и инструменты не блокируют event loop;
+        # ответ добавляется в историю через update_memory
+        return await aprocess_message(user_text, user_memory.pairs())
+
+    async def reply(text: str):
+        if sender:
+            # Отправка (с разбиением и ожиданием лимитов) не держит обработчик
+            sender.reply(message, text)
+            return
+        for part in split_message(text):
+            await message.answer(part)
+
+    async def deliver_plan():
+        try:
+            response = await answer_question()
+        except Exception:
+            logger.exception("Failed to build a learning plan")
+            await reply(PLAN_FAILED)
+            return
+        if update_memory:
+            update_memory(user_text, response)
+        await reply(response)
+
+    if scheduler is None:
+        response = await answer_question()
+    elif classify_message(user_text, user_memory.pairs()) == RECOMMEND:
+        # Долгий подбор курсов не держит слот обработки апдейтов
+        await reply(PLAN_ACK)
+        scheduler.spawn(RECOMMEND, deliver_plan)
+        return
+    else:
+        response = await scheduler.run(QUICK, answer_question)
 
     # Обновляем память пользователя после получения ответа
     if update_memory:
         update_memory(user_text, response)
 
-    await message.answer(response)
+    await reply(response)
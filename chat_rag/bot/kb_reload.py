@@ -0,0 +1,103 @@
+"""
+Перезагрузка базы знаний без остановки бота.
+
+Новые индексы и каталоги курсов собираются в фоне в каждом процессе с агентом
+(в процессе бота или в worker-процессах пула), после чего подменяются одним
+присваиванием: начатые ходы агента дорабатывают со старой версией.
+Перезагрузку запускает администратор командой /reload или наблюдатель,
+который раз в KB_WATCH_INTERVAL_S секунд проверяет отпечаток файлов data/chunks.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from chat_rag.rag.commands import run_command
+from chat_rag.rag.programs import chunks_fingerprint
+from chat_rag.rag.worker_pool import ShardedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+def format_reload_report(results: List[Dict[str, Any]], total_s: float) -> str:
+    """Форматирует результаты перезагрузки процессов для администратора."""
+    lines = [f"База знаний перезагружена за {total_s:.1f} с."]
+    for result in results:
+        lines.append(
+            f"Процесс {result['pid']}: версия {result['previous_version']} → "
+            f"{result['version']} ({result['fingerprint']}"
+            + ("" if result["changed"] else ", данные не изменились")
+            + f"), сборка {result['build_s']:.1f} с, "
+            f"программы: {', '.join(result['programs'])}"
+        )
+    return "\n".join(lines)
+
+
+class KnowledgeBaseReloader:
+    """
+    Запускает перезагрузку базы знаний во всех процессах с агентом.
+
+    Args:
+        rag_pool: Пул worker-процессов (None — агент работает в процессе бота)
+        watch_interval: Период проверки data/chunks в секундах (0 — без наблюдения)
+    """
+
+    def __init__(
+        self, rag_pool: Optional[ShardedWorkerPool] = None, watch_interval: float = 0
+    ):
+        self.rag_pool = rag_pool
+        self.watch_interval = watch_interval
+        self._lock = asyncio.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+        self.last_total_s: float = 0.0
+
+    async def reload(self) -> List[Dict[str, Any]]:
+        """
+        Перезагружает базу знаний и ждёт, пока все процессы переключатся
+        на новую версию.
+
+        Returns:
+            Результаты процессов: версия, отпечаток данных, время сборки
+        """
+        async with self._lock:
+            started = time.monotonic()
+            if self.rag_pool:
+                results = await self.rag_pool.run_command("reload")
+            else:
+                results = [await asyncio.to_thread(run_command, "reload")]
+            self.last_total_s = time.monotonic() - started
+            logger.info(
+                "Knowledge base reload finished in %.2fs: versions=%s",
+                self.last_total_s,
+                [result["version"] for result in results],
+            )
+            return results
+
+    async def _watch(self):
+        fingerprint = await asyncio.to_thread(chunks_fingerprint)
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            current = await asyncio.to_thread(chunks_fingerprint)
+            if current == fingerprint:
+                continue
+            logger.info("Knowledge base changed (%s -> %s)", fingerprint, current)
+            try:
+                await self.reload()
+                fingerprint = current
+            except Exception as e:
+                # Повторим на следующей проверке; до тех пор работает старая версия
+                logger.error("Knowledge base reload failed: %s", e)
+
+    async def start(self):
+        """Запускает наблюдение за data/chunks, если оно включено."""
+        if self.watch_interval > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+            logger.info("Watching knowledge base every %.0fs", self.watch_interval)
+
+    async def stop(self):
+        """Останавливает наблюдение."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
@@ -1,9 +1,12 @@
+import asyncio
 import logging
 import os
-from typing import Any, Awaitable, Callable, Dict, Optional, Union
+from typing import Any, Awaitable, Callable, Dict, Optional
 from aiogram import BaseMiddleware
 from aiogram.types import Message, TelegramObject
-from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
+
+from chat_rag.rag.history import DialogHistory
+from chat_rag.rag.logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
@@ -11,49 +14,29 @@ logger = logging.getLogger(__name__)
 class DialogHistoryMiddleware(BaseMiddleware):
     """
     Middleware для хранения и управления историями диалогов пользователей.
+    История пользователя — кольцевой буфер последних 2 * memory_window сообщений
+    (memory_window пар вопрос-ответ, 0 — без ограничения).
     """
 
     def __init__(
         self, max_tokens: Optional[int] = None, memory_window: Optional[int] = None
     ):
-        # Словарь для хранения памяти каждого пользователя
-        self.user_memories: Dict[
-            int, Union[ConversationBufferMemory, ConversationBufferWindowMemory]
-        ] = {}
+        # Словарь для хранения истории каждого пользователя
+        self.user_memories: Dict[int, DialogHistory] = {}
 
         # Настройки памяти из переменных окружения или параметров
         self.max_tokens = max_tokens or int(os.getenv("MEMORY_MAX_TOKENS", "2000"))
         self.memory_window = memory_window or int(os.getenv("MEMORY_WINDOW", "10"))
-        self.return_messages = (
-            os.getenv("MEMORY_RETURN_MESSAGES", "true").lower() == "true"
-        )
 
         logger.info(
-            "DialogHistoryMiddleware initialized: max_tokens=%d, memory_window=%d, return_messages=%s",
+            "DialogHistoryMiddleware initialized: max_tokens=%d, memory_window=%d",
             self.max_tokens,
             self.memory_window,
-            self.return_messages,
         )
 
-    def _create_memory(
-        self,
-    ) -> Union[ConversationBufferMemory, ConversationBufferWindowMemory]:
-        """Создает новую память для пользователя"""
-        if self.memory_window > 0:
-            logger.debug(
-                "Creating ConversationBufferWindowMemory with window size: %d",
-                self.memory_window,
-            )
-            return ConversationBufferWindowMemory(
-                k=self.memory_window,
-                return_messages=self.return_messages,
-                memory_key="chat_history",
-            )
-        else:
-            logger.debug("Creating ConversationBufferMemory")
-            return ConversationBufferMemory(
-                return_messages=self.return_messages, memory_key="chat_history"
-            )
+    def _create_memory(self) -> DialogHistory:
+        """Создает новую историю для пользователя"""
+        return DialogHistory(self.memory_window * 2 if self.memory_window > 0 else None)
 
     async def __call__(
         self,
@@ -75,7 +58,7 @@ class DialogHistoryMiddleware(BaseMiddleware):
 
         # Получаем или создаем память для пользователя
         if user_id not in self.user_memories:
-            logger.info("Creating new memory for user_id: %d", user_id)
+            logger.info("Creating new memory for user_id: %d", user_id, extra=SAMPLED)
             self.user_memories[user_id] = self._create_memory()
         else:
             logger.debug("Using existing memory for user_id: %d", user_id)
@@ -101,8 +84,7 @@ class DialogHistoryMiddleware(BaseMiddleware):
                 ai_message: Ответ бота
             """
             try:
-                memory = self.user_memories[user_id]
-                memory.save_context({"input": human_message}, {"output": ai_message})
+                self.user_memories[user_id].add_exchange(human_message, ai_message)
                 logger.debug(
                     "Memory updated for user_id: %d, human_msg_len: %d, ai_msg_len: %d",
                     user_id,
@@ -134,17 +116,15 @@ class DialogHistoryMiddleware(BaseMiddleware):
                 "Attempted to clear memory for non-existent user_id: %d", user_id
             )
 
-    def get_user_memory(
-        self, user_id: int
-    ) -> Union[ConversationBufferMemory, ConversationBufferWindowMemory]:
+    def get_user_memory(self, user_id: int) -> DialogHistory:
         """
-        Возвращает память пользователя.
+        Возвращает историю диалога пользователя.
 
         Args:
             user_id: ID пользователя
 
         Returns:
-            ConversationBufferMemory или ConversationBufferWindowMemory: Память пользователя
+            DialogHistory: История пользователя
         """
         if user_id not in self.user_memories:
             logger.info(
@@ -166,7 +146,113 @@ class DialogHistoryMiddleware(BaseMiddleware):
             "total_users": len(self.user_memories),
             "max_tokens": self.max_tokens,
             "memory_window": self.memory_window,
-            "return_messages": self.return_messages,
         }
         logger.debug("Memory stats requested: %s", stats)
         return stats
+
+    def get_history_size_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает распределение размеров историй диалогов по пользователям.
+
+        Returns:
+            Словарь со статистикой (размеры в байтах)
+        """
+        sizes = []
+        messages = []
+        for history in list(self.user_memories.values()):
+            sizes.append(history.nbytes())
+            messages.append(len(history))
+        sizes.sort()
+
+        def percentile(q: float) -> int:
+            return sizes[min(len(sizes) - 1, int(len(sizes) * q))] if sizes else 0
+
+        return {
+            "users": len(sizes),
+            "total_bytes": sum(sizes),
+            "p50_bytes": percentile(0.5),
+            "p90_bytes": percentile(0.9),
+            "p99_bytes": percentile(0.99),
+            "max_bytes": sizes[-1] if sizes else 0,
+            "avg_messages": sum(messages) / len(messages) if messages else 0.0,
+            "max_messages": max(messages, default=0),
+        }
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Middleware для ограничения числа одновременно обрабатываемых апдейтов.
+    Ведёт учёт незавершённых обработок, чтобы при остановке дождаться их.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("MAX_CONCURRENT_UPDATES", "16")
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.in_flight = 0
+        # Флаг готовности принимать трафик (используется в /readyz)
+        self.accepting = True
+
+        logger.info(
+            "ConcurrencyLimitMiddleware initialized: max_concurrency=%d",
+            self.max_concurrency,
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """
+        Выполняет обработчик, не превышая лимит одновременных обработок.
+        """
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Прекращает приём трафика и ждёт завершения текущих обработок.
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            True, если все обработки завершились до таймаута
+        """
+        self.accepting = False
+        logger.info(
+            "Draining %d in-flight updates (timeout=%.1fs)", self.in_flight, timeout
+        )
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Drain timeout exceeded, %d updates still in flight", self.in_flight
+            )
+            return False
+        logger.info("All in-flight updates finished")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает текущую загрузку.
+
+        Returns:
+            Словарь со статистикой
+        """
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "accepting": self.accepting,
+        }
@@ -0,0 +1,206 @@
+"""
+Планировщик работы агента с классами приоритета.
+
+Вопросы делятся на быстрые (факты, FAQ) и рекомендации (план курсов — четыре вызова
+LLM). У каждого класса свой лимит одновременных задач, а общий лимит распределяется
+по приоритету: освободившийся слот получает ожидающая задача старшего класса.
+Так всплеск рекомендаций не задерживает быстрые вопросы.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, TypeVar
+
+import numpy as np
+
+from chat_rag.rag.history import AI, HUMAN, History
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+QUICK = "quick"
+RECOMMEND = "recommend"
+
+# Только явные просьбы подобрать или посоветовать: слова «курс», «электив» встречаются
+# и в вопросах-фактах («на каком курсе практика», «какие курсы есть»)
+_RECOMMEND_PATTERN = re.compile(
+    r"посоветуй|порекомендуй|рекомендуе(?:шь|те)|рекомендаци|подбери"
+    r"|помоги(?:те)?\s+(?:мне\s+)?(?:выбрать|подобрать|составить|спланировать)"
+    r"|(?:составь|построй|спланируй)(?:те)?\s+(?:мне\s+)?(?:\w+\s+)?(?:план|траектори)"
+    r"|что\s+(?:мне\s+)?(?:лучше\s+)?выбрать"
+    r"|как\w*\s+(?:\w+\s+)?(?:курс|дисциплин|предмет|электив)\w*"
+    r"\s+(?:мне\s+)?(?:лучше\s+|стоит\s+)?(?:выбрать|взять|брать|подойд)",
+    re.IGNORECASE,
+)
+
+
+def _continues_recommendation(history: History) -> bool:
+    """
+    Ждёт ли агент уточнений к запросу рекомендаций: на просьбу подобрать курсы
+    (или на ответы к ней) он ответил вопросом — про программу, опыт, цели.
+    """
+    answer: Optional[str] = None
+    for role, text in reversed(history):
+        if role == AI:
+            answer = text
+        elif role == HUMAN:
+            if answer is None or "?" not in answer:
+                return False
+            if _RECOMMEND_PATTERN.search(text):
+                return True
+            answer = None
+    return False
+
+
+def classify_message(text: str, history: Optional[History] = None) -> str:
+    """
+    Класс задачи: RECOMMEND для подбора курсов, иначе QUICK. Ответ на уточняющий
+    вопрос агента к запросу рекомендаций (профиль абитуриента) — тоже подбор курсов:
+    именно он запустит courses_recommender.
+
+    Args:
+        text: Вопрос пользователя
+        history: Предыдущие сообщения диалога (role, text)
+    """
+    if _RECOMMEND_PATTERN.search(text) or _continues_recommendation(history or []):
+        return RECOMMEND
+    return QUICK
+
+
+class JobScheduler:
+    """
+    Очередь задач агента с приоритетами и лимитами по классам.
+
+    Args:
+        limits: Лимит одновременных задач по классам; порядок ключей задаёт
+            приоритет (первый — старший)
+        max_running: Общий лимит одновременных задач (по умолчанию сумма лимитов)
+        window: Сколько последних времён ожидания хранить для перцентилей
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, int],
+        max_running: Optional[int] = None,
+        window: int = 1000,
+    ):
+        self.limits = dict(limits)
+        self.max_running = max_running or sum(limits.values())
+        self._waiting: Dict[str, Deque[asyncio.Future]] = {
+            job_class: deque() for job_class in limits
+        }
+        self._running: Counter = Counter()
+        self._counters: Dict[str, Counter] = {
+            job_class: Counter() for job_class in limits
+        }
+        self._queue_times: Dict[str, Deque[float]] = {
+            job_class: deque(maxlen=window) for job_class in limits
+        }
+        self._background: Set[asyncio.Task] = set()
+
+        logger.info(
+            "JobScheduler initialized: limits=%s, max_running=%d",
+            self.limits,
+            self.max_running,
+        )
+
+    def _dispatch(self):
+        """Раздаёт свободные слоты ожидающим задачам в порядке приоритета."""
+        while sum(self._running.values()) < self.max_running:
+            for job_class, waiting in self._waiting.items():
+                # Задачи, отменённые во время ожидания
+                while waiting and waiting[0].done():
+                    waiting.popleft()
+                if waiting and self._running[job_class] < self.limits[job_class]:
+                    self._running[job_class] += 1
+                    waiting.popleft().set_result(None)
+                    break
+            else:
+                return
+
+    def _release(self, job_class: str):
+        self._running[job_class] -= 1
+        self._counters[job_class]["completed"] += 1
+        self._dispatch()
+
+    async def run(self, job_class: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Ждёт слот класса job_class и выполняет fn().
+
+        Raises:
+            ValueError: если класс неизвестен
+        """
+        if job_class not in self.limits:
+            raise ValueError(f"Unknown job class: {job_class}")
+        enqueued = time.monotonic()
+        slot = asyncio.get_running_loop().create_future()
+        self._waiting[job_class].append(slot)
+        self._counters[job_class]["submitted"] += 1
+        self._dispatch()
+        try:
+            await slot
+        except asyncio.CancelledError:
+            # Слот мог быть выдан одновременно с отменой
+            if slot.done() and not slot.cancelled():
+                self._release(job_class)
+            raise
+        self._queue_times[job_class].append(time.monotonic() - enqueued)
+        try:
+            return await fn()
+        finally:
+            self._release(job_class)
+
+    def spawn(self, job_class: str, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Выполняет задачу в фоне (ответ доставляется отдельно); при остановке
+        drain() дожидается таких задач.
+        """
+        task = asyncio.create_task(self.run(job_class, fn))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Ждёт завершения фоновых задач.
+
+        Returns:
+            True, если все задачи завершились до таймаута
+        """
+        if not self._background:
+            return True
+        logger.info("Waiting for %d background jobs", len(self._background))
+        _, pending = await asyncio.wait(set(self._background), timeout=timeout)
+        if pending:
+            logger.warning("%d background jobs still running", len(pending))
+        return not pending
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Возвращает по классам: лимит, выполняющиеся и ожидающие задачи, счётчики
+        и перцентили времени ожидания в очереди.
+
+        Returns:
+            Словарь со статистикой (времена в миллисекундах)
+        """
+        stats = {}
+        for job_class, limit in self.limits.items():
+            queue_times = np.asarray(self._queue_times[job_class]) * 1000
+            p50, p95 = (
+                np.percentile(queue_times, [50, 95]) if len(queue_times) else (0, 0)
+            )
+            stats[job_class] = {
+                "limit": limit,
+                "running": self._running[job_class],
+                "queued": sum(not slot.done() for slot in self._waiting[job_class]),
+                "submitted": self._counters[job_class]["submitted"],
+                "completed": self._counters[job_class]["completed"],
+                "queue_p50_ms": float(p50),
+                "queue_p95_ms": float(p95),
+                "queue_max_ms": float(queue_times.max()) if len(queue_times) else 0.0,
+            }
+        return stats
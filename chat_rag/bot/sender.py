@@ -0,0 +1,324 @@
+"""
+Очередь исходящих сообщений бота.
+
+Обработчик ставит ответ в очередь и сразу освобождает слот обработки апдейта,
+а отправкой занимаются фоновые задачи:
+    - длинный ответ делится на части не длиннее лимита Telegram (4096 символов)
+      по абзацам, строкам или словам;
+    - сообщения одного чата уходят по порядку и не чаще одного в chat_interval
+      секунд, всего — не больше global_rate сообщений в секунду;
+    - на ответ 429 (flood wait) отправка приостанавливается на retry_after секунд
+      для всего бота (лимит Telegram общий), сообщение повторяется после паузы,
+      сетевые ошибки повторяются с экспоненциальной задержкой.
+
+Свободные задачи отправки не опрашивают очередь, а ждут ближайшего времени
+готовности чата или постановки нового чата.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит текст на части не длиннее limit: по границе абзаца, строки или слова,
+    ближайшей к лимиту; слово длиннее лимита режется.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit + 1)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+@dataclass
+class _Outgoing:
+    bot: Bot
+    chat_id: int
+    text: str
+    enqueued: float
+    attempts: int = 0
+
+
+class OutboundSender:
+    """
+    Отправка сообщений с ограничением частоты по чатам и в целом.
+
+    Args:
+        global_rate: Максимум сообщений в секунду на бота
+        chat_interval: Минимальный интервал между сообщениями одного чата, секунды
+        concurrency: Число одновременных запросов sendMessage
+        max_retries: Сколько раз повторять отправку после 429 или сетевой ошибки
+        window: Сколько последних задержек отправки хранить для перцентилей
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_interval: float = 1.0,
+        concurrency: int = 8,
+        max_retries: int = 5,
+        window: int = 1000,
+    ):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._chats: Dict[int, Deque[_Outgoing]] = {}
+        self._chat_ready_at: Dict[int, float] = {}
+        # Чаты с сообщениями в очереди, не занятые отправкой: куча
+        # (готов к, порядок, чат); свободные задачи ждут в _waiters
+        self._ready: List[Tuple[float, int, int]] = []
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._order = itertools.count()
+        self._global_lock = asyncio.Lock()
+        self._global_next = 0.0
+        self._workers: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._queued = 0
+        self._sending = 0
+        self._counters: Counter = Counter()
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+        logger.info(
+            "OutboundSender initialized: global_rate=%.1f/s, chat_interval=%.2fs, "
+            "concurrency=%d",
+            global_rate,
+            chat_interval,
+            concurrency,
+        )
+
+    async def start(self):
+        """Запускает задачи отправки."""
+        for index in range(self.concurrency - len(self._workers)):
+            task = asyncio.create_task(self._work(), name=f"sender-{index}")
+            self._workers.add(task)
+
+    async def stop(self):
+        """Останавливает задачи отправки; неотправленные сообщения теряются."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def send(self, bot: Bot, chat_id: int, text: str):
+        """
+        Ставит сообщение в очередь чата (длинное — несколькими частями)
+        и возвращается без ожидания отправки.
+        """
+        enqueued = time.monotonic()
+        queue = self._chats.get(chat_id)
+        idle_chat = queue is None
+        if idle_chat:
+            queue = self._chats[chat_id] = deque()
+        for part in split_message(text):
+            queue.append(_Outgoing(bot, chat_id, part, enqueued))
+            self._queued += 1
+            self._counters["enqueued"] += 1
+        self._idle.clear()
+        if idle_chat:
+            self._schedule(chat_id)
+
+    def reply(self, message: Message, text: str):
+        """Ставит в очередь ответ в чат сообщения message."""
+        self.send(message.bot, message.chat.id, text)
+
+    def _schedule(self, chat_id: int):
+        ready_at = self._chat_ready_at.pop(chat_id, 0.0)
+        heapq.heappush(self._ready, (ready_at, next(self._order), chat_id))
+        self._wake()
+
+    def _wake(self):
+        # Будит одну свободную задачу: она пересчитает ближайшее время готовности
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _next_chat(self) -> int:
+        """
+        Ждёт чат, готовый к отправке: до времени готовности первого чата в куче
+        или до постановки нового чата.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = None
+            if self._ready:
+                delay = self._ready[0][0] - time.monotonic()
+                if delay <= 0:
+                    _, _, chat_id = heapq.heappop(self._ready)
+                    if self._ready:
+                        # Следующий чат должен ждать кто-то из свободных задач
+                        self._wake()
+                    return chat_id
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, delay)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+
+    def _forget(self, chat_id: int):
+        # Интервал чата истёк, а новых сообщений нет — время готовности не нужно
+        if chat_id not in self._chats:
+            self._chat_ready_at.pop(chat_id, None)
+
+    async def _global_slot(self):
+        async with self._global_lock:
+            # Пока ждём, flood wait может отодвинуть _global_next ещё дальше
+            while (delay := self._global_next - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            self._global_next = time.monotonic() + 1 / self.global_rate
+
+    async def _work(self):
+        while True:
+            chat_id = await self._next_chat()
+            await self._global_slot()
+            item = self._chats[chat_id][0]
+            self._sending += 1
+            try:
+                delivered = await self._send(item)
+            finally:
+                self._sending -= 1
+            queue = self._chats[chat_id]
+            if delivered is not None:
+                queue.popleft()
+                self._queued -= 1
+            if queue:
+                self._schedule(chat_id)
+            else:
+                del self._chats[chat_id]
+                asyncio.get_running_loop().call_later(
+                    self.chat_interval, self._forget, chat_id
+                )
+                if not self._chats:
+                    self._idle.set()
+
+    async def _send(self, item: _Outgoing) -> Optional[bool]:
+        """
+        Одна попытка отправки. Возвращает True при успехе, False, если сообщение
+        отброшено, и None, если его нужно повторить (чат отложен).
+        """
+        item.attempts += 1
+        now = time.monotonic()
+        try:
+            await item.bot.send_message(item.chat_id, item.text)
+        except TelegramRetryAfter as e:
+            self._counters["flood_waits"] += 1
+            logger.warning(
+                "Flood wait for chat %d: retry after %ds", item.chat_id, e.retry_after
+            )
+            # Flood wait относится ко всему боту: остальные чаты тоже ждут
+            self._global_next = max(self._global_next, now + e.retry_after)
+            return self._retry(item, now + e.retry_after)
+        except TelegramNetworkError as e:
+            self._counters["network_errors"] += 1
+            logger.warning("Network error sending to chat %d: %s", item.chat_id, e)
+            return self._retry(item, now + min(2**item.attempts, 30))
+        except TelegramAPIError as e:
+            # Запрещено, чат не найден и т.п. — повтор не поможет
+            self._counters["failed"] += 1
+            logger.error("Cannot send message to chat %d: %s", item.chat_id, e)
+            return False
+        except Exception:
+            self._counters["failed"] += 1
+            logger.exception("Unexpected error sending to chat %d", item.chat_id)
+            return False
+        finished = time.monotonic()
+        self._chat_ready_at[item.chat_id] = finished + self.chat_interval
+        self._latencies.append(finished - item.enqueued)
+        self._counters["sent"] += 1
+        return True
+
+    def _retry(self, item: _Outgoing, ready_at: float) -> Optional[bool]:
+        if item.attempts > self.max_retries:
+            self._counters["failed"] += 1
+            logger.error(
+                "Dropping message to chat %d after %d attempts",
+                item.chat_id,
+                item.attempts,
+            )
+            return False
+        self._counters["retries"] += 1
+        self._chat_ready_at[item.chat_id] = ready_at
+        return None
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Ждёт отправки всех сообщений из очереди.
+
+        Returns:
+            True, если очередь опустела до таймаута
+        """
+        if self._idle.is_set():
+            return True
+        logger.info("Waiting for %d outgoing messages", self._queued)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d outgoing messages were not sent", self._queued)
+            return False
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает глубину очереди, счётчики отправок и перцентили задержки
+        от постановки в очередь до доставки.
+
+        Returns:
+            Словарь со статистикой (времена в миллисекундах)
+        """
+        latencies = np.asarray(self._latencies) * 1000
+        p50, p95 = np.percentile(latencies, [50, 95]) if len(latencies) else (0, 0)
+        return {
+            "queued": self._queued,
+            "chats_waiting": len(self._chats),
+            "sending": self._sending,
+            **{
+                key: self._counters[key]
+                for key in (
+                    "enqueued",
+                    "sent",
+                    "retries",
+                    "flood_waits",
+                    "network_errors",
+                    "failed",
+                )
+            },
+            "latency_p50_ms": float(p50),
+            "latency_p95_ms": float(p95),
+            "latency_max_ms": float(latencies.max()) if len(latencies) else 0.0,
+        }
@@ -0,0 +1 @@
+# devtools package
@@ -0,0 +1,57 @@
+"""
+Фейковая модель эмбеддингов для нагрузочных тестов без sentence-transformers.
+
+Векторы строятся из хэшей слов текста (одинаковые слова — близкие векторы),
+поэтому поиск по индексу остаётся осмысленным. Задержка вызова моделируется
+как EMBED_FAKE_LATENCY_MS на вызов плюс EMBED_FAKE_PER_TEXT_MS на каждый текст.
+
+Используется через EMBEDDINGS_BACKEND=hash.
+"""
+
+import hashlib
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Детерминированные эмбеддинги «мешка слов» на хэшах.
+    """
+
+    def __init__(
+        self,
+        dim: int = 384,
+        latency_ms: Optional[float] = None,
+        per_text_ms: Optional[float] = None,
+    ):
+        self.dim = dim
+        self.latency_ms = (
+            latency_ms
+            if latency_ms is not None
+            else float(os.getenv("EMBED_FAKE_LATENCY_MS", "5"))
+        )
+        self.per_text_ms = (
+            per_text_ms
+            if per_text_ms is not None
+            else float(os.getenv("EMBED_FAKE_PER_TEXT_MS", "1"))
+        )
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            seed = int.from_bytes(digest, "little")
+            vector += np.random.default_rng(seed).standard_normal(self.dim)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep((self.latency_ms + self.per_text_ms * len(texts)) / 1000)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,276 @@
+"""
+Фейковый OpenAI-совместимый сервер для проверки поведения бота при медленной
+или недоступной LLM (таймауты, хеджирование, circuit breaker).
+
+Реализует POST /v1/chat/completions (с вызовом инструментов агента, чтобы
+запрос проходил через ретривер) и служебные эндпоинты:
+    POST /_fake/config — изменить задержки и долю ошибок (JSON с полями ниже);
+    GET  /_fake/stats  — число принятых, обслуженных и проваленных запросов.
+
+Параметры поведения:
+    latency_ms — базовая задержка ответа;
+    slow_rate  — доля «медленных» ответов, slow_ms — их задержка;
+    error_rate — доля ответов с HTTP 500.
+
+Клиенты подключаются через OPENAI_BASE_URL=http://127.0.0.1:8082/v1
+(и любой OPENAI_API_KEY).
+
+Запуск:
+    python -m chat_rag.devtools.fake_openai --port 8082 --latency-ms 200 --slow-rate 0.05
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class FakeOpenAIServer:
+    """
+    Chat Completions API с настраиваемыми задержками и ошибками.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8082,
+        latency_ms: float = 100,
+        slow_rate: float = 0.0,
+        slow_ms: float = 10_000,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.stats: Dict[str, int] = {
+            "received": 0,
+            "served": 0,
+            "errors": 0,
+            "slow": 0,
+            "cancelled": 0,
+        }
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        """URL для OPENAI_BASE_URL."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def configure(self, **params: float):
+        """Меняет параметры поведения (latency_ms, slow_rate, slow_ms, error_rate)."""
+        for key, value in params.items():
+            if key not in ("latency_ms", "slow_rate", "slow_ms", "error_rate"):
+                raise ValueError(f"Unknown fake OpenAI parameter: {key}")
+            setattr(self, key, float(value))
+
+    def create_app(self) -> web.Application:
+        """Создает aiohttp-приложение сервера."""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._handle_chat)
+        app.router.add_post("/_fake/config", self._handle_config)
+        app.router.add_get("/_fake/stats", self._handle_stats)
+        return app
+
+    async def start(self):
+        """Запускает сервер."""
+        # Без handler_cancellation aiohttp дорабатывает обработчик после закрытия
+        # соединения клиентом, и отменённые запросы не были бы видны в stats
+        self._runner = web.AppRunner(self.create_app(), handler_cancellation=True)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        logger.info("Fake OpenAI API listening on %s", self.base_url)
+
+    async def stop(self):
+        """Останавливает сервер."""
+        if self._runner:
+            await self._runner.cleanup()
+
+    def make_reply(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сообщение модели. Для выбора курсов — список номеров. Если клиент передал
+        инструменты и результата инструмента ещё нет, модель вызывает инструменты
+        (несколько вызовов в одном ответе, как parallel tool calls OpenAI); иначе
+        отвечает эхом последнего сообщения пользователя.
+        """
+        messages = body.get("messages", [])
+        system = " ".join(
+            str(m.get("content", "")) for m in messages if m.get("role") == "system"
+        )
+        if "list[int]" in system:
+            return {"role": "assistant", "content": "[1, 2, 3, 4, 5]"}
+
+        last_user = max(
+            (i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1
+        )
+        question = str(messages[last_user].get("content", "")) if last_user >= 0 else ""
+        answered = any(
+            m.get("role") in ("function", "tool") for m in messages[last_user + 1 :]
+        )
+        tools = [t["function"]["name"] for t in body.get("tools", [])]
+        tools += [f["name"] for f in body.get("functions", [])]
+        if tools and not answered:
+            calls = [
+                {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}
+                for name, args in self._tool_calls(question, tools)
+            ]
+            if body.get("tools"):
+                return {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{next(self._ids)}",
+                            "type": "function",
+                            "function": call,
+                        }
+                        for call in calls
+                    ],
+                }
+            return {"role": "assistant", "content": None, "function_call": calls[0]}
+        return {"role": "assistant", "content": f"Ответ на вопрос: {question[:200]}"}
+
+    @staticmethod
+    def _tool_calls(question: str, tools: List[str]) -> List[Tuple[str, Dict]]:
+        """
+        Вызовы инструментов как у агента: подбор курсов, если вопрос про курсы;
+        факты — retriever по названной программе или параллельно по обеим.
+        """
+        lower = question.lower()
+        if "product" in lower:
+            programs = ["ai_product"]
+        elif "ai" in lower or "интеллект" in lower:
+            programs = ["ai"]
+        else:
+            programs = ["ai", "ai_product"]
+        calls: List[Tuple[str, Dict]] = []
+        if "courses_recommender" in tools and "курс" in lower:
+            calls.append(
+                (
+                    "courses_recommender",
+                    {
+                        "program": programs[0],
+                        "background": "разработчик",
+                        "interests": question[:100],
+                        "goals": "работа в ИИ",
+                    },
+                )
+            )
+        elif "retriever" in tools:
+            calls += [
+                ("retriever", {"query": question[:200], "program": program})
+                for program in programs
+            ]
+        else:
+            calls.append((tools[0], {}))
+        return calls
+
+    async def _handle_chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.stats["received"] += 1
+        delay_ms = self.latency_ms
+        if self._random.random() < self.slow_rate:
+            delay_ms = self.slow_ms
+            self.stats["slow"] += 1
+        try:
+            await asyncio.sleep(delay_ms / 1000)
+        except asyncio.CancelledError:
+            # Клиент закрыл соединение (таймаут или проигравший хедж)
+            self.stats["cancelled"] += 1
+            raise
+        if self._random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response(
+                {"error": {"message": "Fake upstream error", "type": "server_error"}},
+                status=500,
+            )
+        self.stats["served"] += 1
+        message = self.make_reply(body)
+        return web.json_response(
+            {
+                "id": f"chatcmpl-fake-{next(self._ids)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": (
+                            "tool_calls"
+                            if message.get("tool_calls")
+                            else (
+                                "function_call"
+                                if message.get("function_call")
+                                else "stop"
+                            )
+                        ),
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+        )
+
+    async def _handle_config(self, request: web.Request) -> web.Response:
+        try:
+            self.configure(**await request.json())
+        except (TypeError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response(
+            {
+                "latency_ms": self.latency_ms,
+                "slow_rate": self.slow_rate,
+                "slow_ms": self.slow_ms,
+                "error_rate": self.error_rate,
+            }
+        )
+
+    async def _handle_stats(self, _: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+async def _serve(args: argparse.Namespace):
+    server = FakeOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        error_rate=args.error_rate,
+    )
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=10_000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,265 @@
+"""
+Фейковый Telegram Bot API сервер для локальной end-to-end проверки бота.
+
+Реализует минимальный набор методов Bot API (getMe, setWebhook, deleteWebhook,
+getUpdates, sendMessage) и служебные эндпоинты:
+    POST /_fake/updates — отправить апдейт (JSON) на зарегистрированный webhook;
+    GET  /_fake/sent    — список сообщений, отправленных ботом.
+
+Лимиты Telegram моделируются по желанию: sendMessage отвечает 429 (flood wait)
+с вероятностью flood_rate или если сообщения в чат идут чаще chat_interval_s,
+а текст длиннее 4096 символов отклоняется, как в настоящем API.
+
+Бот подключается к серверу через переменную окружения TELEGRAM_API_URL,
+например TELEGRAM_API_URL=http://127.0.0.1:8081.
+
+Запуск:
+    python -m chat_rag.devtools.fake_telegram --port 8081
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class FakeTelegramServer:
+    """
+    In-memory реализация Bot API, достаточная для работы aiogram-бота.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        latency_ms: float = 0,
+        on_message: Optional[Callable[[Dict[str, Any]], None]] = None,
+        flood_rate: float = 0.0,
+        chat_interval_s: float = 0.0,
+        retry_after_s: int = 1,
+        seed: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        # Задержка ответа на каждый вызов Bot API
+        self.latency_ms = latency_ms
+        # Вызывается для каждого сообщения, отправленного ботом
+        self.on_message = on_message
+        # Доля sendMessage, получающих 429, и минимальный интервал сообщений в чат
+        self.flood_rate = flood_rate
+        self.chat_interval_s = chat_interval_s
+        self.retry_after_s = retry_after_s
+        self.flood_responses = 0
+        self.rejected_long = 0
+        self._rng = random.Random(seed)
+        self._last_sent: Dict[int, float] = {}
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.sent_messages: List[Dict[str, Any]] = []
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self._client: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def base_url(self) -> str:
+        """URL для TELEGRAM_API_URL."""
+        return f"http://{self.host}:{self.port}"
+
+    def create_app(self) -> web.Application:
+        """Создает aiohttp-приложение сервера."""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        app.router.add_post("/_fake/updates", self._handle_push_update)
+        app.router.add_get("/_fake/sent", self._handle_sent)
+        return app
+
+    async def start(self):
+        """Запускает сервер."""
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        self._client = aiohttp.ClientSession()
+        logger.info("Fake Telegram API listening on %s", self.base_url)
+
+    async def stop(self):
+        """Останавливает сервер."""
+        if self._client:
+            await self._client.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    def make_message_update(
+        self, user_id: int, text: str, chat_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Формирует апдейт с текстовым сообщением от пользователя.
+
+        Args:
+            user_id: ID пользователя
+            text: Текст сообщения
+            chat_id: ID чата (по умолчанию совпадает с user_id)
+
+        Returns:
+            Словарь в формате Update
+        """
+        chat_id = chat_id or user_id
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                "text": text,
+            },
+        }
+
+    async def push_update(self, update: Dict[str, Any]) -> int:
+        """
+        Отправляет апдейт на зарегистрированный webhook.
+
+        Returns:
+            HTTP-статус ответа бота
+        """
+        if not self.webhook_url or not self._client:
+            raise RuntimeError("Webhook is not set")
+        headers = {}
+        if self.webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+        async with self._client.post(
+            self.webhook_url, json=update, headers=headers
+        ) as response:
+            return response.status
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params: Dict[str, Any] = dict(await request.post())
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if method.lower() == "sendmessage":
+            error = self._check_send_limits(params)
+            if error is not None:
+                return error
+        handler = getattr(self, f"_api_{method.lower()}", None)
+        if handler is None:
+            logger.warning("Unsupported fake Bot API method: %s", method)
+            return web.json_response(
+                {"ok": False, "error_code": 400, "description": "Unsupported method"},
+                status=400,
+            )
+        return web.json_response({"ok": True, "result": await handler(params)})
+
+    def _check_send_limits(self, params: Dict[str, Any]) -> Optional[web.Response]:
+        if len(str(params.get("text", ""))) > 4096:
+            self.rejected_long += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: message is too long",
+                },
+                status=400,
+            )
+        chat_id = int(params["chat_id"])
+        now = time.monotonic()
+        retry_after = 0
+        since_last = now - self._last_sent.get(chat_id, -math.inf)
+        if since_last < self.chat_interval_s:
+            retry_after = math.ceil(self.chat_interval_s - since_last)
+        elif self.flood_rate and self._rng.random() < self.flood_rate:
+            retry_after = self.retry_after_s
+        if retry_after:
+            self.flood_responses += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                },
+                status=429,
+            )
+        self._last_sent[chat_id] = now
+        return None
+
+    async def _handle_push_update(self, request: web.Request) -> web.Response:
+        update = await request.json()
+        if "update_id" not in update:
+            update = self.make_message_update(
+                int(update["user_id"]), str(update["text"])
+            )
+        status = await self.push_update(update)
+        return web.json_response({"status": status})
+
+    async def _handle_sent(self, _: web.Request) -> web.Response:
+        return web.json_response(self.sent_messages)
+
+    async def _api_getme(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": 1,
+            "is_bot": True,
+            "first_name": "Fake",
+            "username": "fake_bot",
+        }
+
+    async def _api_setwebhook(self, params: Dict[str, Any]) -> bool:
+        self.webhook_url = params.get("url")
+        self.webhook_secret = params.get("secret_token")
+        logger.info("Webhook set: %s", self.webhook_url)
+        return True
+
+    async def _api_deletewebhook(self, params: Dict[str, Any]) -> bool:
+        self.webhook_url = None
+        return True
+
+    async def _api_getupdates(self, params: Dict[str, Any]) -> List[Any]:
+        # Апдейты доставляются только через webhook; long polling просто ждёт
+        await asyncio.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+        return []
+
+    async def _api_sendmessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+        self.sent_messages.append(message)
+        if self.on_message:
+            self.on_message(message)
+        return message
+
+
+async def _serve(host: str, port: int, flood_rate: float, chat_interval_s: float):
+    server = FakeTelegramServer(
+        host=host, port=port, flood_rate=flood_rate, chat_interval_s=chat_interval_s
+    )
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--chat-interval-s", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(_serve(args.host, args.port, args.flood_rate, args.chat_interval_s))
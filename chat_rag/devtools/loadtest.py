@@ -0,0 +1,453 @@
+"""
+Нагрузочный тест бота end-to-end.
+
+Запускает настоящий Dispatcher (create_dispatcher: ConcurrencyLimitMiddleware,
+DialogHistoryMiddleware, router, пул процессов при RAG_WORKERS > 0) и подаёт в него
+апдейты от множества симулированных пользователей, как это делает polling.
+Внешние сервисы заменены локальными:
+    Telegram     — FakeTelegramServer (задержка --telegram-latency-ms);
+    OpenAI       — FakeOpenAIServer (--openai-latency-ms, --openai-slow-rate);
+    эмбеддинги   — HashEmbeddings (--embed-latency-ms).
+
+Каждый пользователь задаёт вопрос, ждёт ответа, «думает» (экспоненциальное время
+со средним --think-s) и задаёт следующий. Вопросы — из FAQ в чанках программ,
+часть — запросы на подбор курсов.
+
+Отчёт: пропускная способность, перцентили задержки ответа, время ожидания
+в очереди (от получения апдейта до начала обработки) и рост RSS по времени.
+
+Запуск:
+    python -m chat_rag.devtools.loadtest --users 2000 --duration 120 --ramp-s 30
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from chat_rag.rag.logging_setup import setup_logging
+from chat_rag.rag.memory_profile import rss_bytes
+from chat_rag.rag.singleflight import get_singleflight_stats
+
+logger = logging.getLogger(__name__)
+
+BOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+RECOMMEND_QUESTIONS = [
+    "Посоветуй курсы: я бэкенд-разработчик, интересуюсь NLP, хочу стать ML-инженером",
+    "Какие курсы выбрать аналитику данных, который хочет в AI product management?",
+    "Подбери курсы по компьютерному зрению для выпускника физфака",
+]
+
+
+def total_rss_bytes() -> int:
+    """RSS процесса теста и его worker-процессов."""
+    pids = [os.getpid()] + [p.pid for p in multiprocessing.active_children()]
+    return sum(rss_bytes(pid) for pid in pids)
+
+
+def load_question_mix(recommend_share: float) -> Callable[[random.Random], str]:
+    """
+    Возвращает генератор вопросов: FAQ из чанков всех программ и, с долей
+    recommend_share, запросы на подбор курсов.
+    """
+    from chat_rag.rag.programs import get_registry
+
+    registry = get_registry()
+    questions: List[str] = []
+    for code in registry.codes():
+        for doc in registry.load_documents(code):
+            if doc.page_content.startswith("Q: "):
+                questions.append(doc.page_content[3:].split("\nA:")[0])
+    if not questions:
+        questions = ["Сколько стоит обучение?", "Какие вступительные испытания?"]
+
+    def pick(rng: random.Random) -> str:
+        if rng.random() < recommend_share:
+            return rng.choice(RECOMMEND_QUESTIONS)
+        return rng.choice(questions)
+
+    return pick
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p90/p95/p99/max в миллисекундах."""
+    if not values:
+        return {"p50": None, "p90": None, "p95": None, "p99": None, "max": None}
+    data = np.asarray(values) * 1000
+    p50, p90, p95, p99 = np.percentile(data, [50, 90, 95, 99])
+    return {
+        "p50": float(p50),
+        "p90": float(p90),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(data.max()),
+    }
+
+
+class LoadTest:
+    """
+    Симуляция пользователей и сбор метрик.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.started = 0.0
+        self.sent = 0
+        self.replied = 0
+        self.timeouts = 0
+        self.degraded = 0
+        self.active_users = 0
+        self.latencies: List[float] = []
+        self.queue_delays: List[float] = []
+        self.timeline: List[Dict[str, Any]] = []
+        self._fed_at: Dict[int, float] = {}
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._window_latencies: List[float] = []
+        self._window_queue: List[float] = []
+        self._window_replies = 0
+        # Промежуточные ответы (подтверждение подбора курсов) — не ответ на вопрос
+        self.ack_texts: Set[str] = set()
+
+    def on_message(self, message: Dict[str, Any]):
+        """Ответ бота дошёл до фейкового Telegram."""
+        if message.get("text") in self.ack_texts:
+            return
+        waiter = self._waiters.pop(message["chat"]["id"], None)
+        if waiter and not waiter.done():
+            waiter.set_result(message.get("text", ""))
+
+    async def queue_probe(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        """
+        Outer middleware после ConcurrencyLimitMiddleware: вызывается, когда апдейт
+        получил слот обработки.
+        """
+        fed_at = self._fed_at.pop(event.update_id, None)
+        if fed_at is not None:
+            delay = time.monotonic() - fed_at
+            self.queue_delays.append(delay)
+            self._window_queue.append(delay)
+        return await handler(event, data)
+
+    async def ask(
+        self, dp: Any, bot: Any, telegram: Any, user_id: int, text: str
+    ) -> Optional[str]:
+        """Отправляет вопрос пользователя и ждёт ответа."""
+        from aiogram.types import Update
+
+        update = telegram.make_message_update(user_id, text)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[user_id] = waiter
+        fed_at = time.monotonic()
+        self._fed_at[update["update_id"]] = fed_at
+        self.sent += 1
+        # Как при polling: каждый апдейт обрабатывается отдельной задачей
+        asyncio.create_task(
+            dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+        )
+        try:
+            reply = await asyncio.wait_for(waiter, self.args.reply_timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(user_id, None)
+            self.timeouts += 1
+            return None
+        latency = time.monotonic() - fed_at
+        self.replied += 1
+        self._window_replies += 1
+        self.latencies.append(latency)
+        self._window_latencies.append(latency)
+        return reply
+
+    async def user_loop(
+        self,
+        dp: Any,
+        bot: Any,
+        telegram: Any,
+        user_id: int,
+        pick_question: Callable[[random.Random], str],
+        deadline: float,
+        degraded_answer: str,
+    ):
+        rng = random.Random(self.rng.random())
+        # Равномерный набор пользователей за ramp_s
+        await asyncio.sleep(rng.uniform(0, self.args.ramp_s))
+        self.active_users += 1
+        try:
+            while time.monotonic() < deadline:
+                reply = await self.ask(dp, bot, telegram, user_id, pick_question(rng))
+                if reply == degraded_answer:
+                    self.degraded += 1
+                await asyncio.sleep(rng.expovariate(1 / self.args.think_s))
+        finally:
+            self.active_users -= 1
+
+    async def reporter(self, telegram: Any, concurrency: Any, stop: asyncio.Event):
+        print(
+            f"{'t_s':>6} {'users':>6} {'in_fl':>6} {'rps':>7} {'p50_ms':>8} "
+            f"{'p95_ms':>8} {'q95_ms':>8} {'rss_mb':>8}"
+        )
+        last = time.monotonic()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.report_every)
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            lat = percentiles(self._window_latencies)
+            queue = percentiles(self._window_queue)
+            point = {
+                "t_s": now - self.started,
+                "active_users": self.active_users,
+                "in_flight": self.sent - self.replied - self.timeouts,
+                "handlers_in_flight": concurrency.in_flight,
+                "rps": self._window_replies / max(now - last, 1e-9),
+                "latency_p50_ms": lat["p50"],
+                "latency_p95_ms": lat["p95"],
+                "queue_p95_ms": queue["p95"],
+                "rss_mb": total_rss_bytes() / 2**20,
+            }
+            self.timeline.append(point)
+            print(
+                f"{point['t_s']:>6.0f} {point['active_users']:>6} "
+                f"{point['in_flight']:>6} {point['rps']:>7.2f} "
+                f"{lat['p50'] or 0:>8.0f} {lat['p95'] or 0:>8.0f} "
+                f"{queue['p95'] or 0:>8.0f} {point['rss_mb']:>8.1f}",
+                flush=True,
+            )
+            self._window_latencies.clear()
+            self._window_queue.clear()
+            self._window_replies = 0
+            # Журнал фейкового Telegram не должен искажать замер памяти
+            telegram.sent_messages.clear()
+            last = now
+
+    def summary(self, elapsed: float, rss_start: int) -> Dict[str, Any]:
+        return {
+            "users": self.args.users,
+            "duration_s": elapsed,
+            "sent": self.sent,
+            "replied": self.replied,
+            "timeouts": self.timeouts,
+            "degraded": self.degraded,
+            "throughput_rps": self.replied / elapsed if elapsed else 0.0,
+            "latency_ms": percentiles(self.latencies),
+            "queue_delay_ms": percentiles(self.queue_delays),
+            "rss_start_mb": rss_start / 2**20,
+            "rss_peak_mb": max(
+                [p["rss_mb"] for p in self.timeline] + [rss_start / 2**20]
+            ),
+            "rss_end_mb": total_rss_bytes() / 2**20,
+            # Только процесс бота; при RAG_WORKERS счётчики в worker-процессах
+            "singleflight": get_singleflight_stats(),
+            "timeline": self.timeline,
+        }
+
+
+def _configure_environment(
+    args: argparse.Namespace, telegram_url: str, openai_url: str
+):
+    # Значения окружения читаются при импорте config и создании моделей
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:LOADTEST"
+    os.environ["TELEGRAM_API_URL"] = telegram_url
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ["OPENAI_API_KEY"] = "loadtest"
+    os.environ["EMBEDDINGS_BACKEND"] = "hash"
+    os.environ["EMBED_FAKE_LATENCY_MS"] = str(args.embed_latency_ms)
+    os.environ.setdefault(
+        "RETRIEVER_INDEX_DIR", os.path.join(tempfile.gettempdir(), "loadtest-index")
+    )
+    if args.workers is not None:
+        os.environ["RAG_WORKERS"] = str(args.workers)
+    if args.max_concurrency is not None:
+        os.environ["MAX_CONCURRENT_UPDATES"] = str(args.max_concurrency)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from chat_rag.devtools.fake_openai import FakeOpenAIServer
+    from chat_rag.devtools.fake_telegram import FakeTelegramServer
+
+    test = LoadTest(args)
+    telegram = FakeTelegramServer(
+        port=args.telegram_port,
+        latency_ms=args.telegram_latency_ms,
+        on_message=test.on_message,
+        flood_rate=args.telegram_flood_rate,
+        chat_interval_s=args.telegram_chat_interval_s,
+        seed=args.seed,
+    )
+    openai = FakeOpenAIServer(
+        port=args.openai_port,
+        latency_ms=args.openai_latency_ms,
+        slow_rate=args.openai_slow_rate,
+        slow_ms=args.openai_slow_ms,
+        seed=args.seed,
+    )
+    _configure_environment(args, telegram.base_url, openai.base_url)
+    await telegram.start()
+    await openai.start()
+
+    # Модули бота импортируются как в chat_rag/bot/bot.py (плоские импорты)
+    sys.path.insert(0, BOT_DIR)
+    import bot as bot_module
+    import handlers
+    from chat_rag.rag.programs import get_registry
+    from chat_rag.rag.rag_agent import degraded_answer
+
+    bot = bot_module.create_bot()
+    dp = bot_module.create_dispatcher()
+    dp.update.outer_middleware(test.queue_probe)
+    pick_question = load_question_mix(args.recommend_share)
+    test.ack_texts.add(handlers.PLAN_ACK)
+
+    try:
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        # Прогрев: индексы программ и соединения строятся до начала замера
+        for i, code in enumerate(get_registry().codes()):
+            await test.ask(dp, bot, telegram, -1 - i, f"Что за программа {code}?")
+        test.sent = test.replied = test.timeouts = 0
+        test.latencies.clear()
+        test.queue_delays.clear()
+
+        rss_start = total_rss_bytes()
+        test.started = time.monotonic()
+        deadline = test.started + args.ramp_s + args.duration
+        stop = asyncio.Event()
+        degraded = degraded_answer()
+        reporter = asyncio.create_task(test.reporter(telegram, dp["concurrency"], stop))
+        await asyncio.gather(
+            *(
+                test.user_loop(
+                    dp, bot, telegram, user_id, pick_question, deadline, degraded
+                )
+                for user_id in range(1, args.users + 1)
+            )
+        )
+        stop.set()
+        await reporter
+        result = test.summary(time.monotonic() - test.started, rss_start)
+        result["scheduler"] = dp["scheduler"].get_stats()
+        result["sender"] = dp["sender"].get_stats()
+        result["sender"]["flood_responses"] = telegram.flood_responses
+        if not dp.get("rag_pool"):
+            from chat_rag.rag import rag_agent
+
+            retriever = rag_agent.memory_report().get("retriever")
+            if retriever:
+                result["query_cache"] = retriever["query_cache"]
+        return result
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        await openai.stop()
+        await telegram.stop()
+
+
+def print_summary(result: Dict[str, Any]):
+    lat, queue = result["latency_ms"], result["queue_delay_ms"]
+    print()
+    print(
+        f"users={result['users']} duration={result['duration_s']:.0f}s "
+        f"sent={result['sent']} replied={result['replied']} "
+        f"timeouts={result['timeouts']} degraded={result['degraded']}"
+    )
+    print(f"throughput: {result['throughput_rps']:.2f} replies/s")
+    for title, values in (("latency", lat), ("queue delay", queue)):
+        print(
+            f"{title}, ms: "
+            + " ".join(
+                f"{key}={value:.0f}" if value is not None else f"{key}=-"
+                for key, value in values.items()
+            )
+        )
+    print(
+        f"rss, MB: start={result['rss_start_mb']:.1f} "
+        f"peak={result['rss_peak_mb']:.1f} end={result['rss_end_mb']:.1f}"
+    )
+    for job_class, stats in result.get("scheduler", {}).items():
+        print(
+            f"scheduler {job_class}: jobs={stats['completed']} "
+            f"queue p50={stats['queue_p50_ms']:.0f} p95={stats['queue_p95_ms']:.0f} "
+            f"max={stats['queue_max_ms']:.0f} ms"
+        )
+    sender = result.get("sender")
+    if sender:
+        print(
+            f"sender: sent={sender['sent']} flood_waits={sender['flood_waits']} "
+            f"retries={sender['retries']} failed={sender['failed']} "
+            f"queued={sender['queued']} latency p50={sender['latency_p50_ms']:.0f} "
+            f"p95={sender['latency_p95_ms']:.0f} max={sender['latency_max_ms']:.0f} ms"
+        )
+    for name, stats in result["singleflight"].items():
+        print(
+            f"single-flight {name}: calls={stats['calls']} "
+            f"executed={stats['executed']} coalesced={stats['coalesced']}"
+        )
+    query_cache = result.get("query_cache")
+    if query_cache:
+        print(
+            f"query embedding cache: hits={query_cache['hits']} "
+            f"misses={query_cache['misses']} "
+            f"hit_rate={query_cache['hit_rate']:.0%} "
+            f"entries={query_cache['entries']}"
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="End-to-end load test of the bot")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--duration", type=float, default=60, help="секунд после набора"
+    )
+    parser.add_argument("--ramp-s", type=float, default=10)
+    parser.add_argument("--think-s", type=float, default=20, help="среднее время паузы")
+    parser.add_argument("--recommend-share", type=float, default=0.05)
+    parser.add_argument("--reply-timeout", type=float, default=120)
+    parser.add_argument("--openai-latency-ms", type=float, default=800)
+    parser.add_argument("--openai-slow-rate", type=float, default=0.0)
+    parser.add_argument("--openai-slow-ms", type=float, default=10_000)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument(
+        "--telegram-flood-rate", type=float, default=0.0, help="доля ответов 429"
+    )
+    parser.add_argument(
+        "--telegram-chat-interval-s",
+        type=float,
+        default=0.0,
+        help="429 на сообщения в чат чаще этого интервала",
+    )
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--workers", type=int, help="RAG_WORKERS (по умолчанию из env)")
+    parser.add_argument("--max-concurrency", type=int, help="MAX_CONCURRENT_UPDATES")
+    parser.add_argument("--report-every", type=float, default=5)
+    parser.add_argument("--telegram-port", type=int, default=18081)
+    parser.add_argument("--openai-port", type=int, default=18082)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить результат в JSON-файл")
+    args = parser.parse_args(argv)
+
+    # Логи бота перемешиваются с отчётом; setup_logging в bot.py станет no-op
+    setup_logging(level=os.getenv("LOG_LEVEL", "WARNING"))
+    result = asyncio.run(run(args))
+    print_summary(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Служебные команды процесса с агентом.
+
+Команды выполняются и в процессе бота, и в worker-процессах пула
+(см. ShardedWorkerPool.run_command): профилирование памяти (memory_profile)
+и перезагрузка базы знаний (rag_agent.reload_knowledge_base).
+"""
+
+import os
+from typing import Any, Callable, Dict
+
+from chat_rag.rag.memory_profile import memory_report, tracer
+
+
+def reload_knowledge_base() -> Dict[str, Any]:
+    """Перезагрузка базы знаний процесса (см. rag_agent.reload_knowledge_base)."""
+    from chat_rag.rag import rag_agent
+
+    return rag_agent.reload_knowledge_base()
+
+
+COMMANDS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "report": memory_report,
+    "trace_start": tracer.start,
+    "trace_diff": tracer.diff,
+    "trace_stop": tracer.stop,
+    "reload": reload_knowledge_base,
+}
+
+
+def run_command(name: str) -> Dict[str, Any]:
+    """
+    Выполняет служебную команду: профилирование памяти (report, trace_start,
+    trace_diff, trace_stop) или перезагрузку базы знаний (reload).
+
+    Raises:
+        ValueError: если команда неизвестна
+    """
+    if name not in COMMANDS:
+        raise ValueError(f"Unknown command: {name}")
+    return {"pid": os.getpid(), **COMMANDS[name]()}
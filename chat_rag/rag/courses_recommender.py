@@ -1,21 +1,28 @@
+import asyncio
 import json
 import logging
 import os
-from typing import Any, Dict, List, Union, ClassVar, Type, Literal
+from typing import Any, Dict, List, Optional, Union, ClassVar, Type
 
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.tools import BaseTool
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import BaseModel, PrivateAttr
 
-
-CHUNKS_DIR = "data/chunks"
-ai_courses_chunks = os.path.join(CHUNKS_DIR, "ai_courses_chunks.json")
-ai_product_courses_chunks = os.path.join(CHUNKS_DIR, "ai_product_courses_chunks.json")
+from chat_rag.rag.llm_guard import GuardedChatOpenAI, LLMUnavailableError
+from chat_rag.rag.logging_setup import SAMPLED
+from chat_rag.rag.programs import (
+    LazyProgramCache,
+    ProgramCode,
+    ProgramRegistry,
+    deep_sizeof,
+    get_registry,
+    validate_program,
+)
+from chat_rag.rag.singleflight import get_group, normalize_query
 
 
 class CoursesRecommenderInput(BaseModel):
-    program: Literal["ai", "ai_product"]
+    program: ProgramCode
     background: str
     interests: str
     goals: str
@@ -32,50 +39,85 @@ class CoursesRecommender(BaseTool):
         "Рекомендует программу обучения из курсов ИТМО на основе профиля абитуриента"
     )
     args_schema: ClassVar[Type[BaseModel]] = CoursesRecommenderInput  # <-- ВАЖНО
-    courses: List[Dict[str, Any]] = Field(default_factory=list)
     _llm: Any = PrivateAttr(default=None)
     _logger: logging.Logger = PrivateAttr()
+    _registry: Any = PrivateAttr(default=None)
+    _catalog: Any = PrivateAttr(default=None)
 
-    def __init__(self):
+    def __init__(
+        self,
+        registry: Optional[ProgramRegistry] = None,
+        memory_budget_mb: Optional[int] = None,
+    ):
         super().__init__()
-        self._llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0.0)
-        self._logger = logging.getLogger("CoursesRecommender")
-        if not self._logger.hasHandlers():
-            logging.basicConfig(level=logging.INFO)
+        self._llm = GuardedChatOpenAI(model="gpt-4.1-nano", temperature=0.0)
+        self._logger = logging.getLogger(__name__)
         self._logger.info("Инициализация CoursesRecommender")
-        self.load_courses()
+        self._registry = registry or get_registry()
+        # Каталог курсов программы загружается при первом запросе рекомендаций
+        budget_mb = memory_budget_mb or int(os.getenv("COURSES_MEMORY_BUDGET_MB", "64"))
+        self._catalog = self._make_cache(budget_mb * 2**20)
+
+    def _make_cache(self, budget_bytes: int) -> LazyProgramCache:
+        return LazyProgramCache(
+            "CoursesRecommender",
+            loader=self.load_courses,
+            sizer=deep_sizeof,
+            budget_bytes=budget_bytes,
+        )
+
+    def reloaded(self, registry: ProgramRegistry) -> "CoursesRecommender":
+        """
+        Копия инструмента с каталогами курсов из нового реестра (клиент LLM общий).
+        Каталоги программ, загруженных сейчас, читаются заранее.
+        """
+        tool = self.model_copy()
+        tool._registry = registry
+        tool._catalog = tool._make_cache(self._catalog.budget_bytes)
+        for program, _ in self._catalog.items():
+            if program in registry.codes():
+                tool._catalog.get(program)
+        return tool
+
+    def load_courses(self, program: str) -> List[Dict[str, Any]]:
+        """
+        Загружает курсы программы из <program>_courses_chunks.json.
+        """
+        try:
+            courses = self._registry.load_courses(program)
+            self._logger.info(
+                "Загружено %d курсов программы '%s'", len(courses), program
+            )
+            return courses
+        except (OSError, json.JSONDecodeError, AssertionError) as e:
+            self._logger.error(
+                "Ошибка при загрузке курсов программы '%s': %s", program, e
+            )
+            return []
 
-    def load_courses(self):
+    def memory_report(self) -> Dict[str, Any]:
         """
-        Загружает все курсы из ai_courses_chunks.json и ai_product_courses_chunks.json.
+        Размеры загруженных каталогов курсов.
+
+        Returns:
+            Словарь с размерами в байтах
         """
-        chunk_files = [ai_courses_chunks, ai_product_courses_chunks]
-        for fpath in chunk_files:
-            try:
-                with open(fpath, encoding="utf-8") as f:
-                    data = json.load(f)
-                    assert isinstance(
-                        data, list
-                    ), "Неверный формат данных. Должен быть список."
-                    for item in data:
-                        assert (
-                            isinstance(item, dict) and "name" in item
-                        ), "Неверный формат данных. Каждый элемент должен быть словарем с ключом 'name'."
-                        self.courses.append(item)
-                self._logger.info(f"Загружено {len(data)} курсов из {fpath}")
-            except (OSError, json.JSONDecodeError, AssertionError) as e:
-                self._logger.error(f"Ошибка при загрузке {fpath}: {e}")
+        return {"catalog": self._catalog.get_stats()}
 
     def filter_courses_by_program(self, program: str) -> List[Dict[str, Any]]:
         """
-        Фильтрует курсы по программе обучения.
+        Возвращает курсы программы обучения.
         """
-        assert program in ["ai", "ai_product"], "Неверная программа обучения"
+        validate_program(program)
         filtered = [
-            course for course in self.courses if course.get("program") == program
+            course
+            for course in self._catalog.get(program)
+            if course.get("program") == program
         ]
-        self._logger.info(
-            f"Фильтрация курсов по программе '{program}': найдено {len(filtered)} курсов"
+        self._logger.debug(
+            "Фильтрация курсов по программе '%s': найдено %d курсов",
+            program,
+            len(filtered),
         )
         return filtered
 
@@ -88,8 +130,8 @@ class CoursesRecommender(BaseTool):
         filtered = [
             course for course in courses if semester in course.get("semesters", [])
         ]
-        self._logger.info(
-            f"Курсы для семестра {semester}: найдено {len(filtered)} курсов"
+        self._logger.debug(
+            "Курсы для семестра %d: найдено %d курсов", semester, len(filtered)
         )
         return filtered
 
@@ -105,12 +147,14 @@ class CoursesRecommender(BaseTool):
         """
         Выбирает 5 лучших курсов для семестра с помощью LLM.
         """
-        self._logger.info(
-            f"Выбор курсов для семестра {semester}. Кандидатов: {len(candidate_courses)}"
+        self._logger.debug(
+            "Выбор курсов для семестра %d. Кандидатов: %d",
+            semester,
+            len(candidate_courses),
         )
         if len(candidate_courses) <= 5:
-            self._logger.info(
-                f"Кандидатов <= 5, возвращаем все курсы для семестра {semester}"
+            self._logger.debug(
+                "Кандидатов <= 5, возвращаем все курсы для семестра %d", semester
             )
             return candidate_courses
 
@@ -148,7 +192,7 @@ class CoursesRecommender(BaseTool):
 """
 
         try:
-            self._logger.info(f"Отправка запроса LLM для семестра {semester}")
+            self._logger.debug("Отправка запроса LLM для семестра %d", semester)
             response = self._llm.invoke(
                 [
                     SystemMessage(content=system_prompt),
@@ -159,7 +203,7 @@ class CoursesRecommender(BaseTool):
             response_text = (
                 response.content if hasattr(response, "content") else str(response)
             )
-            self._logger.info(f"Ответ LLM: {response_text}")
+            self._logger.debug("Ответ LLM: %s", response_text)
             # Ожидаем ответ строго в формате Python: list[int]
             import ast
 
@@ -174,13 +218,17 @@ class CoursesRecommender(BaseTool):
                             ):
                                 selected_indices.append(idx - 1)
                 except (SyntaxError, ValueError) as e:
-                    self._logger.error(f"Ошибка парсинга ответа LLM: {e}")
+                    self._logger.error("Ошибка парсинга ответа LLM: %s", e)
 
-            self._logger.info(f"Выбраны индексы курсов: {selected_indices}")
+            self._logger.debug("Выбраны индексы курсов: %s", selected_indices)
             return [candidate_courses[i] for i in selected_indices[:5]]
 
+        except LLMUnavailableError as e:
+            self._logger.warning("LLM недоступна, берём первые 5 курсов: %s", e)
+            self._llm.guard.count("fallback_degraded")
+            return candidate_courses[:5]
         except (ValueError, TypeError, AttributeError) as e:
-            self._logger.error(f"Ошибка при выборе курсов: {e}")
+            self._logger.error("Ошибка при выборе курсов: %s", e)
             # Возвращаем первые 5 курсов как fallback
             return candidate_courses[:5]
 
@@ -191,13 +239,19 @@ class CoursesRecommender(BaseTool):
         Строит программу обучения из 5 курсов на каждый из 4 семестров.
         """
         # Фильтруем курсы по программе
+        # Профиль абитуриента не логируется: только программа и размер входных данных
         self._logger.info(
-            f"Строим программу обучения: program={program}, background={background}, interests={interests}, goals={goals}"
+            "Строим программу обучения",
+            extra={
+                "program": program,
+                "profile_chars": len(background) + len(interests) + len(goals),
+                **SAMPLED,
+            },
         )
         program_courses = self.filter_courses_by_program(program)
 
         if not program_courses:
-            self._logger.error(f"Курсы для программы {program} не найдены")
+            self._logger.error("Курсы для программы %s не найдены", program)
             return {"error": f"Курсы для программы {program} не найдены"}
 
         learning_program: Dict[str, List[Dict[str, Any]]] = {}
@@ -205,14 +259,14 @@ class CoursesRecommender(BaseTool):
 
         # Для каждого семестра выбираем 5 курсов
         for semester in range(1, 5):
-            self._logger.info(f"Обработка семестра {semester}")
+            self._logger.debug("Обработка семестра %d", semester)
             # Получаем курсы для текущего семестра
             semester_candidates = self.get_courses_for_semester(
                 program_courses, semester
             )
 
             if not semester_candidates:
-                self._logger.info(f"Нет доступных курсов для семестра {semester}")
+                self._logger.debug("Нет доступных курсов для семестра %d", semester)
                 learning_program[f"semester_{semester}"] = []
                 continue
 
@@ -226,8 +280,10 @@ class CoursesRecommender(BaseTool):
                 semester=semester,
             )
 
-            self._logger.info(
-                f"Выбрано {len(selected_for_semester)} курсов для семестра {semester}"
+            self._logger.debug(
+                "Выбрано %d курсов для семестра %d",
+                len(selected_for_semester),
+                semester,
             )
             learning_program[f"semester_{semester}"] = selected_for_semester
             selected_courses.extend(selected_for_semester)
@@ -239,7 +295,6 @@ class CoursesRecommender(BaseTool):
         Основная функция tool'а - строит рекомендованную программу обучения.
         """
         try:
-            self._logger.info(f"Вызов _run с аргументами: {kwargs}")
             # Извлекаем параметры из kwargs
             program = kwargs.get("program", "")
             background = kwargs.get("background", "")
@@ -250,13 +305,20 @@ class CoursesRecommender(BaseTool):
                 self._logger.error("Ошибка: не все параметры заполнены")
                 return "Ошибка: все параметры (program, background, interests, goals) должны быть заполнены"
 
-            # Строим программу обучения
-            learning_program = self.build_learning_program(
-                program, background, interests, goals
+            # Строим программу обучения; одинаковые одновременные запросы
+            # разделяют одно построение (4 вызова LLM)
+            key = (program,) + tuple(
+                normalize_query(value) for value in (background, interests, goals)
+            )
+            learning_program = get_group("courses_recommender").do(
+                key,
+                lambda: self.build_learning_program(
+                    program, background, interests, goals
+                ),
             )
 
             if "error" in learning_program:
-                self._logger.error(f"Ошибка: {learning_program['error']}")
+                self._logger.error("Ошибка: %s", learning_program["error"])
                 return str(learning_program["error"])
 
             # Формируем читаемый ответ
@@ -279,13 +341,16 @@ class CoursesRecommender(BaseTool):
                             result += f"  {i}. {course.get('name', 'Неизвестное название')} ({course.get('hours', 'Н/Д')} часов)\n"
                 result += "\n"
 
-            self._logger.info("Результат программы обучения сформирован")
+            self._logger.debug("Результат программы обучения сформирован")
             return result
 
         except Exception as e:
-            self._logger.error(f"Ошибка при построении программы: {str(e)}")
+            self._logger.error("Ошибка при построении программы: %s", e)
             return f"Ошибка при построении программы: {str(e)}"
 
     async def _arun(self, *args, **kwargs) -> str:
-        """Асинхронная версия."""
-        return self._run(*args, **kwargs)
+        """
+        Асинхронная версия: построение плана делает синхронные вызовы LLM
+        по семестрам, поэтому выполняется в потоке и не блокирует event loop.
+        """
+        return await asyncio.to_thread(self._run, *args, **kwargs)
@@ -0,0 +1,298 @@
+"""
+Удаление почти-дубликатов чанков при сборе данных.
+
+Кандидаты в дубликаты ищутся через MinHash/LSH по шинглам текста, затем
+для каждой пары-кандидата считается точный коэффициент Жаккара. Дубликаты
+объединяются в группы; в каждой группе остаётся самый длинный чанк, метаданные
+остальных сохраняются в его поле duplicates.
+
+Для дисциплин учебного плана (pdf_parser) дубликатами считаются строки с одинаковым
+или почти одинаковым названием: одна дисциплина, читаемая в нескольких семестрах,
+становится одной записью с объединённым списком семестров. Названия с разными
+номерами («Научно-исследовательская работа» и «... 2», «Иностранный язык I» и «II»)
+относятся к разным дисциплинам и не объединяются.
+
+Запуск на готовых файлах (без --apply только отчёт):
+    python -m chat_rag.rag.dedup data/chunks --apply
+"""
+
+import argparse
+import json
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+NUM_PERM = 128
+LSH_BANDS = 32
+# Параметры универсального хэширования a*x + b mod p; x < 2^32, a*x + b < 2^64
+_PRIME = 4294967311
+_MAX_HASH = 2**32 - 1
+
+TEXT_FIELDS = ("text", "question", "answer")
+
+
+@dataclass
+class DedupReport:
+    """Насколько дедупликация сократила корпус."""
+
+    name: str
+    input_count: int
+    output_count: int
+    input_chars: int
+    output_chars: int
+    merged_groups: int
+
+    @property
+    def removed(self) -> int:
+        return self.input_count - self.output_count
+
+    def summary(self) -> str:
+        chars_saved = (
+            1 - self.output_chars / self.input_chars if self.input_chars else 0
+        )
+        return (
+            f"{self.name}: {self.input_count} -> {self.output_count} чанков "
+            f"(-{self.removed}, групп: {self.merged_groups}), "
+            f"текста {self.input_chars} -> {self.output_chars} символов "
+            f"(-{chars_saved:.1%})"
+        )
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, без пунктуации, одиночные пробелы."""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", text.lower())).strip()
+
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    """Хэши символьных шинглов нормализованного текста."""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return {
+        zlib.crc32(text[i : i + size].encode("utf-8"))
+        for i in range(len(text) - size + 1)
+    }
+
+
+def name_numbers(name: str) -> Tuple[str, ...]:
+    """Номера в названии дисциплины: арабские и римские (I, II, IV...)."""
+    return tuple(re.findall(r"\b(?:\d+|[IVX]+)\b", name))
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """MinHash-сигнатуры множеств шинглов."""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, items: Set[int]) -> np.ndarray:
+        values = np.fromiter(items, dtype=np.uint64, count=len(items))[:, None]
+        hashes = (values * self._a + self._b) % np.uint64(_PRIME)
+        return hashes.min(axis=0)
+
+
+def lsh_candidates(
+    signatures: Sequence[np.ndarray], bands: int = LSH_BANDS
+) -> Set[Tuple[int, int]]:
+    """
+    Пары индексов, у которых совпала сигнатура хотя бы в одной полосе LSH.
+    """
+    if not signatures:
+        return set()
+    rows = len(signatures[0]) // bands
+    pairs: Set[Tuple[int, int]] = set()
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        for index, signature in enumerate(signatures):
+            key = signature[band * rows : (band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(index)
+        for members in buckets.values():
+            pairs.update(combinations(members, 2))
+    return pairs
+
+
+def near_duplicate_groups(
+    texts: Sequence[str],
+    threshold: float,
+    shingle_size: int = 5,
+    num_perm: int = NUM_PERM,
+    bands: int = LSH_BANDS,
+    keys: Optional[Sequence[Hashable]] = None,
+) -> List[List[int]]:
+    """
+    Группы индексов текстов с попарным сходством Жаккара не ниже threshold
+    (транзитивно). Группы упорядочены по первому вхождению.
+
+    Args:
+        keys: Тексты с разными ключами не объединяются, как бы ни были похожи
+    """
+    sets = [shingles(text, shingle_size) for text in texts]
+    hasher = MinHasher(num_perm)
+    signatures = [hasher.signature(items) for items in sets]
+
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in lsh_candidates(signatures, bands):
+        if keys is not None and keys[i] != keys[j]:
+            continue
+        if jaccard(sets[i], sets[j]) >= threshold:
+            parent[max(find(i), find(j))] = min(find(i), find(j))
+
+    groups: Dict[int, List[int]] = {}
+    for index in range(len(texts)):
+        groups.setdefault(find(index), []).append(index)
+    return sorted(groups.values(), key=lambda group: group[0])
+
+
+def chunk_text(chunk: Dict[str, Any]) -> str:
+    """Текст чанка, по которому он индексируется."""
+    if "question" in chunk and "answer" in chunk:
+        return f"{chunk['question']}\n{chunk['answer']}"
+    return str(chunk.get("text", ""))
+
+
+def _threshold(value: Optional[float], env: str, default: str) -> float:
+    return value if value is not None else float(os.getenv(env, default))
+
+
+def dedup_chunks(
+    chunks: List[Dict[str, Any]],
+    threshold: Optional[float] = None,
+    name: str = "chunks",
+) -> Tuple[List[Dict[str, Any]], DedupReport]:
+    """
+    Объединяет почти-дубликаты чанков страницы программы.
+
+    В группе остаётся самый длинный чанк (на месте первого вхождения группы),
+    метаданные остальных добавляются в его поле duplicates.
+
+    Returns:
+        Чанки без дубликатов и отчёт
+    """
+    threshold = _threshold(threshold, "DEDUP_THRESHOLD", "0.8")
+    texts = [chunk_text(chunk) for chunk in chunks]
+    result = []
+    merged = 0
+    for group in near_duplicate_groups(texts, threshold):
+        keep = max(group, key=lambda i: len(texts[i]))
+        chunk = dict(chunks[keep])
+        others = [i for i in group if i != keep]
+        if others:
+            merged += 1
+            chunk["duplicates"] = list(chunk.get("duplicates", [])) + [
+                {k: v for k, v in chunks[i].items() if k not in TEXT_FIELDS}
+                for i in others
+            ]
+        result.append(chunk)
+    return result, DedupReport(
+        name=name,
+        input_count=len(chunks),
+        output_count=len(result),
+        input_chars=sum(len(text) for text in texts),
+        output_chars=sum(len(chunk_text(chunk)) for chunk in result),
+        merged_groups=merged,
+    )
+
+
+def dedup_courses(
+    courses: List[Dict[str, Any]],
+    threshold: Optional[float] = None,
+    name: str = "courses",
+) -> Tuple[List[Dict[str, Any]], DedupReport]:
+    """
+    Объединяет строки учебного плана с одинаковыми или почти одинаковыми
+    названиями дисциплин: семестры объединяются, остальные поля берутся
+    из первой строки, отличающиеся значения сохраняются в variants.
+    Названия с разными номерами (name_numbers) не объединяются: у «... 2» свои
+    кредиты и семестры, а variants при подборе курсов не читаются.
+
+    Returns:
+        Дисциплины без дубликатов и отчёт
+    """
+    threshold = _threshold(threshold, "DEDUP_COURSE_THRESHOLD", "0.9")
+    names = [str(course.get("name", "")) for course in courses]
+    result = []
+    merged = 0
+    keys = [name_numbers(n) for n in names]
+    for group in near_duplicate_groups(names, threshold, shingle_size=3, keys=keys):
+        course = dict(courses[group[0]])
+        if len(group) > 1:
+            merged += 1
+            rows = [courses[i] for i in group]
+            course["semesters"] = sorted(
+                {semester for row in rows for semester in row.get("semesters", [])}
+            )
+            variants = [
+                {k: row.get(k) for k in ("name", "credits", "hours", "semesters")}
+                for row in rows[1:]
+                if any(
+                    row.get(k) != course.get(k) for k in ("name", "credits", "hours")
+                )
+            ]
+            if variants:
+                course["variants"] = variants
+        result.append(course)
+    return result, DedupReport(
+        name=name,
+        input_count=len(courses),
+        output_count=len(result),
+        input_chars=sum(len(n) for n in names),
+        output_chars=sum(len(str(course.get("name", ""))) for course in result),
+        merged_groups=merged,
+    )
+
+
+def _chunk_files(directory: str) -> Iterable[Tuple[str, bool]]:
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith("_courses_chunks.json"):
+            yield os.path.join(directory, filename), True
+        elif filename.endswith("_chunks.json"):
+            yield os.path.join(directory, filename), False
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Near-duplicate chunk removal")
+    parser.add_argument("directory", nargs="?", default="data/chunks")
+    parser.add_argument("--threshold", type=float, help="порог для чанков страниц")
+    parser.add_argument("--course-threshold", type=float, help="порог для дисциплин")
+    parser.add_argument(
+        "--apply", action="store_true", help="перезаписать файлы без дубликатов"
+    )
+    args = parser.parse_args(argv)
+
+    for path, is_courses in _chunk_files(args.directory):
+        with open(path, encoding="utf-8") as f:
+            items = json.load(f)
+        name = os.path.basename(path)
+        if is_courses:
+            items, report = dedup_courses(items, args.course_threshold, name)
+        else:
+            items, report = dedup_chunks(items, args.threshold, name)
+        print(report.summary())
+        if args.apply and report.removed:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Бенчмарк бэкендов эмбеддингов (EMBEDDINGS_BACKEND): время загрузки модели и прирост
+RSS, задержка эмбеддинга одного запроса, пропускная способность на батчах документов
+и согласие с эталонным бэкендом (первым в списке): косинусная близость векторов
+запросов и доля совпадающих документов в top-k поиска по чанкам программ.
+
+Каждый бэкенд измеряется в отдельном процессе, чтобы импорт torch одним бэкендом
+не искажал время загрузки и RSS другого.
+
+Запуск:
+    python -m chat_rag.rag.embedding_benchmark --backends huggingface onnx
+"""
+
+import argparse
+import multiprocessing as mp
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from chat_rag.rag.embeddings import EMBEDDINGS_BACKENDS, create_embeddings
+from chat_rag.rag.memory_profile import rss_bytes
+
+# Короткие запросы, в которые агент переформулирует вопросы
+SHORT_QUERIES = [
+    "стоимость обучения",
+    "вступительные экзамены",
+    "общежитие",
+    "бюджетные места",
+    "карьера выпускников",
+    "партнёры программы",
+    "длительность обучения",
+    "форма обучения",
+]
+
+
+def load_corpus() -> Dict[str, List[str]]:
+    """
+    Документы всех программ и запросы: вопросы FAQ из чанков и короткие запросы.
+    """
+    from chat_rag.rag.programs import get_registry
+
+    registry = get_registry()
+    docs: List[str] = []
+    for code in registry.codes():
+        docs.extend(doc.page_content for doc in registry.load_documents(code))
+    questions = [
+        doc.split("\nA:")[0][3:] for doc in docs if doc.startswith("Q: ")
+    ] + SHORT_QUERIES
+    return {"docs": docs, "queries": questions}
+
+
+def measure_backend(
+    backend: str, model_name: str, corpus: Dict[str, List[str]], batch_size: int
+) -> Dict[str, Any]:
+    """
+    Замеры одного бэкенда; выполняется в отдельном процессе.
+    """
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    embeddings, model_id = create_embeddings(model_name, backend)
+    # Первый вызов включает ленивую инициализацию модели
+    embeddings.embed_query("прогрев")
+    load_s = time.perf_counter() - started
+
+    latencies = []
+    query_vectors = []
+    for query in corpus["queries"]:
+        started = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    docs = corpus["docs"]
+    started = time.perf_counter()
+    doc_vectors = []
+    for start in range(0, len(docs), batch_size):
+        doc_vectors.extend(embeddings.embed_documents(docs[start : start + batch_size]))
+    batch_s = time.perf_counter() - started
+
+    return {
+        "backend": backend,
+        "model_id": model_id,
+        "load_s": load_s,
+        "rss_mb": (rss_bytes() - rss_before) / 2**20,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "docs_per_s": len(docs) / batch_s if batch_s else 0.0,
+        "query_vectors": np.asarray(query_vectors, dtype=np.float32),
+        "doc_vectors": np.asarray(doc_vectors, dtype=np.float32),
+    }
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None
+    )
+
+
+def agreement(
+    reference: Dict[str, Any], other: Dict[str, Any], k: int
+) -> Dict[str, float]:
+    """
+    Косинусная близость векторов запросов двух бэкендов и доля общих документов
+    в top-k точного поиска по их же векторам документов.
+    """
+    ref_queries = _normalized(reference["query_vectors"])
+    other_queries = _normalized(other["query_vectors"])
+    cosine = (ref_queries * other_queries).sum(axis=1)
+
+    def top_k(queries: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        scores = queries @ _normalized(docs).T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    ref_top = top_k(ref_queries, reference["doc_vectors"])
+    other_top = top_k(other_queries, other["doc_vectors"])
+    overlap = [
+        len(set(ref_top[i]) & set(other_top[i])) / k for i in range(len(ref_top))
+    ]
+    return {
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "topk_agreement": float(np.mean(overlap)),
+        "top1_agreement": float(np.mean(ref_top[:, 0] == other_top[:, 0])),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Embedding backend benchmark")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=EMBEDDINGS_BACKENDS,
+        default=["huggingface", "onnx"],
+    )
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus()
+    print(f"docs={len(corpus['docs'])} queries={len(corpus['queries'])}")
+    # spawn: чистый процесс без уже импортированных моделей
+    ctx = mp.get_context("spawn")
+    results = []
+    for backend in args.backends:
+        with ctx.Pool(1) as pool:
+            results.append(
+                pool.apply(
+                    measure_backend, (backend, args.model, corpus, args.batch_size)
+                )
+            )
+
+    print(
+        f"{'backend':<12} {'load_s':>7} {'rss_mb':>7} {'p50_ms':>7} {'p95_ms':>7} "
+        f"{'docs/s':>8} {'cos_mean':>8} {'cos_min':>8} {'top1':>6} top{args.k}"
+    )
+    for result in results:
+        agree = agreement(results[0], result, args.k)
+        print(
+            f"{result['backend']:<12} {result['load_s']:>7.2f} {result['rss_mb']:>7.1f} "
+            f"{result['p50_ms']:>7.2f} {result['p95_ms']:>7.2f} "
+            f"{result['docs_per_s']:>8.1f} {agree['cosine_mean']:>8.4f} "
+            f"{agree['cosine_min']:>8.4f} {agree['top1_agreement']:>6.3f} "
+            f"{agree['topk_agreement']:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Эмбеддинги для ретривера.
+
+create_embeddings выбирает реализацию модели по EMBEDDINGS_BACKEND:
+    huggingface — sentence-transformers (по умолчанию);
+    onnx        — та же модель, экспортированная в ONNX с int8-весами, без PyTorch
+                  (chat_rag/rag/onnx_embeddings.py);
+    hash        — детерминированные хэш-векторы с настраиваемой задержкой
+                  (chat_rag/devtools/fake_embeddings.py, для нагрузочных тестов).
+
+BatchingEmbeddings объединяет одиночные запросы на эмбеддинг, пришедшие от разных
+пользователей почти одновременно, в один батч, и прогоняет их через модель
+одним вызовом.
+
+CachedQueryEmbeddings хранит эмбеддинги частых запросов (LRU) и при необходимости
+сохраняет их на диск между перезапусками.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from chat_rag.rag.singleflight import normalize_query
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_BACKENDS = ("huggingface", "onnx", "hash")
+
+
+def create_embeddings(
+    model_name: str, backend: Optional[str] = None
+) -> Tuple[Embeddings, str]:
+    """
+    Создает модель эмбеддингов.
+
+    Returns:
+        Модель и её идентификатор для отпечатка индекса: индексы, построенные
+        разными бэкендами, не смешиваются
+    """
+    backend = (backend or os.getenv("EMBEDDINGS_BACKEND", "huggingface")).lower()
+    if backend == "huggingface":
+        from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=model_name), model_name
+    if backend == "onnx":
+        from chat_rag.rag.onnx_embeddings import OnnxEmbeddings, onnx_model_dir
+
+        return OnnxEmbeddings(onnx_model_dir(model_name)), f"onnx-int8:{model_name}"
+    if backend == "hash":
+        from chat_rag.devtools.fake_embeddings import HashEmbeddings
+
+        return HashEmbeddings(), f"hash:{model_name}"
+    raise ValueError(f"Unknown embeddings backend: {backend}")
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Обёртка над Embeddings с микробатчингом запросов.
+
+    Запросы копятся не дольше max_wait_ms с момента прихода первого из них
+    или пока не наберётся max_batch_size, после чего эмбеддятся одним вызовом
+    base.embed_documents. Для моделей без отдельного query-промпта
+    (например, all-MiniLM-L6-v2) результат совпадает с embed_query.
+    Эмбеддинги документов при индексации идут в модель напрямую.
+
+    Args:
+        base: Модель эмбеддингов
+        max_batch_size: Максимальный размер батча (EMBED_BATCH_MAX_SIZE)
+        max_wait_ms: Сколько ждать попутных запросов (EMBED_BATCH_WAIT_MS)
+        timeout: Сколько секунд запрос ждёт эмбеддинга (EMBED_QUERY_TIMEOUT_S)
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.base = base
+        self.max_batch_size = max_batch_size or int(
+            os.getenv("EMBED_BATCH_MAX_SIZE", "32")
+        )
+        self.max_wait_ms = (
+            max_wait_ms
+            if max_wait_ms is not None
+            else float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+        )
+        self.timeout = (
+            timeout
+            if timeout is not None
+            else float(os.getenv("EMBED_QUERY_TIMEOUT_S", "30"))
+        )
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._max_seen_batch = 0
+
+        logger.info(
+            "BatchingEmbeddings initialized: max_batch_size=%d, max_wait_ms=%.1f",
+            self.max_batch_size,
+            self.max_wait_ms,
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги документов без батчинга."""
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Эмбеддинг запроса; блокирует поток до готовности батча.
+
+        Raises:
+            TimeoutError: если батч не готов за timeout секунд
+        """
+        future = self._submit(text)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            # Ещё не взятый в батч запрос снимается с очереди
+            future.cancel()
+            raise TimeoutError(f"Query embedding timed out after {self.timeout}s")
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Асинхронный эмбеддинг запроса; не блокирует event loop."""
+        # Отмена ожидания (таймаут хода) отменяет и ещё не взятый в батч запрос
+        return await asyncio.wait_for(
+            asyncio.wrap_future(self._submit(text)), self.timeout
+        )
+
+    def _submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run_batches, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batches(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                # Ошибка одного батча не должна останавливать поток: иначе все
+                # следующие запросы повисли бы без ответа
+                logger.exception("Unexpected error in embedding batcher")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed_batch(self, batch: List[Tuple[str, Future]]):
+        # Запросы, ожидание которых уже отменено (таймаут хода), не эмбеддим;
+        # остальные переводятся в running и больше не могут быть отменены
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self.base.embed_documents(texts)
+        except Exception as e:
+            logger.error("Error embedding batch of %d queries: %s", len(texts), e)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        if len(vectors) != len(batch):
+            raise ValueError(
+                f"Model returned {len(vectors)} vectors for {len(batch)} queries"
+            )
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+        self._batches += 1
+        self._queries += len(batch)
+        self._max_seen_batch = max(self._max_seen_batch, len(batch))
+        logger.debug("Embedded batch of %d queries", len(batch))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику батчинга.
+
+        Returns:
+            Словарь со статистикой
+        """
+        return {
+            "batches": self._batches,
+            "queries": self._queries,
+            "avg_batch_size": self._queries / self._batches if self._batches else 0.0,
+            "max_batch_size_seen": self._max_seen_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    LRU-кэш эмбеддингов запросов перед моделью (или BatchingEmbeddings).
+
+    Ключ — точный текст запроса в пределах одной модели: модель может различать
+    регистр, и вектор «ИИ» не подходит для «ии». Для моделей без учёта регистра
+    normalize включает ключ без учёта регистра и пробелов (normalize_query).
+    Попадание не доходит ни до батчера, ни до модели. Векторы хранятся как float32.
+    Если задан path, кэш загружается при создании и сохраняется при выходе
+    процесса (и по save()); файл другой модели или с другими ключами игнорируется.
+
+    Args:
+        base: Модель эмбеддингов
+        model_id: Идентификатор модели (см. create_embeddings)
+        max_size: Максимум запросов в кэше (EMBED_CACHE_SIZE)
+        path: Файл кэша на диске (EMBED_CACHE_PATH; пусто — только в памяти)
+        normalize: Нормализовать ключ (EMBED_CACHE_NORMALIZE, по умолчанию нет)
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        model_id: str,
+        max_size: Optional[int] = None,
+        path: Optional[str] = None,
+        normalize: Optional[bool] = None,
+    ):
+        self.base = base
+        self.model_id = model_id
+        self.normalize = (
+            normalize
+            if normalize is not None
+            else os.getenv("EMBED_CACHE_NORMALIZE", "false").lower() == "true"
+        )
+        self.max_size = (
+            max_size
+            if max_size is not None
+            else int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+        )
+        self.path = path if path is not None else os.getenv("EMBED_CACHE_PATH", "")
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._loaded = 0
+
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+        logger.info(
+            "CachedQueryEmbeddings initialized: max_size=%d, normalize=%s, "
+            "path=%s, loaded=%d",
+            self.max_size,
+            self.normalize,
+            self.path or "-",
+            self._loaded,
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги документов без кэша."""
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Эмбеддинг запроса из кэша или от модели."""
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Асинхронный эмбеддинг запроса из кэша или от модели."""
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = await self.base.aembed_query(text)
+            self._put(key, vector)
+        return vector
+
+    def _key(self, text: str) -> str:
+        return normalize_query(text) if self.normalize else text
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+        return vector.tolist()
+
+    def _put(self, key: str, vector: List[float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = np.asarray(vector, dtype=np.float32)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._evictions += 1
+
+    def _load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["model_id"]) != self.model_id:
+                    logger.info(
+                        "Embedding cache %s belongs to another model, ignoring",
+                        self.path,
+                    )
+                    return
+                normalized = "normalize" in data.files and bool(data["normalize"])
+                if normalized != self.normalize:
+                    logger.info(
+                        "Embedding cache %s uses other keys (normalize=%s), ignoring",
+                        self.path,
+                        normalized,
+                    )
+                    return
+                keys, vectors = data["keys"], data["vectors"]
+        except FileNotFoundError:
+            return
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("Cannot load embedding cache %s: %s", self.path, e)
+            return
+        with self._lock:
+            for key, vector in zip(keys[-self.max_size :], vectors[-self.max_size :]):
+                self._items[str(key)] = vector
+            self._loaded = len(self._items)
+
+    def save(self):
+        """
+        Сохраняет кэш в path (атомарной заменой файла). Из нескольких процессов
+        с одним path на диске остаётся кэш последнего сохранившего.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            keys = list(self._items)
+            vectors = list(self._items.values())
+        if not keys:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            # Файловый объект: np.savez не добавляет расширение к имени
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    model_id=np.array(self.model_id),
+                    normalize=np.array(self.normalize),
+                    keys=np.array(keys),
+                    vectors=np.stack(vectors),
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Cannot save embedding cache %s: %s", self.path, e)
+            return
+        logger.info("Saved %d query embeddings to %s", len(keys), self.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша.
+
+        Returns:
+            Словарь со статистикой
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._items),
+                "max_size": self.max_size,
+                "bytes": sum(vector.nbytes for vector in self._items.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "normalize": self.normalize,
+                "loaded_from_disk": self._loaded,
+                "path": self.path,
+            }
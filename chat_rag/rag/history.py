@@ -0,0 +1,78 @@
+"""
+Компактная история диалога пользователя.
+
+Вместо объекта памяти LangChain (pydantic-модель с историей из объектов сообщений)
+на каждого пользователя хранится кольцевой буфер пар (role, text) ограниченной
+длины. Сообщения LangChain строятся из пар только на время хода агента
+(to_messages).
+"""
+
+import sys
+from typing import Any, List, Optional, Tuple
+
+HUMAN = "human"
+AI = "ai"
+
+# История диалога в переносимом между процессами виде: (role, text)
+History = List[Tuple[str, str]]
+
+
+class DialogHistory:
+    """
+    Кольцевой буфер последних сообщений диалога.
+
+    Args:
+        capacity: Сколько последних сообщений хранить (None — без ограничения)
+    """
+
+    __slots__ = ("capacity", "_items", "_start")
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity
+        # Список растёт до capacity, дальше новые сообщения пишутся поверх старых
+        self._items: List[Tuple[str, str]] = []
+        self._start = 0
+
+    def append(self, role: str, text: str):
+        """Добавляет сообщение, вытесняя самое старое при заполненном буфере."""
+        item = (sys.intern(role), text)
+        if self.capacity is None or len(self._items) < self.capacity:
+            self._items.append(item)
+        elif self.capacity > 0:
+            self._items[self._start] = item
+            self._start = (self._start + 1) % self.capacity
+
+    def add_exchange(self, human_message: str, ai_message: str):
+        """Добавляет вопрос пользователя и ответ бота."""
+        self.append(HUMAN, human_message)
+        self.append(AI, ai_message)
+
+    def pairs(self) -> History:
+        """Сообщения от старых к новым."""
+        return self._items[self._start :] + self._items[: self._start]
+
+    def clear(self):
+        """Очищает историю."""
+        self._items = []
+        self._start = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def nbytes(self) -> int:
+        """Размер истории в памяти вместе с текстами сообщений."""
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self._items)
+            + sum(sys.getsizeof(item) + sys.getsizeof(item[1]) for item in self._items)
+        )
+
+
+def to_messages(history: History) -> List[Any]:
+    """Сообщения LangChain для слота chat_history промпта агента."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    return [
+        HumanMessage(text) if role == HUMAN else AIMessage(text)
+        for role, text in history
+    ]
@@ -0,0 +1,124 @@
+"""
+Бенчмарк типов FAISS-индекса: полнота (recall@k) относительно точного flat-индекса
+и задержка поиска одного запроса.
+
+По умолчанию используется синтетический корпус: кластеризованные нормированные
+векторы размерности all-MiniLM-L6-v2. Можно взять векторы существующего индекса
+(--index-dir), тогда запросами служат зашумлённые векторы корпуса.
+
+Запуск:
+    python -m chat_rag.rag.index_benchmark --sizes 1000 20000 200000
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from chat_rag.rag.vector_store import INDEX_TYPES, INDEX_FILE, build_index
+
+
+def synthetic_corpus(
+    count: int, dim: int, clusters: int = 256, latent_dim: int = 32, seed: int = 0
+) -> np.ndarray:
+    """
+    Генерирует нормированные векторы, сгруппированные вокруг clusters центров.
+    Как и у настоящих эмбеддингов, внутренняя размерность данных (latent_dim)
+    намного меньше dim.
+    """
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((latent_dim, dim)).astype(np.float32)
+    centers = rng.standard_normal((clusters, latent_dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    latent = centers[labels] + 0.5 * rng.standard_normal((count, latent_dim))
+    vectors = (latent.astype(np.float32) @ projection) + 0.05 * rng.standard_normal(
+        (count, dim)
+    ).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def make_queries(corpus: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Запросы — зашумлённые векторы корпуса."""
+    rng = np.random.default_rng(seed)
+    picks = corpus[rng.integers(0, len(corpus), size=count)]
+    queries = picks + 0.02 * rng.standard_normal(picks.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries.astype(np.float32)
+
+
+def benchmark(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    index_types: List[str],
+) -> List[Dict[str, float]]:
+    """
+    Строит индексы каждого типа и измеряет время сборки, задержку и recall@k.
+    """
+    exact = faiss.IndexFlatL2(corpus.shape[1])
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index, _ = build_index(corpus, index_type)
+        build_s = time.perf_counter() - started
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            _, ids = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found[i] = ids[0]
+
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        rows.append(
+            {
+                "type": index_type,
+                "docs": len(corpus),
+                "build_s": build_s,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "recall": hits / (len(queries) * k),
+            }
+        )
+    return rows
+
+
+def _load_index_vectors(index_dir: str) -> np.ndarray:
+    index = faiss.read_index(f"{index_dir}/{INDEX_FILE}")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="FAISS index type benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 20000, 200000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES))
+    parser.add_argument("--index-dir", help="взять векторы из существующего индекса")
+    args = parser.parse_args(argv)
+
+    if args.index_dir:
+        corpora = [_load_index_vectors(args.index_dir)]
+    else:
+        corpora = [synthetic_corpus(size, args.dim) for size in args.sizes]
+
+    print(f"{'type':<6} {'docs':>8} {'build_s':>8} {'p50_ms':>8} {'p95_ms':>8} recall")
+    for corpus in corpora:
+        queries = make_queries(corpus, args.queries)
+        for row in benchmark(corpus, queries, args.k, args.types):
+            print(
+                f"{row['type']:<6} {row['docs']:>8} {row['build_s']:>8.2f} "
+                f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} {row['recall']:.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
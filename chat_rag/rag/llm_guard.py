@@ -0,0 +1,374 @@
+"""
+Защита вызовов LLM от «хвостовых» задержек.
+
+LLMGuard оборачивает каждый вызов модели:
+    - дедлайн на весь вызов (LLM_TIMEOUT_S);
+    - хеджирование: если ответа нет дольше заданного перцентиля недавних
+      задержек (LLM_HEDGE_PERCENTILE), отправляется дубликат запроса,
+      используется первый успешный ответ;
+    - circuit breaker: после LLM_BREAKER_FAILURES неудач подряд вызовы
+      сразу отклоняются в течение LLM_BREAKER_RESET_S секунд, затем
+      пропускается один пробный вызов.
+
+Во всех случаях отказа поднимается LLMUnavailableError, вызывающий код
+отвечает из кэша или деградированным ответом. Исходы вызовов считаются
+и доступны через get_stats().
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, TypeVar
+
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(RuntimeError):
+    """
+    LLM не ответила: истёк дедлайн, вызов завершился ошибкой
+    или отклонён открытым circuit breaker.
+    """
+
+    def __init__(self, guard: str, reason: str):
+        super().__init__(f"LLM '{guard}' unavailable: {reason}")
+        self.guard = guard
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker с состояниями closed → open → half_open → closed.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout_s: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов сейчас."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout_s:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # В полуоткрытом состоянии пропускаем один пробный вызов
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.failure_threshold > 0 and self._failures >= self.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "Circuit breaker opened after %d failures", self._failures
+                    )
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class LLMGuard:
+    """
+    Дедлайн, хеджирование и circuit breaker для вызовов одной модели.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout_s: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        failure_threshold: Optional[int] = None,
+        reset_timeout_s: Optional[float] = None,
+        latency_window: int = 200,
+    ):
+        self.name = name
+        self.timeout_s = timeout_s or float(os.getenv("LLM_TIMEOUT_S", "30"))
+        # 0 — хеджирование выключено
+        self.hedge_percentile = (
+            hedge_percentile
+            if hedge_percentile is not None
+            else float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+        )
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(
+            failure_threshold=(
+                failure_threshold
+                if failure_threshold is not None
+                else int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+            ),
+            reset_timeout_s=reset_timeout_s
+            or float(os.getenv("LLM_BREAKER_RESET_S", "30")),
+        )
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._counters: Counter = Counter()
+        self._lock = threading.Lock()
+        # Потоки для синхронных вызовов; зависший вызов занимает поток
+        # не дольше таймаута HTTP-клиента модели
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+            thread_name_prefix=f"llm-{name}",
+        )
+
+        logger.info(
+            "LLMGuard '%s': timeout=%.1fs, hedge_percentile=%.0f, breaker=%d/%.0fs",
+            name,
+            self.timeout_s,
+            self.hedge_percentile,
+            self.breaker.failure_threshold,
+            self.breaker.reset_timeout_s,
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Через сколько секунд без ответа отправлять дубликат запроса
+        (None — не отправлять).
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        position = min(
+            len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100)
+        )
+        delay = latencies[position]
+        return delay if delay < self.timeout_s else None
+
+    def count(self, outcome: str):
+        """Увеличивает счётчик исхода (в том числе ответов из фолбэка)."""
+        with self._lock:
+            self._counters[outcome] += 1
+
+    def _admit(self):
+        self.count("calls")
+        if not self.breaker.allow():
+            self.count("rejected")
+            raise LLMUnavailableError(self.name, "circuit open")
+
+    def _on_success(self, started: float, hedged: bool, won_by_hedge: bool):
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+            self._counters["success"] += 1
+            if hedged:
+                self._counters["hedged"] += 1
+            if won_by_hedge:
+                self._counters["hedge_wins"] += 1
+        self.breaker.record_success()
+
+    def _failure(
+        self, outcome: str, error: Optional[BaseException] = None
+    ) -> LLMUnavailableError:
+        self.count(outcome)
+        self.breaker.record_failure()
+        logger.warning("LLM '%s' call failed: %s %s", self.name, outcome, error or "")
+        return LLMUnavailableError(self.name, outcome)
+
+    def _submit(self, fn: Callable[[], T]) -> "Future[T]":
+        # Колбэки LangChain читают контекст вызывающего потока
+        return self._executor.submit(contextvars.copy_context().run, fn)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """
+        Выполняет синхронный вызов модели под защитой.
+
+        Raises:
+            LLMUnavailableError: если ответ не получен
+        """
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.timeout_s
+        hedge_delay = self.hedge_delay()
+        attempts: List[Future] = [self._submit(fn)]
+        pending = set(attempts)
+        error: Optional[BaseException] = None
+        while pending:
+            wait_until = deadline
+            if hedge_delay is not None and len(attempts) == 1:
+                wait_until = min(deadline, started + hedge_delay)
+            done, pending = wait(
+                pending,
+                timeout=max(0.0, wait_until - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None:
+                    self._on_success(
+                        started, len(attempts) > 1, future is not attempts[0]
+                    )
+                    return future.result()
+                error = future.exception()
+            if time.monotonic() >= deadline:
+                break
+            if pending and len(attempts) == 1 and hedge_delay is not None:
+                attempts.append(self._submit(fn))
+                pending.add(attempts[-1])
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise self._failure("timeout")
+        raise self._failure("error", error) from error
+
+    async def acall(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполняет асинхронный вызов модели под защитой.
+        Проигравшие и просроченные попытки отменяются.
+
+        Raises:
+            LLMUnavailableError: если ответ не получен
+        """
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.timeout_s
+        hedge_delay = self.hedge_delay()
+        attempts: List[asyncio.Task] = []
+        pending: Set[asyncio.Task] = set()
+        error: Optional[BaseException] = None
+        try:
+            attempts.append(asyncio.ensure_future(fn()))
+            pending.add(attempts[0])
+            while pending:
+                wait_until = deadline
+                if hedge_delay is not None and len(attempts) == 1:
+                    wait_until = min(deadline, started + hedge_delay)
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, wait_until - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self._on_success(
+                            started, len(attempts) > 1, task is not attempts[0]
+                        )
+                        return task.result()
+                    error = task.exception()
+                if time.monotonic() >= deadline:
+                    break
+                if pending and len(attempts) == 1 and hedge_delay is not None:
+                    attempts.append(asyncio.ensure_future(fn()))
+                    pending.add(attempts[-1])
+        except BaseException as e:
+            # Вызывающий отменён (например, по таймауту хода) или попытку не удалось
+            # создать: исход неизвестен, но пробный вызов half-open надо освободить,
+            # иначе breaker отклонял бы все следующие вызовы
+            self._failure(
+                "cancelled" if isinstance(e, asyncio.CancelledError) else "error", e
+            )
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+        if pending:
+            raise self._failure("timeout")
+        raise self._failure("error", error) from error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает счётчики исходов и состояние circuit breaker.
+
+        Returns:
+            Словарь со статистикой
+        """
+        hedge_delay = self.hedge_delay()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats: Dict[str, Any] = dict(self._counters)
+        stats.update(
+            {
+                "breaker_state": self.breaker.state,
+                "p50_s": latencies[len(latencies) // 2] if latencies else None,
+                "hedge_delay_s": hedge_delay,
+                "timeout_s": self.timeout_s,
+            }
+        )
+        return stats
+
+
+_guards: Dict[str, LLMGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(name: str) -> LLMGuard:
+    """Общий для процесса LLMGuard модели name."""
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = LLMGuard(name)
+        return _guards[name]
+
+
+def get_guards_stats() -> Dict[str, Dict[str, Any]]:
+    """Статистика всех LLMGuard процесса."""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.name: guard.get_stats() for guard in guards}
+
+
+class GuardedChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI, все вызовы которого проходят через LLMGuard модели.
+    Повторы внутри клиента OpenAI и потоковая выдача отключены: их роль выполняет
+    хеджирование, а таймаут HTTP-запроса совпадает с дедлайном вызова.
+    """
+
+    _guard: LLMGuard = PrivateAttr()
+
+    def __init__(self, guard: Optional[LLMGuard] = None, **kwargs: Any):
+        guard = guard or get_guard(kwargs.get("model", "llm"))
+        kwargs.setdefault("timeout", guard.timeout_s)
+        kwargs.setdefault("max_retries", 0)
+        # Агенты вызывают модель через astream; потоковый ответ нельзя хеджировать,
+        # поэтому ответ запрашивается целиком через _generate/_agenerate
+        kwargs.setdefault("disable_streaming", True)
+        super().__init__(**kwargs)
+        self._guard = guard
+
+    @property
+    def guard(self) -> LLMGuard:
+        return self._guard
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        generate = super()._generate
+        return self._guard.call(
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        agenerate = super()._agenerate
+        return await self._guard.acall(
+            lambda: agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
@@ -0,0 +1,147 @@
+"""
+Настройка логирования процесса.
+
+Записи кладутся в очередь, а форматирование и вывод выполняет фоновый поток
+(QueueListener): на пути запроса остаются проверка уровня, подстановка аргументов
+и постановка в очередь. Сообщения пишутся с ленивой подстановкой
+(logger.info("... %s", value)), чтобы выключенные уровни ничего не стоили.
+
+Переменные окружения:
+    LOG_LEVEL       — уровень по умолчанию (INFO);
+    LOG_LEVELS      — уровни по компонентам через запятую,
+                      например "chat_rag.rag.retriever=DEBUG,httpx=INFO";
+    LOG_FORMAT      — text или json (JSON-объект на строку, поля extra попадают в него);
+    LOG_SAMPLE_RATE — доля сохраняемых частых сообщений (0.01).
+
+Частые сообщения (на каждый запрос) помечаются extra=SAMPLED и сохраняются
+с вероятностью LOG_SAMPLE_RATE; предупреждения и ошибки не семплируются.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+# Клиенты HTTP и aiogram пишут INFO на каждый запрос к модели и каждый апдейт
+DEFAULT_LEVELS = {
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "openai": "WARNING",
+    "aiogram.event": "WARNING",
+}
+
+SAMPLED = {"sample": float(os.getenv("LOG_SAMPLE_RATE", "0.01"))}
+
+# Стандартные атрибуты LogRecord — всё остальное пришло из extra
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает записи с extra {"sample": rate} с вероятностью rate."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample", None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись в одну строку JSON: время, уровень, логгер, сообщение и поля extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in _RECORD_FIELDS and key != "sample"
+        )
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования на вызывающем потоке. Стандартный prepare
+    форматирует сообщение с трассировкой и очищает exc_info, поэтому JsonFormatter
+    получал трассировку внутри "msg" и не писал "exc". Здесь подставляются только
+    аргументы (они могут измениться после вызова), остальное делает форматтер
+    в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Разбирает "component=LEVEL,..." в словарь уровней."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    levels: Optional[Dict[str, str]] = None,
+    fmt: Optional[str] = None,
+):
+    """
+    Подключает к корневому логгеру очередь с фоновым выводом в stderr.
+    Повторный вызов в том же процессе ничего не делает.
+
+    Args:
+        level: Уровень по умолчанию (LOG_LEVEL)
+        levels: Уровни по компонентам (дополняют LOG_LEVELS)
+        fmt: Формат вывода: text или json (LOG_FORMAT)
+    """
+    global _listener
+    if _listener is not None:
+        return
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    stream = logging.StreamHandler()
+    stream.setFormatter(
+        JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    # Семплирование до очереди: отброшенная запись не стоит ничего в фоне
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    component_levels = {
+        **DEFAULT_LEVELS,
+        **parse_levels(os.getenv("LOG_LEVELS", "")),
+        **(levels or {}),
+    }
+    for name, component_level in component_levels.items():
+        logging.getLogger(name).setLevel(component_level)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при выходе процесса
+    atexit.register(_listener.stop)
@@ -0,0 +1,241 @@
+"""
+Профилирование памяти процесса бота.
+
+memory_report() собирает RSS процесса и размеры компонентов RAG: модели
+эмбеддингов, индексов и документов программ, каталогов курсов, кэша ответов.
+AllocationTracer включает tracemalloc по запросу и показывает, какие строки кода
+выделили память с момента включения; пока трассировка выключена, накладных
+расходов нет.
+
+Отчёт и трассировка вызываются как служебные команды (см. commands.run_command)
+и в процессе бота, и в worker-процессах пула.
+"""
+
+import itertools
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from chat_rag.rag.programs import deep_sizeof
+
+logger = logging.getLogger(__name__)
+
+
+def rss_bytes(pid: Optional[int] = None) -> int:
+    """
+    Текущий RSS процесса pid (по умолчанию текущего). Без /proc возвращает
+    пиковый RSS текущего процесса.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid != os.getpid():
+        return 0
+    # ru_maxrss в килобайтах на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def model_nbytes(model: Any) -> int:
+    """
+    Размер модели: параметры и буферы torch-модулей, model_bytes у моделей,
+    которые знают свой размер (ONNX), для остальных объектов — deep_sizeof.
+    """
+    if hasattr(model, "model_bytes"):
+        return model.model_bytes
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in itertools.chain(model.parameters(), model.buffers())
+        )
+    return deep_sizeof(model)
+
+
+class AllocationTracer:
+    """
+    Трассировка выделений памяти через tracemalloc: start() запоминает базовый
+    снимок, diff() показывает рост по строкам кода относительно него.
+    """
+
+    def __init__(self):
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            )
+        )
+
+    def start(self, frames: Optional[int] = None) -> Dict[str, Any]:
+        """Включает трассировку и делает базовый снимок."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames or int(os.getenv("TRACEMALLOC_FRAMES", "1")))
+            self._baseline = self._snapshot()
+            self._started_at = time.monotonic()
+        logger.info("tracemalloc started")
+        return self.status()
+
+    def diff(self, top: int = 10) -> Dict[str, Any]:
+        """
+        Рост памяти по строкам кода с момента start().
+
+        Args:
+            top: Сколько строк с наибольшим ростом вернуть
+        """
+        with self._lock:
+            if self._baseline is None or not tracemalloc.is_tracing():
+                return {"tracing": False}
+            stats = self._snapshot().compare_to(self._baseline, "lineno")
+        return {
+            **self.status(),
+            "top": [
+                {
+                    "where": str(stat.traceback[0]),
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "size": stat.size,
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+    def stop(self) -> Dict[str, Any]:
+        """Выключает трассировку и освобождает снимки."""
+        with self._lock:
+            self._baseline = None
+            tracemalloc.stop()
+        logger.info("tracemalloc stopped")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": True,
+            "seconds": time.monotonic() - self._started_at,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+        }
+
+
+tracer = AllocationTracer()
+
+
+def memory_report() -> Dict[str, Any]:
+    """
+    RSS процесса и размеры компонентов RAG, загруженных в этом процессе.
+
+    Returns:
+        Словарь с размерами в байтах
+    """
+    from chat_rag.rag import rag_agent
+
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": rss_bytes(),
+        "components": rag_agent.memory_report(),
+        "tracemalloc": tracer.status(),
+    }
+
+
+def _mb(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if value < 2**20:
+        return f"{value / 1024:.1f} КБ"
+    return f"{value / 2**20:.1f} МБ"
+
+
+def format_report(
+    results: List[Dict[str, Any]], history: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Форматирует результаты команд процессов и статистику историй диалогов
+    для отправки администратору.
+    """
+    lines: List[str] = []
+    for result in results:
+        lines.append(f"Процесс {result['pid']}:")
+        if "rss_bytes" in result:
+            lines.append(f"  RSS: {_mb(result['rss_bytes'])}")
+        components = result.get("components", {})
+        kb = components.get("knowledge_base")
+        if kb:
+            lines.append(
+                f"  База знаний: версия {kb['version']} ({kb['fingerprint']}), "
+                f"программы: {', '.join(kb['programs'])}"
+            )
+        if "answer_cache" in components:
+            cache = components["answer_cache"]
+            lines.append(
+                f"  Кэш ответов: {cache['entries']} шт., {_mb(cache['bytes'])}"
+            )
+        retriever = components.get("retriever")
+        if retriever:
+            lines.append(
+                f"  Модель эмбеддингов: {_mb(retriever['embedding_model_bytes'])}"
+            )
+            query_cache = retriever.get("query_cache")
+            if query_cache:
+                lines.append(
+                    f"  Кэш эмбеддингов запросов: {query_cache['entries']} шт., "
+                    f"{_mb(query_cache['bytes'])}, "
+                    f"попаданий {query_cache['hit_rate']:.0%}"
+                )
+            for program, sizes in retriever["programs"].items():
+                lines.append(
+                    f"  Индекс {program}: {sizes['docs']} док., "
+                    f"векторы {_mb(sizes['index_bytes'])}, "
+                    f"документы {_mb(sizes['documents_bytes'])}"
+                    + (" (mmap)" if sizes["mmap"] else "")
+                )
+        recommender = components.get("courses_recommender")
+        if recommender:
+            for program, size in recommender["catalog"]["program_bytes"].items():
+                lines.append(f"  Каталог курсов {program}: {_mb(size)}")
+        if components.get("agent") == "not loaded":
+            lines.append("  Агент не загружен")
+        trace = result.get("tracemalloc") or (
+            result if "tracing" in result else {"tracing": False}
+        )
+        if "rss_bytes" not in result and not trace.get("tracing"):
+            lines.append("  tracemalloc выключен")
+        elif trace.get("tracing"):
+            lines.append(
+                f"  tracemalloc: {trace['seconds']:.0f} с, "
+                f"отслежено {_mb(trace['traced_bytes'])}, "
+                f"накладные {_mb(trace['overhead_bytes'])}"
+            )
+        for stat in result.get("top", []):
+            lines.append(
+                f"    {stat['size_diff'] / 1024:+.1f} КБ "
+                f"({stat['count_diff']:+d}) {stat['where']}"
+            )
+    if history:
+        lines.append(
+            f"Истории диалогов: {history['users']} польз., "
+            f"всего {_mb(history['total_bytes'])}; на пользователя "
+            f"p50 {history['p50_bytes'] / 1024:.1f} КБ, "
+            f"p90 {history['p90_bytes'] / 1024:.1f} КБ, "
+            f"p99 {history['p99_bytes'] / 1024:.1f} КБ, "
+            f"max {history['max_bytes'] / 1024:.1f} КБ; "
+            f"сообщений в среднем {history['avg_messages']:.1f}, "
+            f"max {history['max_messages']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,229 @@
+"""
+Эмбеддинги sentence-transformers через ONNX Runtime с int8-квантизацией весов.
+
+Для вычисления эмбеддингов не нужен PyTorch: модель загружается из экспортированного
+заранее файла ONNX, токенизатор — из tokenizer.json (библиотека tokenizers).
+Эмбеддинг — среднее по токенам последнего слоя с учётом маски и L2-нормировка,
+как у sentence-transformers/all-MiniLM-L6-v2.
+
+Экспорт модели (один раз; нужны torch, transformers, onnx и onnxruntime):
+    python -m chat_rag.rag.onnx_embeddings \\
+        --model sentence-transformers/all-MiniLM-L6-v2 \\
+        --out data/models/all-MiniLM-L6-v2-int8
+
+Используется через EMBEDDINGS_BACKEND=onnx; каталог модели — EMBED_ONNX_DIR
+(по умолчанию data/models/<модель>-int8), число потоков — EMBED_ONNX_THREADS
+(по умолчанию OMP_NUM_THREADS: в worker-процессах пула — 1, без него — по числу ядер).
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from chat_rag.rag.logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+MODELS_DIR = os.path.join(BASE_DIR, "data", "models")
+
+MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "embedding_config.json"
+
+
+def onnx_model_dir(model_name: str) -> str:
+    """Каталог экспортированной модели model_name."""
+    default = os.path.join(MODELS_DIR, f"{model_name.rsplit('/', 1)[-1]}-int8")
+    return os.getenv("EMBED_ONNX_DIR", default)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Эмбеддинги квантизованной ONNX-модели на CPU.
+
+    Args:
+        model_dir: Каталог, созданный export_model
+        threads: Потоки ONNX Runtime на один вызов (EMBED_ONNX_THREADS,
+            иначе OMP_NUM_THREADS; 0 — по числу ядер)
+        batch_size: Сколько текстов прогонять через модель за один вызов
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        threads: Optional[int] = None,
+        batch_size: int = 32,
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX model not found in {model_dir}. Export it with: "
+                f"python -m chat_rag.rag.onnx_embeddings --out {model_dir}"
+            )
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            self.config: Dict[str, Any] = json.load(f)
+        self.batch_size = batch_size
+        # Worker-процессы пула выставляют OMP_NUM_THREADS=1: N процессов
+        # с потоками по числу ядер каждый дрались бы за одни и те же ядра
+        self.threads = (
+            threads
+            if threads is not None
+            else int(
+                os.getenv("EMBED_ONNX_THREADS") or os.getenv("OMP_NUM_THREADS") or "0"
+            )
+        )
+        # Размер файла модели — для отчёта о памяти (см. memory_profile.model_nbytes)
+        self.model_bytes = os.path.getsize(model_path)
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self._tokenizer.enable_truncation(self.config["max_length"])
+        self._tokenizer.enable_padding(
+            pad_id=self.config["pad_id"], pad_token=self.config["pad_token"]
+        )
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {item.name for item in self._session.get_inputs()}
+        logger.info(
+            "OnnxEmbeddings initialized: model=%s, threads=%d, size=%.1f MB",
+            self.config["model_name"],
+            self.threads,
+            self.model_bytes / 2**20,
+        )
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        (hidden,) = self._session.run(
+            ["last_hidden_state"],
+            {
+                name: value
+                for name, value in inputs.items()
+                if name in self._input_names
+            },
+        )
+        # Среднее по токенам без паддинга
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize", True):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.clip(norms, 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги текстов батчами по batch_size."""
+        vectors = [
+            self._embed_batch(texts[start : start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        """Эмбеддинг одного запроса."""
+        return self._embed_batch([text])[0].tolist()
+
+
+def export_model(
+    model_name: str, out_dir: str, max_length: int = 256, normalize: bool = True
+):
+    """
+    Экспортирует модель HuggingFace в ONNX и квантизует веса в int8
+    (динамическая квантизация: активации квантизуются во время вызова).
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["пример запроса"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in sample
+    ]
+    dynamic_axes = {
+        name: {0: "batch", 1: "sequence"}
+        for name in input_names + ["last_hidden_state"]
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_dir)), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_dir)))
+    try:
+        # mkdtemp создаёт каталог с доступом только для владельца, а модель читает
+        # и процесс бота, запущенный от другого пользователя
+        os.chmod(tmp_dir, 0o755)
+        fp32_path = os.path.join(tmp_dir, "model_fp32.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+            )
+        quantize_dynamic(
+            fp32_path, os.path.join(tmp_dir, MODEL_FILE), weight_type=QuantType.QInt8
+        )
+        os.remove(fp32_path)
+        tokenizer.backend_tokenizer.save(os.path.join(tmp_dir, TOKENIZER_FILE))
+        with open(os.path.join(tmp_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "model_name": model_name,
+                    "max_length": max_length,
+                    "pad_id": tokenizer.pad_token_id,
+                    "pad_token": tokenizer.pad_token,
+                    "normalize": normalize,
+                },
+                f,
+                indent=2,
+            )
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info("Exported %s to %s", model_name, out_dir)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export an int8 ONNX embedding model")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--out", help="каталог модели (по умолчанию EMBED_ONNX_DIR)")
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--no-normalize", action="store_true")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    out_dir = args.out or onnx_model_dir(args.model)
+    export_model(args.model, out_dir, args.max_length, not args.no_normalize)
+    print(f"Model saved to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
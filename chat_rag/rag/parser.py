@@ -11,18 +11,24 @@
         квоты, дисциплины и важные ссылки.
 
 Константы:
-    URLS: Список URL магистерских программ ИТМО для парсинга.
+    URLS: Список URL магистерских программ ИТМО для парсинга по умолчанию — исходные
+        программы (SEED_PROGRAMS) и все программы из реестра (data/chunks). Коды программ
+        можно передать аргументами: python -m chat_rag.rag.parser ai ai_product <code>
 """
 
 import json
 import os
+import sys
 
 import requests
 from bs4 import BeautifulSoup
 
+from chat_rag.rag.dedup import dedup_chunks
+from chat_rag.rag.programs import PROGRAM_URL_TEMPLATE, SEED_PROGRAMS, get_registry
+
 URLS = [
-    "https://abit.itmo.ru/program/master/ai",
-    "https://abit.itmo.ru/program/master/ai_product",
+    PROGRAM_URL_TEMPLATE.format(program=code)
+    for code in dict.fromkeys([*SEED_PROGRAMS, *get_registry().codes()])
 ]
 
 
@@ -127,13 +133,17 @@ def extract_and_save_documents(url, output_dir="data"):
         + add_program_field(json_docs)
         + add_program_field(faq_docs)
     )
+    # FAQ и описания программы частично повторяют друг друга
+    all_docs, report = dedup_chunks(all_docs, name=os.path.basename(fname))
+    print(report.summary())
     with open(fname, "w", encoding="utf-8") as f:
         json.dump(all_docs, f, ensure_ascii=False, indent=2)
 
 
 if __name__ == "__main__":
     print("Запуск парсинга и сохранения документов...")
-    for url in URLS:
+    urls = [PROGRAM_URL_TEMPLATE.format(program=code) for code in sys.argv[1:]] or URLS
+    for url in urls:
         try:
             print(f"Обработка: {url}")
             extract_and_save_documents(url, output_dir="data/chunks")
@@ -3,10 +3,13 @@
 """
 
 import json
+import os
 import re
 
 import pdfplumber
 
+from chat_rag.rag.dedup import dedup_courses
+
 
 def parse_pdf_to_chunks(pdf_path, output_json, program_name):
     """
@@ -42,6 +45,9 @@ def parse_pdf_to_chunks(pdf_path, output_json, program_name):
                             "program": program_name,
                         }
                     )
+    # Дисциплина, читаемая в нескольких семестрах, занимает несколько строк плана
+    chunks, report = dedup_courses(chunks, name=os.path.basename(output_json))
+    print(report.summary())
     with open(output_json, "w", encoding="utf-8") as f:
         json.dump(chunks, f, ensure_ascii=False, indent=2)
 
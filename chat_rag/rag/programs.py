@@ -0,0 +1,355 @@
+"""
+Реестр магистерских программ, обнаруживаемых по файлам в data/chunks.
+
+Программа <code> описывается файлами:
+    <code>_chunks.json         — чанки со страницы программы (для ретривера);
+    <code>_courses_chunks.json — дисциплины учебного плана (для рекомендаций).
+
+Данные программ загружаются при первом обращении (LazyProgramCache), а редко
+используемые программы вытесняются, когда суммарный размер превышает бюджет памяти.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from langchain_core.documents import Document
+from pydantic import AfterValidator
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+CHUNKS_DIR = os.path.join(BASE_DIR, "data", "chunks")
+PROGRAM_URL_TEMPLATE = "https://abit.itmo.ru/program/master/{program}"
+# Исходные программы бота: с них начинается сбор данных на чистом checkout,
+# когда в data/chunks ещё ничего нет
+SEED_PROGRAMS = ("ai", "ai_product")
+
+CHUNKS_SUFFIX = "_chunks.json"
+COURSES_SUFFIX = "_courses_chunks.json"
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class ProgramInfo:
+    """Файлы данных одной программы."""
+
+    code: str
+    chunks_path: Optional[str] = None
+    courses_path: Optional[str] = None
+
+    @property
+    def url(self) -> str:
+        """Страница программы на abit.itmo.ru."""
+        return PROGRAM_URL_TEMPLATE.format(program=self.code)
+
+
+def chunks_fingerprint(chunks_dir: Optional[str] = None) -> str:
+    """
+    Отпечаток файлов данных программ по именам, размерам и времени изменения:
+    меняется, когда чанки перегенерированы, добавлены или удалены.
+    """
+    chunks_dir = chunks_dir or os.getenv("CHUNKS_DIR", CHUNKS_DIR)
+    digest = hashlib.sha1()
+    try:
+        filenames = sorted(os.listdir(chunks_dir))
+    except OSError:
+        filenames = []
+    for filename in filenames:
+        if not filename.endswith(CHUNKS_SUFFIX):
+            continue
+        try:
+            stat = os.stat(os.path.join(chunks_dir, filename))
+        except OSError:
+            continue
+        digest.update(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+class ProgramRegistry:
+    """
+    Реестр программ, построенный по содержимому каталога с чанками.
+    """
+
+    def __init__(self, chunks_dir: Optional[str] = None):
+        self.chunks_dir = chunks_dir or os.getenv("CHUNKS_DIR", CHUNKS_DIR)
+        self._programs: Dict[str, ProgramInfo] = {}
+        self.fingerprint = ""
+        self.discover()
+
+    def discover(self):
+        """Пересканирует каталог с чанками."""
+        self.fingerprint = chunks_fingerprint(self.chunks_dir)
+        chunks: Dict[str, str] = {}
+        courses: Dict[str, str] = {}
+        try:
+            filenames = sorted(os.listdir(self.chunks_dir))
+        except OSError as e:
+            logger.error("Cannot list chunks directory %s: %s", self.chunks_dir, e)
+            filenames = []
+        for filename in filenames:
+            path = os.path.join(self.chunks_dir, filename)
+            if filename.endswith(COURSES_SUFFIX):
+                courses[filename[: -len(COURSES_SUFFIX)]] = path
+            elif filename.endswith(CHUNKS_SUFFIX):
+                chunks[filename[: -len(CHUNKS_SUFFIX)]] = path
+        self._programs = {
+            code: ProgramInfo(code, chunks.get(code), courses.get(code))
+            for code in sorted(set(chunks) | set(courses))
+        }
+        logger.info("Discovered programs: %s", ", ".join(self._programs))
+
+    def codes(self) -> List[str]:
+        """Коды всех известных программ."""
+        return list(self._programs)
+
+    def get(self, code: str) -> ProgramInfo:
+        """
+        Возвращает описание программы.
+
+        Raises:
+            ValueError: если программа неизвестна
+        """
+        if code not in self._programs:
+            raise ValueError(
+                f"Неизвестная программа '{code}'. Доступны: {', '.join(self._programs)}"
+            )
+        return self._programs[code]
+
+    def load_documents(self, code: str) -> List[Document]:
+        """
+        Загружает чанки программы как Document для индексации.
+        """
+        program = self.get(code)
+        if not program.chunks_path:
+            return []
+        with open(program.chunks_path, encoding="utf-8") as f:
+            data = json.load(f)
+        docs = []
+        for item in data:
+            if "question" in item and "answer" in item:
+                text = f"Q: {item['question']}\nA: {item['answer']}"
+            else:
+                text = item.get("text", "")
+            metadata = {
+                k: v for k, v in item.items() if k not in ("text", "question", "answer")
+            }
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+    def load_courses(self, code: str) -> List[Dict[str, Any]]:
+        """
+        Загружает дисциплины учебного плана программы.
+        """
+        program = self.get(code)
+        if not program.courses_path:
+            return []
+        with open(program.courses_path, encoding="utf-8") as f:
+            data = json.load(f)
+        assert isinstance(data, list), "Неверный формат данных. Должен быть список."
+        for item in data:
+            assert (
+                isinstance(item, dict) and "name" in item
+            ), "Неверный формат данных. Каждый элемент должен быть словарем с ключом 'name'."
+        return data
+
+
+_registry: Optional[ProgramRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ProgramRegistry:
+    """Общий реестр программ процесса."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProgramRegistry()
+    return _registry
+
+
+def set_registry(registry: ProgramRegistry):
+    """Подменяет общий реестр (при перезагрузке базы знаний)."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+# Реестр, по которому строятся схемы инструментов нового агента до подмены общего
+_schema_registry: ContextVar[Optional[ProgramRegistry]] = ContextVar(
+    "schema_registry", default=None
+)
+
+
+@contextmanager
+def schema_registry(registry: ProgramRegistry) -> Iterator[None]:
+    """
+    Внутри блока JSON-схемы полей ProgramCode перечисляют программы registry,
+    а не общего реестра. Другие потоки и задачи по-прежнему видят общий реестр.
+    """
+    token = _schema_registry.set(registry)
+    try:
+        yield
+    finally:
+        _schema_registry.reset(token)
+
+
+def validate_program(code: str) -> str:
+    """
+    Проверяет, что программа есть в реестре.
+
+    Raises:
+        ValueError: если программа неизвестна
+    """
+    get_registry().get(code)
+    return code
+
+
+class _ProgramCodeSchema:
+    """
+    Подставляет в JSON-схему поля актуальный список программ из реестра
+    (или из реестра schema_registry, пока собирается новый агент).
+    """
+
+    def __get_pydantic_json_schema__(self, core_schema: Any, handler: Any) -> Any:
+        schema = handler(core_schema)
+        schema["enum"] = (_schema_registry.get() or get_registry()).codes()
+        return schema
+
+
+# Тип поля program в схемах инструментов: LLM видит список программ в enum
+ProgramCode = Annotated[str, AfterValidator(validate_program), _ProgramCodeSchema()]
+
+
+def deep_sizeof(obj: Any, _seen: Optional[set] = None) -> int:
+    """
+    Приблизительный размер объекта в памяти вместе с вложенными контейнерами.
+    """
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+class LazyProgramCache(Generic[T]):
+    """
+    Кэш данных программ с загрузкой при первом обращении и LRU-вытеснением
+    при превышении бюджета памяти. Только что загруженная программа не
+    вытесняется, даже если одна превышает бюджет.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[str], T],
+        sizer: Callable[[T], int],
+        budget_bytes: int,
+    ):
+        self.name = name
+        self._loader = loader
+        self._sizer = sizer
+        self.budget_bytes = budget_bytes
+        self._items: "OrderedDict[str, T]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, code: str) -> T:
+        """Возвращает данные программы, загружая их при необходимости."""
+        with self._lock:
+            if code in self._items:
+                self._items.move_to_end(code)
+                return self._items[code]
+            load_lock = self._load_locks.setdefault(code, threading.Lock())
+
+        # Загрузка одной программы не блокирует обращения к другим
+        with load_lock:
+            with self._lock:
+                if code in self._items:
+                    self._items.move_to_end(code)
+                    return self._items[code]
+            value = self._loader(code)
+            size = self._sizer(value)
+            with self._lock:
+                self._items[code] = value
+                self._sizes[code] = size
+                self.loads += 1
+                self._evict(keep=code)
+            logger.info(
+                "%s: loaded program '%s' (%.1f MB)", self.name, code, size / 2**20
+            )
+            return value
+
+    def _evict(self, keep: str):
+        while self.total_bytes() > self.budget_bytes and len(self._items) > 1:
+            code = next(iter(self._items))
+            if code == keep:
+                break
+            del self._items[code]
+            size = self._sizes.pop(code)
+            self.evictions += 1
+            logger.info(
+                "%s: evicted program '%s' (%.1f MB)", self.name, code, size / 2**20
+            )
+
+    def items(self) -> List[Tuple[str, T]]:
+        """Загруженные программы и их данные."""
+        with self._lock:
+            return list(self._items.items())
+
+    def total_bytes(self) -> int:
+        """Суммарный размер загруженных программ."""
+        return sum(self._sizes.values())
+
+    def clear(self):
+        """Выгружает все программы."""
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает состояние кэша.
+
+        Returns:
+            Словарь со статистикой
+        """
+        with self._lock:
+            return {
+                "loaded": list(self._items),
+                "bytes": self.total_bytes(),
+                "program_bytes": dict(self._sizes),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -1,83 +1,343 @@
-import json
+import asyncio
+import logging
 import os
-from typing import Any, Dict, Union
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Sequence
 
 from dotenv import load_dotenv
-from langchain.agents import AgentType, initialize_agent
-from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
-from langchain.schema import Document
-from langchain_openai import ChatOpenAI
+from langchain.agents import AgentExecutor, create_openai_tools_agent
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import BaseTool
 
 from chat_rag.rag.courses_recommender import CoursesRecommender
+from chat_rag.rag.history import DialogHistory, History, to_messages
+from chat_rag.rag.llm_guard import (
+    GuardedChatOpenAI,
+    LLMUnavailableError,
+    get_guard,
+)
+from chat_rag.rag.logging_setup import SAMPLED
 from chat_rag.rag.retriever import RetrieverTool
+from chat_rag.rag.programs import (
+    PROGRAM_URL_TEMPLATE,
+    SEED_PROGRAMS,
+    ProgramRegistry,
+    deep_sizeof,
+    get_registry,
+    schema_registry,
+    set_registry,
+)
 from chat_rag.rag.prompts import AGENT_SYSTEM_PROMPT
+from chat_rag.rag.singleflight import get_group, normalize_query
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Начало ответа при недоступной LLM, ссылки на программы добавляет degraded_answer()
+DEGRADED_ANSWER_TEXT = (
+    "Сейчас сервис ответов перегружен, и я не могу ответить на ваш вопрос. "
+    "Пожалуйста, повторите его через минуту. Подробная информация о программах: "
+)
+ANSWER_CACHE_SIZE = int(os.getenv("LLM_FALLBACK_CACHE_SIZE", "256"))
+AGENT_MODEL = "gpt-4.1-mini"
+# Бюджет на весь ход агента: все вызовы модели и инструментов
+AGENT_TURN_TIMEOUT_S = float(os.getenv("AGENT_TURN_TIMEOUT_S", "60"))
+# Трассировка шагов агента в stdout (для отладки)
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() == "true"
+
 
-# Load knowledge base documents
-def load_documents():
+def get_index_dir() -> str:
+    """
+    Каталог индекса ретривера на диске (общий для всех процессов на хосте).
+    """
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-    chunks_dir = os.path.join(base_dir, "data", "chunks")
-    paths = [
-        os.path.join(chunks_dir, "ai_chunks.json"),
-        os.path.join(chunks_dir, "ai_product_chunks.json"),
+    return os.getenv("RETRIEVER_INDEX_DIR", os.path.join(base_dir, "data", "index"))
+
+
+@dataclass(frozen=True)
+class KnowledgeBaseVersion:
+    """Версия базы знаний (чанков программ), с которой работает агент."""
+
+    version: int
+    fingerprint: str
+    programs: List[str]
+    loaded_at: float
+    build_s: float
+
+
+_agent: Optional[AgentExecutor] = None
+_kb_version: Optional[KnowledgeBaseVersion] = None
+_agent_lock = threading.Lock()
+
+
+def _build_agent(tools: Sequence[BaseTool], registry: ProgramRegistry) -> AgentExecutor:
+    """
+    Собирает агента с инструментами tools. Схемы инструментов (список программ
+    в enum) строятся по registry: при перезагрузке он ещё не стал общим.
+    """
+    llm = GuardedChatOpenAI(
+        model=AGENT_MODEL,
+        temperature=0.0,
+    )
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", AGENT_SYSTEM_PROMPT),
+            MessagesPlaceholder("chat_history", optional=True),
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad"),
+        ]
+    )
+    # Модель может запросить несколько инструментов в одном ответе;
+    # AgentExecutor.ainvoke выполняет их одновременно
+    with schema_registry(registry):
+        agent = create_openai_tools_agent(llm, tools, prompt)
+    return AgentExecutor(
+        agent=agent,
+        tools=list(tools),
+        memory=None,
+        verbose=AGENT_VERBOSE,
+    )
+
+
+def get_agent() -> AgentExecutor:
+    """
+    Возвращает агента, создавая его (и инструменты) при первом обращении.
+    Ленивая инициализация позволяет фронтовому процессу не загружать модели,
+    когда запросы обрабатываются в отдельных worker-процессах.
+    """
+    global _agent, _kb_version
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                started = time.monotonic()
+                registry = get_registry()
+                tools = [
+                    RetrieverTool(registry, index_dir=get_index_dir()),
+                    CoursesRecommender(registry),
+                ]
+                _agent = _build_agent(tools, registry)
+                if _kb_version is None:
+                    _kb_version = KnowledgeBaseVersion(
+                        version=1,
+                        fingerprint=registry.fingerprint,
+                        programs=registry.codes(),
+                        loaded_at=time.time(),
+                        build_s=time.monotonic() - started,
+                    )
+    return _agent
+
+
+def _reload() -> Dict[str, Any]:
+    global _agent, _kb_version
+    started = time.monotonic()
+    registry = ProgramRegistry()
+    with _agent_lock:
+        agent, previous = _agent, _kb_version
+    # Новые индексы и каталоги готовятся, пока старая версия обслуживает запросы
+    new_agent = None
+    if agent is not None:
+        new_agent = _build_agent(
+            [
+                tool.reloaded(registry) if hasattr(tool, "reloaded") else tool
+                for tool in agent.tools
+            ],
+            registry,
+        )
+    version = KnowledgeBaseVersion(
+        version=previous.version + 1 if previous else 1,
+        fingerprint=registry.fingerprint,
+        programs=registry.codes(),
+        loaded_at=time.time(),
+        build_s=time.monotonic() - started,
+    )
+    # Подмена: новые ходы берут нового агента, начатые дорабатывают со старым
+    with _agent_lock:
+        set_registry(registry)
+        if new_agent is not None:
+            _agent = new_agent
+        _kb_version = version
+    logger.info(
+        "Knowledge base reloaded: version=%d, fingerprint=%s, build=%.2fs",
+        version.version,
+        version.fingerprint,
+        version.build_s,
+    )
+    return {
+        **asdict(version),
+        "previous_version": previous.version if previous else None,
+        "changed": previous is None or previous.fingerprint != version.fingerprint,
+    }
+
+
+def reload_knowledge_base() -> Dict[str, Any]:
+    """
+    Перезагружает базу знаний без остановки: заново находит программы в data/chunks,
+    строит индексы ретривера и каталоги курсов для загруженных программ и атомарно
+    подменяет ими агента. Одновременные вызовы объединяются в одну перезагрузку.
+
+    Returns:
+        Новая версия базы знаний, время сборки и номер предыдущей версии
+    """
+    return get_group("kb_reload").do("reload", _reload)
+
+
+async def aprocess_message(user_message: str, history: Optional[History] = None) -> str:
+    """
+    Один ход агента. Независимые вызовы инструментов из одного ответа модели
+    выполняются параллельно; весь ход ограничен AGENT_TURN_TIMEOUT_S.
+
+    Args:
+        user_message: Вопрос пользователя
+        history: Предыдущие сообщения диалога (role, text) для слота chat_history;
+            история только читается, ответ в неё добавляет вызывающий код
+    """
+    agent = _agent if _agent is not None else await asyncio.to_thread(get_agent)
+    version = _kb_version.version if _kb_version else 0
+    history = list(history or [])
+    inputs: Dict[str, Any] = {"input": user_message}
+    if history:
+        inputs["chat_history"] = to_messages(history)
+    started = time.monotonic()
+    # Ответ зависит от вопроса и истории: один ход агента разделяют одинаковые
+    # одновременные вопросы с одинаковым контекстом (чаще всего — первые в диалоге)
+    try:
+        result = await asyncio.wait_for(
+            get_group("agent").ado(
+                (version, normalize_query(user_message), tuple(history)),
+                lambda: agent.ainvoke(inputs),
+            ),
+            AGENT_TURN_TIMEOUT_S,
+        )
+    except asyncio.TimeoutError:
+        get_guard(AGENT_MODEL).count("turn_timeout")
+        return fallback_answer(
+            user_message, LLMUnavailableError(AGENT_MODEL, "turn timeout")
+        )
+    except LLMUnavailableError as e:
+        return fallback_answer(user_message, e)
+    answer = result["output"]
+    logger.info(
+        "Agent turn finished",
+        extra={"latency_ms": round((time.monotonic() - started) * 1000), **SAMPLED},
+    )
+    if not history:
+        # В кэш фолбэка попадают только ответы, не зависящие от диалога
+        _remember_answer(user_message, answer)
+    return answer
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Фоновый event loop процесса для синхронных вызовов агента. Один loop на процесс:
+    асинхронные HTTP-клиенты моделей нельзя использовать из разных loop.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="rag-agent-loop", daemon=True
+                ).start()
+                _loop = loop
+    return _loop
+
+
+def process_message(user_message: str, history: Optional[History] = None) -> str:
+    """
+    Синхронная обёртка над aprocess_message для потоков worker-процессов
+    и CLI: ход выполняется в фоновом event loop процесса.
+    """
+    return asyncio.run_coroutine_threadsafe(
+        aprocess_message(user_message, history), _get_loop()
+    ).result()
+
+
+def degraded_answer() -> str:
+    """
+    Ответ, когда LLM недоступна и в кэше нет ответа на такой же вопрос:
+    ссылки на страницы программ из реестра (исходные программы, пока реестр пуст).
+    """
+    registry = get_registry()
+    urls = [registry.get(code).url for code in registry.codes()] or [
+        PROGRAM_URL_TEMPLATE.format(program=code) for code in SEED_PROGRAMS
     ]
-    docs = []
-    for path in paths:
-        try:
-            with open(path, encoding="utf-8") as f:
-                data = json.load(f)
-            for item in data:
-                if "question" in item and "answer" in item:
-                    text = f"Q: {item['question']}\nA: {item['answer']}"
-                else:
-                    text = item.get("text", "")
-                metadata = {
-                    k: v
-                    for k, v in item.items()
-                    if k not in ("text", "question", "answer")
-                }
-                docs.append(Document(page_content=text, metadata=metadata))
-        except Exception as e:
-            print(f"Error loading {path}: {e}")
-    return docs
-
-
-# Initialize tools and agent
-_docs = load_documents()
-retriever_tool = RetrieverTool(docs=_docs)
-courses_tool = CoursesRecommender()
-_tools = [retriever_tool, courses_tool]
-_llm = ChatOpenAI(
-    model="gpt-4.1-mini",
-    temperature=0.0,
-)
+    return DEGRADED_ANSWER_TEXT + ", ".join(urls)
+
+
+# Кэш ответов для фолбэка, ключ — нормализованный вопрос. В нём хранятся
+# только ответы, не зависящие от контекста пользователя: иначе при недоступной
+# LLM один пользователь мог бы получить ответ, построенный по чужому диалогу
+_answer_cache: "OrderedDict[str, str]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+
+def _remember_answer(question: str, answer: str):
+    """Запоминает ответ на вопрос; ответ не должен зависеть от истории диалога."""
+    with _answer_cache_lock:
+        _answer_cache[normalize_query(question)] = answer
+        _answer_cache.move_to_end(normalize_query(question))
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+
+def fallback_answer(question: str, error: LLMUnavailableError) -> str:
+    """
+    Ответ при недоступной LLM: последний ответ на такой же вопрос
+    или деградированный ответ.
+    """
+    guard = get_guard(error.guard)
+    with _answer_cache_lock:
+        cached = _answer_cache.get(normalize_query(question))
+    if cached is not None:
+        guard.count("fallback_cached")
+        logger.warning("LLM unavailable (%s), answering from cache", error.reason)
+        return cached
+    guard.count("fallback_degraded")
+    logger.warning("LLM unavailable (%s), sending degraded answer", error.reason)
+    return degraded_answer()
 
-# Инициализация агента один раз
-agent = initialize_agent(
-    tools=_tools,
-    llm=_llm,
-    agent=AgentType.OPENAI_FUNCTIONS,
-    memory=None,
-    verbose=True,
-    agent_kwargs={"system_message": AGENT_SYSTEM_PROMPT},
-)
 
+def memory_report() -> Dict[str, Any]:
+    """
+    Размеры компонентов агента в памяти процесса. Агент не создаётся,
+    если ещё не был загружен.
 
-def process_message(
-    user_message: str,
-    memory: Union[ConversationBufferMemory, ConversationBufferWindowMemory],
-) -> str:
-    agent.memory = memory
-    return agent.run(input=user_message)
+    Returns:
+        Словарь с размерами по компонентам
+    """
+    with _answer_cache_lock:
+        report: Dict[str, Any] = {
+            "answer_cache": {
+                "entries": len(_answer_cache),
+                "bytes": deep_sizeof(_answer_cache),
+            }
+        }
+    if _kb_version is not None:
+        report["knowledge_base"] = asdict(_kb_version)
+    if _agent is None:
+        report["agent"] = "not loaded"
+        return report
+    for tool in _agent.tools:
+        if hasattr(tool, "memory_report"):
+            report[tool.name] = tool.memory_report()
+    return report
 
 
 # Example entry point for CLI testing
 if __name__ == "__main__":
     print("Telegram RAG Agent. Type your message below.")
-    memory = ConversationBufferMemory()
+    history = DialogHistory()
     while True:
         msg = input("User: ")
-        resp = process_message(msg, memory)
+        resp = process_message(msg, history.pairs())
+        history.add_exchange(msg, resp)
         print("Agent:", resp)
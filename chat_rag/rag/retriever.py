@@ -1,63 +1,204 @@
-from typing import Any, ClassVar, Type, Literal
+from typing import Any, ClassVar, Dict, Optional, Type
+import asyncio
 import logging
+import os
 from pydantic import BaseModel, Field, PrivateAttr
 
 from langchain.tools import BaseTool
 from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+from chat_rag.rag.embeddings import (
+    BatchingEmbeddings,
+    CachedQueryEmbeddings,
+    create_embeddings,
+)
+from chat_rag.rag.programs import (
+    LazyProgramCache,
+    ProgramCode,
+    ProgramRegistry,
+    deep_sizeof,
+    get_registry,
+)
+from chat_rag.rag.memory_profile import model_nbytes
+from chat_rag.rag.logging_setup import SAMPLED
+from chat_rag.rag.singleflight import get_group, normalize_query
+from chat_rag.rag.vector_store import MmapDocstore, index_nbytes, load_or_build_store
+
+logger = logging.getLogger(__name__)
 
 
 class RetrieverInput(BaseModel):
     query: str = Field(..., min_length=1, description="Краткий запрос (1–3 фразы)")
-    program: Literal["ai", "ai_product"] = Field(..., description="Программа")
+    program: ProgramCode = Field(..., description="Программа")
+
+
+def documents_nbytes(vectorstore: FAISS) -> int:
+    """
+    Размер документов хранилища: отображённый файл для MmapDocstore,
+    объекты Document в памяти — для остальных.
+    """
+    docstore = vectorstore.docstore
+    if isinstance(docstore, MmapDocstore):
+        return docstore.nbytes
+    return deep_sizeof(getattr(docstore, "_dict", {}))
+
+
+def estimate_store_bytes(vectorstore: FAISS) -> int:
+    """
+    Приблизительный объём памяти, занимаемый индексом и документами.
+    """
+    return index_nbytes(vectorstore.index) + documents_nbytes(vectorstore)
 
 
 class RetrieverTool(BaseTool):
     """
     Инструмент для семантического поиска документов с помощью FAISS и HuggingFace embeddings.
-    Поддерживает фильтрацию по программе через метаданные.
-    docs — список объектов Document, где текст хранится в page_content, а метаинформация (type, source, program) — в metadata.
+    У каждой программы свой индекс: он строится (или открывается с диска) при первом
+    запросе по программе и может быть вытеснен, если индексы не помещаются в бюджет памяти.
     """
 
     name: str = "retriever"
     description: str = "Поиск релевантных документов по семантическому сходству."
     args_schema: ClassVar[Type[BaseModel]] = RetrieverInput  # <-- ВАЖНО
-    _retriever: Any = PrivateAttr(default=None)  # <-- чтобы не было полем модели
+    _retrievers: Any = PrivateAttr(default=None)  # <-- чтобы не было полем модели
+    _embeddings: Any = PrivateAttr(default=None)
+    _registry: Any = PrivateAttr(default=None)
+    _model_name: str = PrivateAttr(default="")
+    _index_dir: Optional[str] = PrivateAttr(default=None)
+    _index_type: str = PrivateAttr(default="auto")
 
     def __init__(
         self,
-        docs: list[Document],
+        registry: Optional[ProgramRegistry] = None,
         model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
         name: str = "retriever",
         description: str = "Поиск релевантных документов по семантическому сходству.",
+        index_dir: Optional[str] = None,
+        index_type: Optional[str] = None,
+        memory_budget_mb: Optional[int] = None,
     ):
         """
         Инициализация RetrieverTool.
-        docs: список объектов Document для индексации (page_content — текст, metadata — метаинформация)
+        registry: реестр программ, из которого берутся документы для индексации
         model_name: название модели HuggingFace для эмбеддингов
         name: имя инструмента
         description: описание инструмента
+        index_dir: каталог индекса на диске; если задан, индекс открывается через mmap
+            и пересобирается только при изменении документов или модели
+        index_type: тип FAISS-индекса (auto, flat, ivf, hnsw, ivfpq); auto выбирает
+            тип по размеру корпуса
+        memory_budget_mb: бюджет памяти на индексы загруженных программ
         """
-        logging.info(
-            f"Инициализация RetrieverTool: name={name}, model_name={model_name}, docs_count={len(docs)}"
-        )
         super().__init__(name=name, description=description)
-        logging.info("Создание эмбеддингов HuggingFace...")
-        embeddings = HuggingFaceEmbeddings(model_name=model_name)
-        texts = [doc.page_content for doc in docs]
-        metadatas = [doc.metadata for doc in docs]
-        logging.info(f"Индексация {len(texts)} документов в FAISS...")
-        vectorstore = FAISS.from_texts(texts, embedding=embeddings, metadatas=metadatas)
-        self._retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-        logging.info("RetrieverTool успешно инициализирован.")
+        self._registry = registry or get_registry()
+        logger.info(
+            "Инициализация RetrieverTool: name=%s, model_name=%s, programs=%s",
+            name,
+            model_name,
+            self._registry.codes(),
+        )
+        logger.info("Создание эмбеддингов...")
+        base_embeddings, model_id = create_embeddings(model_name)
+        # Повторные запросы берутся из кэша, а одновременные запросы разных
+        # пользователей эмбеддятся одним батчем
+        self._embeddings = CachedQueryEmbeddings(
+            BatchingEmbeddings(base_embeddings), model_id
+        )
+        self._model_name = model_id
+        self._index_dir = index_dir
+        self._index_type = index_type or os.getenv("RETRIEVER_INDEX_TYPE", "auto")
+        budget_mb = memory_budget_mb or int(
+            os.getenv("RETRIEVER_MEMORY_BUDGET_MB", "1024")
+        )
+        self._retrievers = self._make_cache(budget_mb * 2**20)
+        logger.info("RetrieverTool успешно инициализирован.")
+
+    def _make_cache(self, budget_bytes: int) -> LazyProgramCache:
+        return LazyProgramCache(
+            "RetrieverTool",
+            loader=self._load_retriever,
+            sizer=lambda retriever: (
+                estimate_store_bytes(retriever.vectorstore) if retriever else 0
+            ),
+            budget_bytes=budget_bytes,
+        )
+
+    def reloaded(self, registry: ProgramRegistry) -> "RetrieverTool":
+        """
+        Копия инструмента с документами из нового реестра. Модель эмбеддингов
+        общая; индексы программ, загруженных сейчас, строятся (или открываются
+        с диска) заранее. Текущий экземпляр не меняется и дообслуживает начатые
+        запросы.
+        """
+        tool = self.model_copy()
+        tool._registry = registry
+        tool._retrievers = tool._make_cache(self._retrievers.budget_bytes)
+        for program, _ in self._retrievers.items():
+            if program in registry.codes():
+                tool._retrievers.get(program)
+        return tool
+
+    def _load_retriever(self, program: str) -> Any:
+        """
+        Строит или открывает индекс программы. Для программы без чанков возвращает None.
+        """
+        docs = self._registry.load_documents(program)
+        if not docs:
+            logger.warning("Нет документов для программы '%s'", program)
+            return None
+        if self._index_dir:
+            vectorstore = load_or_build_store(
+                os.path.join(self._index_dir, program),
+                docs,
+                self._embeddings,
+                self._model_name,
+                self._index_type,
+            )
+        else:
+            texts = [doc.page_content for doc in docs]
+            metadatas = [doc.metadata for doc in docs]
+            logger.info("Индексация %d документов в FAISS...", len(texts))
+            vectorstore = FAISS.from_texts(
+                texts, embedding=self._embeddings, metadatas=metadatas
+            )
+        return vectorstore.as_retriever(search_kwargs={"k": 3})
+
+    def memory_report(self) -> Dict[str, Any]:
+        """
+        Размеры модели эмбеддингов и загруженных индексов программ.
+
+        Returns:
+            Словарь с размерами в байтах
+        """
+        # Кэш запросов -> батчер -> модель
+        base = self._embeddings.base.base
+        client = getattr(base, "_client", None)
+        programs = {}
+        for program, retriever in self._retrievers.items():
+            if retriever is None:
+                continue
+            vectorstore = retriever.vectorstore
+            programs[program] = {
+                "docs": vectorstore.index.ntotal,
+                "index_bytes": index_nbytes(vectorstore.index),
+                "documents_bytes": documents_nbytes(vectorstore),
+                "mmap": isinstance(vectorstore.docstore, MmapDocstore),
+            }
+        return {
+            "embedding_model_bytes": model_nbytes(
+                client if client is not None else base
+            ),
+            "programs": programs,
+            "cache": self._retrievers.get_stats(),
+            "query_cache": self._embeddings.get_stats(),
+        }
 
     def _run(self, *args, **kwargs):
         """
         Синхронный поиск релевантных документов по запросу.
         Аргументы:
             query: строка запроса (первый аргумент или ключ 'query')
-            program: название программы для фильтрации (обязательно)
+            program: код программы, по индексу которой выполняется поиск (обязательно)
         Возвращает:
             Строки найденных документов, объединённые через перевод строки.
         """
@@ -68,14 +209,29 @@ class RetrieverTool(BaseTool):
             raise ValueError("Parameter 'query' is required and cannot be empty.")
         if not program:
             raise ValueError("Parameter 'program' is required and cannot be empty.")
-        logging.info(f"Запуск поиска: query='{query}', program='{program}'")
-        # Фильтрация по программе задана явно
-        if program:
-            logging.info(f"Фильтрация по программе: {program}")
-            results = self._retriever.invoke(query, filter={"program": program})
-        else:
-            results = self.retriever.invoke(query)
-        logging.info(f"Найдено документов: {len(results)}")
+        logger.debug("Запуск поиска: program='%s', query='%s'", program, query)
+        return get_group("retriever").do(
+            (normalize_query(query), program), lambda: self._search(query, program)
+        )
+
+    def _search(self, query: str, program: str) -> str:
+        retriever = self._retrievers.get(program)
+        results = retriever.invoke(query) if retriever else []
+        logger.info(
+            "Поиск выполнен",
+            extra={"program": program, "docs": len(results), **SAMPLED},
+        )
+        return "\n".join([doc.page_content for doc in results])
+
+    async def _asearch(self, query: str, program: str) -> str:
+        # Загрузка индекса программы может читать диск — выполняем её вне event loop
+        retriever = await asyncio.to_thread(self._retrievers.get, program)
+        # Эмбеддинг запроса ждёт батч без блокировки event loop
+        results = await retriever.ainvoke(query) if retriever else []
+        logger.info(
+            "Поиск выполнен",
+            extra={"program": program, "docs": len(results), **SAMPLED},
+        )
         return "\n".join([doc.page_content for doc in results])
 
     async def _arun(self, *args, **kwargs):
@@ -83,7 +239,7 @@ class RetrieverTool(BaseTool):
         Асинхронный поиск релевантных документов по запросу.
         Аргументы:
             query: строка запроса (первый аргумент или ключ 'query')
-            program: название программы для фильтрации (обязательно)
+            program: код программы, по индексу которой выполняется поиск (обязательно)
         Возвращает:
             Строки найденных документов, объединённые через перевод строки.
         """
@@ -94,5 +250,8 @@ class RetrieverTool(BaseTool):
             raise ValueError("Parameter 'query' is required and cannot be empty.")
         if not program:
             raise ValueError("Parameter 'program' is required and cannot be empty.")
-        logging.info(f"[async] Запуск поиска: query='{query}', program='{program}'")
-        return self._run(query, program=program)
+        logger.debug("[async] Запуск поиска: program='%s', query='%s'", program, query)
+        # Одинаковые одновременные запросы разделяют один поиск
+        return await get_group("retriever").ado(
+            (normalize_query(query), program), lambda: self._asearch(query, program)
+        )
@@ -0,0 +1,181 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Пока вычисление по ключу выполняется, повторные вызовы с тем же ключом не запускают
+своё, а ждут результата первого и получают тот же ответ (или ту же ошибку).
+После завершения ключ освобождается: результат не кэшируется. Асинхронное
+вычисление отменяется, когда его перестал ждать последний вызывающий.
+
+Ожидание реализовано на concurrent.futures.Future, поэтому вызовы из потоков
+(do) и из корутин разных event loop (ado) объединяются друг с другом.
+"""
+
+import asyncio
+import re
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def normalize_query(text: str) -> str:
+    """Текст запроса для ключа: регистр и пробельные символы не различаются."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class _Call:
+    """Идущее вычисление: его future, число ожидающих и задача (для ado)."""
+
+    __slots__ = ("future", "waiters", "task")
+
+    def __init__(self):
+        self.future: Future = Future()
+        # Отмена ожидания одним из вызывающих не должна отменять общее вычисление
+        self.future.set_running_or_notify_cancel()
+        self.waiters = 0
+        self.task: Optional[asyncio.Future] = None
+
+
+class SingleFlight:
+    """
+    Группа объединяемых вызовов одного вида (ответ агента, поиск, план курсов).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self._counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> Tuple[_Call, bool]:
+        """
+        Возвращает вычисление по ключу и признак, что вызывающий — ведущий
+        и должен выполнить вычисление сам.
+        """
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self._counters["executed"] += 1
+            else:
+                self._counters["coalesced"] += 1
+            call.waiters += 1
+            return call, leader
+
+    def _leave(self, key: Hashable, call: _Call):
+        """
+        Ожидающий ado отменён (например, по таймауту хода): если вычисление больше
+        никто не ждёт, его задача отменяется, чтобы не работать впустую.
+        """
+        with self._lock:
+            call.waiters -= 1
+            task = call.task if call.waiters == 0 else None
+            if task is not None and not task.done():
+                self._counters["abandoned"] += 1
+                # Новые вызовы с этим ключом не должны присоединяться к отменяемому
+                if self._in_flight.get(key) is call:
+                    del self._in_flight[key]
+            else:
+                task = None
+        if task is not None:
+            # Ожидающий мог быть из другого event loop: отмена — в loop задачи
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def _finish(self, key: Hashable, call: _Call, result: Any, error: Any):
+        with self._lock:
+            if self._in_flight.get(key) is call:
+                del self._in_flight[key]
+            if error is not None:
+                self._counters["errors"] += 1
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Выполняет fn() или ждёт уже идущего вычисления с тем же ключом.
+        """
+        call, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, call, None, e)
+                raise
+            self._finish(key, call, result, None)
+            return result
+        return call.future.result()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Асинхронный вариант do. Вычисление ведущего выполняется отдельной задачей:
+        отмена одного из ожидающих его не прерывает, а отмена последнего
+        (например, по таймауту хода) отменяет и вычисление.
+        """
+        call, leader = self._join(key)
+        if leader:
+            try:
+                task = asyncio.ensure_future(fn())
+            except BaseException as e:
+                self._finish(key, call, None, e)
+                raise
+
+            def done(task: "asyncio.Task[T]"):
+                # task.result() упавшей задачи поднимает её ошибку: ключ бы не освободился
+                if task.cancelled():
+                    self._finish(key, call, None, asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self._finish(key, call, None, task.exception())
+                else:
+                    self._finish(key, call, task.result(), None)
+
+            with self._lock:
+                call.task = task
+            task.add_done_callback(done)
+        try:
+            return await asyncio.wrap_future(call.future)
+        except asyncio.CancelledError:
+            self._leave(key, call)
+            raise
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Счётчики: calls — всего вызовов, executed — реальных вычислений,
+        coalesced — вызовов, получивших чужой результат, errors — вычислений
+        с ошибкой, abandoned — вычислений, отменённых без ожидающих,
+        in_flight — выполняется сейчас.
+
+        Returns:
+            Словарь со статистикой
+        """
+        with self._lock:
+            stats = {
+                key: self._counters[key]
+                for key in ("calls", "executed", "coalesced", "errors", "abandoned")
+            }
+            stats["in_flight"] = len(self._in_flight)
+        return stats
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str) -> SingleFlight:
+    """Общая для процесса группа single-flight name."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def get_singleflight_stats() -> Dict[str, Dict[str, int]]:
+    """Статистика всех групп single-flight процесса."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.get_stats() for group in groups}
@@ -0,0 +1,421 @@
+"""
+Хранилище векторного индекса на диске в формате, пригодном для memory-mapping.
+
+directory — символическая ссылка на каталог версии (<directory>.v<время>-<pid>).
+Новая версия записывается в свой каталог и публикуется атомарной подменой ссылки,
+предыдущая версия сохраняется, более старые удаляются.
+
+Структура каталога версии:
+    manifest.json — отпечаток корпуса и модели, размерность, число документов;
+    index.faiss   — FAISS-индекс, открывается через mmap без копирования;
+    docs.bin      — документы (текст и метаданные) в виде JSON-записей подряд;
+    offsets.npy   — смещения записей в docs.bin (count + 1 значений).
+
+Все процессы на одном хосте открывают одни и те же файлы, поэтому векторы
+и тексты документов лежат в общих страницах page cache, а новый процесс
+не тратит время на эмбеддинг корпуса.
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.bin"
+OFFSETS_FILE = "offsets.npy"
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+# Пороги режима auto по chat_rag/rag/index_benchmark.py (см. README): до 10 000
+# документов flat укладывается в 1 мс, HNSW держит recall@3 >= 0.995 до 300 000
+# (больших корпусов не мерили); IVF-PQ теряет 20-25% полноты и сам не выбирается
+AUTO_FLAT_MAX_DOCS = 10_000
+AUTO_MEASURED_MAX_DOCS = 300_000
+# Обучение PQ: 256 центроидов на подквантизатор, FAISS требует не меньше
+# 39 обучающих векторов на центроид
+PQ_MIN_TRAIN_DOCS = 256 * 39
+# Попытки открыть индекс, если его версия исчезла во время открытия
+OPEN_ATTEMPTS = 3
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+
+
+class MmapDocstore(Docstore):
+    """
+    Docstore поверх memory-mapped файла: Document создаётся только при обращении.
+    Идентификатор документа — его позиция в индексе в виде строки.
+    """
+
+    def __init__(self, directory: str):
+        self._offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, DOCS_FILE), "rb") as f:
+            # Пустой файл нельзя отобразить в память
+            self._data: Union[mmap.mmap, bytes] = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(f.fileno()).st_size
+                else b""
+            )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Размер отображённых данных документов."""
+        return len(self._data) + self._offsets.nbytes
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Возвращает документ по идентификатору."""
+        position = int(search)
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        record = json.loads(self._data[start:end].decode("utf-8"))
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+
+class PositionalIds(Mapping):
+    """
+    Отображение позиции в индексе на идентификатор документа без хранения словаря.
+    """
+
+    def __init__(self, count: int):
+        self._count = count
+
+    def __getitem__(self, position: Any) -> str:
+        position = int(position)
+        if not 0 <= position < self._count:
+            raise KeyError(position)
+        return str(position)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._count))
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def resolve_index_type(index_type: str, count: int) -> str:
+    """
+    Выбирает тип индекса. Для "auto" до AUTO_FLAT_MAX_DOCS используется точный
+    поиск, дальше — HNSW. IVF-PQ (сжатые векторы, заметно ниже полнота) выбирается
+    только явно.
+
+    Raises:
+        ValueError: неизвестный тип или корпус слишком мал для обучения ivfpq
+    """
+    index_type = index_type.lower()
+    if index_type not in INDEX_TYPES + ("auto",):
+        raise ValueError(f"Unknown index type: {index_type}")
+    if index_type == "auto":
+        if count <= AUTO_FLAT_MAX_DOCS:
+            return "flat"
+        if count > AUTO_MEASURED_MAX_DOCS:
+            logger.warning(
+                "Corpus of %d docs is beyond the benchmarked range (%d), using hnsw; "
+                "check recall with chat_rag.rag.index_benchmark",
+                count,
+                AUTO_MEASURED_MAX_DOCS,
+            )
+        return "hnsw"
+    check_training_size(index_type, count)
+    return index_type
+
+
+def check_training_size(index_type: str, count: int):
+    """
+    Проверяет, что документов хватает для обучения индекса.
+
+    Raises:
+        ValueError: если корпус меньше PQ_MIN_TRAIN_DOCS для ivfpq
+    """
+    if index_type == "ivfpq" and count < PQ_MIN_TRAIN_DOCS:
+        raise ValueError(
+            f"Index type ivfpq needs at least {PQ_MIN_TRAIN_DOCS} documents to train "
+            f"the product quantizer, got {count}; use flat or hnsw"
+        )
+
+
+def _ivf_nlist(count: int) -> int:
+    # ~4*sqrt(N) списков, но не меньше 39 обучающих векторов на список
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # По 8 измерений на подквантизатор; m должно делить размерность
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors: np.ndarray, index_type: str) -> Tuple[Any, Dict[str, int]]:
+    """
+    Строит FAISS-индекс указанного типа (flat, ivf, hnsw, ivfpq).
+
+    Returns:
+        Индекс и параметры поиска, которые нужно применять при каждом открытии
+    """
+    count, dim = vectors.shape
+    search_params: Dict[str, int] = {}
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        search_params["efSearch"] = int(os.getenv("RETRIEVER_EF_SEARCH", "64"))
+    elif index_type in ("ivf", "ivfpq"):
+        check_training_size(index_type, count)
+        nlist = _ivf_nlist(count)
+        spec = f"IVF{nlist},Flat"
+        if index_type == "ivfpq":
+            spec = f"IVF{nlist},PQ{_pq_subquantizers(dim)}"
+        index = faiss.index_factory(dim, spec)
+        if index_type == "ivfpq":
+            # Полисемантическое обучение PQ очень долгое и поиску не нужно
+            faiss.downcast_index(index).do_polysemous_training = False
+        index.train(vectors)
+        search_params["nprobe"] = int(
+            os.getenv("RETRIEVER_NPROBE", str(min(nlist, max(8, nlist // 16))))
+        )
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    index.add(vectors)
+    apply_search_params(index, search_params)
+    return index, search_params
+
+
+def apply_search_params(index: Any, search_params: Dict[str, int]):
+    """Применяет параметры поиска (nprobe, efSearch) к индексу."""
+    if search_params:
+        spec = ",".join(f"{key}={value}" for key, value in search_params.items())
+        faiss.ParameterSpace().set_index_parameters(index, spec)
+
+
+def index_nbytes(index: Any) -> int:
+    """
+    Приблизительный размер FAISS-индекса в памяти: коды векторов, идентификаторы
+    в списках IVF и граф HNSW.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return index_nbytes(index.storage) + index.hnsw.neighbors.size() * 4
+    try:
+        code_size = index.sa_code_size()
+    except RuntimeError:
+        code_size = index.d * 4
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (code_size + 8) + index_nbytes(index.quantizer)
+    return index.ntotal * code_size
+
+
+def compute_fingerprint(docs: List[Document], model_name: str) -> str:
+    """
+    Вычисляет отпечаток корпуса и модели эмбеддингов.
+    Индекс на диске используется, только если отпечаток совпадает.
+    """
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for doc in docs:
+        record = {"text": doc.page_content, "metadata": doc.metadata}
+        digest.update(json.dumps(record, ensure_ascii=False, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """Читает manifest.json индекса или возвращает None, если индекса нет."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_store(
+    directory: str,
+    docs: List[Document],
+    embeddings: Embeddings,
+    model_name: str,
+    fingerprint: str,
+    index_type: str = "flat",
+):
+    """
+    Эмбеддит документы и атомарно записывает индекс в directory.
+    """
+    started = time.perf_counter()
+    texts = [doc.page_content for doc in docs]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    dim = vectors.shape[1] if len(vectors) else 0
+    if len(vectors):
+        index, search_params = build_index(vectors, index_type)
+    else:
+        index, search_params = faiss.IndexFlatL2(dim), {}
+
+    # Каталог версии не виден читателям, пока на него не указывает ссылка
+    tmp_dir = f"{directory}.v{time.time_ns()}-{os.getpid()}"
+    os.makedirs(tmp_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+
+    offsets = [0]
+    with open(os.path.join(tmp_dir, DOCS_FILE), "wb") as f:
+        for doc in docs:
+            record = {"text": doc.page_content, "metadata": doc.metadata}
+            data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(tmp_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+    manifest = {
+        "fingerprint": fingerprint,
+        "model_name": model_name,
+        "count": len(docs),
+        "dim": dim,
+        "index_type": index_type,
+        "search_params": search_params,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    _publish(directory, tmp_dir)
+    logger.info(
+        "Vector store saved to %s: %d docs, dim=%d, index=%s, %.2fs",
+        directory,
+        len(docs),
+        dim,
+        index_type,
+        time.perf_counter() - started,
+    )
+
+
+def _publish(directory: str, version_dir: str):
+    """
+    Делает version_dir текущей версией индекса: ссылка directory подменяется
+    одним rename, поэтому читатели всегда находят либо старую, либо новую версию.
+    Предыдущая версия остаётся для читателей, уже разрешивших ссылку.
+    """
+    previous = os.path.realpath(directory) if os.path.islink(directory) else None
+    link_tmp = f"{directory}.link-{os.getpid()}"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.basename(version_dir), link_tmp)
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # Индекс старого формата (обычный каталог) поверх ссылки не переименовать;
+        # короткое окно без индекса при переходе закрывает повтор в open_store
+        legacy_dir = f"{directory}.legacy-{os.getpid()}"
+        os.replace(directory, legacy_dir)
+        os.replace(link_tmp, directory)
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+    else:
+        os.replace(link_tmp, directory)
+
+    keep = {os.path.realpath(version_dir), previous}
+    for old_dir in glob.glob(f"{glob.escape(directory)}.v*"):
+        if os.path.realpath(old_dir) not in keep:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def open_store(directory: str, embeddings: Embeddings) -> FAISS:
+    """
+    Открывает индекс из directory через mmap. Ссылка разрешается один раз:
+    индекс, манифест и документы читаются из одной версии.
+    """
+    for _ in range(OPEN_ATTEMPTS - 1):
+        version_dir = os.path.realpath(directory)
+        try:
+            return _open_version(version_dir, embeddings)
+        except (FileNotFoundError, RuntimeError):
+            # Версию удалили следующие публикации, пока она открывалась, или идёт
+            # переход со старого формата каталога и ссылка вот-вот появится
+            moved = os.path.realpath(directory) != version_dir
+            if os.path.isdir(version_dir) and not moved:
+                raise
+        time.sleep(0.1)
+    return _open_version(os.path.realpath(directory), embeddings)
+
+
+def _open_version(directory: str, embeddings: Embeddings) -> FAISS:
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(index_path)
+    try:
+        # Векторы плоского индекса читаются прямо из отображённого файла
+        index = faiss.read_index(
+            index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+        )
+    except RuntimeError as e:
+        logger.warning(
+            "mmap is not supported for %s, reading into memory: %s", index_path, e
+        )
+        index = faiss.read_index(index_path)
+    manifest = read_manifest(directory) or {}
+    # Параметры поиска можно подстроить переменными окружения без пересборки
+    search_params = dict(manifest.get("search_params", {}))
+    for key, env in (
+        ("nprobe", "RETRIEVER_NPROBE"),
+        ("efSearch", "RETRIEVER_EF_SEARCH"),
+    ):
+        if key in search_params and os.getenv(env):
+            search_params[key] = int(os.environ[env])
+    apply_search_params(index, search_params)
+    docstore = MmapDocstore(directory)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=PositionalIds(len(docstore)),  # type: ignore[arg-type]
+    )
+
+
+def load_or_build_store(
+    directory: str,
+    docs: List[Document],
+    embeddings: Embeddings,
+    model_name: str,
+    index_type: str = "auto",
+) -> FAISS:
+    """
+    Открывает индекс из directory, при отсутствии или устаревании пересобирает его.
+    Сборку выполняет один процесс, остальные ждут её на файловой блокировке.
+    """
+    fingerprint = compute_fingerprint(docs, model_name)
+    index_type = resolve_index_type(index_type, len(docs))
+
+    def is_stale(manifest: Optional[Dict[str, Any]]) -> bool:
+        return (
+            not manifest
+            or manifest.get("fingerprint") != fingerprint
+            or manifest.get("index_type", "flat") != index_type
+        )
+
+    if is_stale(read_manifest(directory)):
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        with open(f"{directory}.lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if is_stale(read_manifest(directory)):
+                logger.info(
+                    "Vector store at %s is missing or stale, rebuilding", directory
+                )
+                save_store(
+                    directory, docs, embeddings, model_name, fingerprint, index_type
+                )
+    logger.info("Opening vector store from %s", directory)
+    return open_store(directory, embeddings)
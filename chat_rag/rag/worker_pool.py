@@ -0,0 +1,478 @@
+"""
+Пул worker-процессов для CPU-bound работы RAG (эмбеддинг запроса, поиск FAISS, агент).
+
+Фронтовый процесс aiogram занимается только вводом-выводом Telegram, а сообщения
+маршрутизируются по user_id в один из N процессов. Каждый процесс держит свой
+ретривер и агента, поэтому сообщения одного пользователя всегда обрабатываются
+одним процессом и строго по порядку. Результаты возвращаются по каналу процесса
+по мере готовности, каждое сообщение — одним ответом целиком (по частям ответ
+делит уже очередь отправки бота).
+
+Если процесс завершился (OOM, падение в нативном коде), ожидающие его запросы
+завершаются WorkerUnavailableError, а процесс перезапускается.
+"""
+
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from chat_rag.rag.history import History
+
+logger = logging.getLogger(__name__)
+
+# Процесс, проживший меньше MIN_UPTIME_S, перезапускается с паузой RESPAWN_DELAY_S:
+# не крутим перезапуски впустую, если он падает сразу при старте
+MIN_UPTIME_S = 10.0
+RESPAWN_DELAY_S = 1.0
+
+
+class WorkerUnavailableError(RuntimeError):
+    """Worker-процесс не ответил: завершился, не уложился в таймаут или пул остановлен."""
+
+
+def _worker_main(
+    index: int,
+    requests: "mp.Queue[Any]",
+    results: Any,
+    threads: int,
+    process_fn: Optional[Callable[[str, History], str]] = None,
+):
+    """
+    Точка входа worker-процесса.
+
+    Запросы одного пользователя выполняются последовательно, запросы разных
+    пользователей — параллельно в пуле из threads потоков. process_fn заменяет
+    агента (для тестов пула).
+    """
+    # Ограничиваем внутренние потоки torch/BLAS, чтобы N процессов не дрались за ядра
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+    from chat_rag.rag.logging_setup import setup_logging
+
+    # Процесс запущен через spawn и не наследует настройку логирования бота
+    setup_logging()
+
+    if process_fn is None:
+        from chat_rag.rag.rag_agent import get_agent, process_message
+
+        get_agent()
+        process_fn = process_message
+
+    # Канал результатов у процесса свой, но пишут в него несколько потоков
+    send_lock = threading.Lock()
+
+    def put(item: Tuple[str, Any, Any]):
+        with send_lock:
+            results.send(item)
+
+    put(("ready", index, None))
+    logger.info("RAG worker %d ready (pid=%d)", index, os.getpid())
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    lock = threading.Lock()
+    # Сигнал, что очереди всех пользователей опустели (для остановки)
+    idle = threading.Condition(lock)
+    pending: Dict[int, Deque[Tuple[int, str, History]]] = {}
+
+    def run(user_id: int, request_id: int, text: str, history: History):
+        try:
+            put(("ok", request_id, process_fn(text, history)))
+        except Exception as e:
+            logger.error("RAG worker %d failed on request %d: %s", index, request_id, e)
+            put(("error", request_id, str(e)))
+        # Запускаем следующее сообщение этого пользователя, если оно есть
+        with lock:
+            user_queue = pending[user_id]
+            user_queue.popleft()
+            if user_queue:
+                executor.submit(run, user_id, *user_queue[0])
+            else:
+                del pending[user_id]
+                if not pending:
+                    idle.notify_all()
+
+    def run_control(request_id: int, command: str):
+        from chat_rag.rag.commands import run_command
+
+        try:
+            put(("ok", request_id, run_command(command)))
+        except Exception as e:
+            logger.error("RAG worker %d failed on command %s: %s", index, command, e)
+            put(("error", request_id, str(e)))
+
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, user_id, text, history = item
+        if user_id is None:
+            # Служебная команда (профилирование, перезагрузка) вне очереди пользователей
+            executor.submit(run_control, request_id, text)
+            continue
+        with lock:
+            user_queue = pending.setdefault(user_id, deque())
+            user_queue.append((request_id, text, history))
+            if len(user_queue) == 1:
+                executor.submit(run, user_id, request_id, text, history)
+
+    # Следующие сообщения пользователей ставятся в пул из выполняющихся задач:
+    # пул закрывается, только когда очереди пользователей пусты
+    with idle:
+        idle.wait_for(lambda: not pending)
+    executor.shutdown(wait=True)
+    results.close()
+    logger.info("RAG worker %d stopped", index)
+
+
+class ShardedWorkerPool:
+    """
+    Пул процессов с маршрутизацией сообщений по user_id.
+
+    Args:
+        num_workers: Число процессов
+        threads_per_worker: Потоков в процессе (сообщения разных пользователей)
+        request_timeout: Сколько секунд process() ждёт ответа (None — без ограничения)
+        process_fn: Функция (text, history) -> ответ вместо агента (для тестов);
+            должна импортироваться по имени в дочернем процессе
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        threads_per_worker: int = 4,
+        request_timeout: Optional[float] = None,
+        process_fn: Optional[Callable[[str, History], str]] = None,
+    ):
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.request_timeout = request_timeout
+        self.process_fn = process_fn
+        # spawn: FAISS и torch небезопасно наследовать через fork
+        self._ctx = mp.get_context("spawn")
+        # Очередь запросов, канал результатов и процесс каждого шарда
+        self._requests: List[Any] = []
+        self._results: List[Any] = []
+        self._processes: List[Any] = []
+        self._started_at: List[float] = []
+        # request_id -> (loop, future, шард)
+        self._futures: Dict[
+            int, Tuple[asyncio.AbstractEventLoop, asyncio.Future, int]
+        ] = {}
+        self._futures_lock = threading.Lock()
+        self._next_request_id = 0
+        self._ready = threading.Semaphore(0)
+        self._reader: Optional[threading.Thread] = None
+        # Шарды, чей процесс ждёт перезапуска, и шарды, завершившиеся при остановке
+        self._respawning: Set[int] = set()
+        self._stopped: Set[int] = set()
+        self._stopping = False
+        self._restarts = 0
+
+    def _spawn(self, index: int, requests: Any) -> Tuple[Any, Any]:
+        results, child_results = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                index,
+                requests,
+                child_results,
+                self.threads_per_worker,
+                self.process_fn,
+            ),
+            name=f"rag-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Копия в дочернем процессе — единственный писатель: его смерть даёт EOF
+        child_results.close()
+        return results, process
+
+    def start(self, timeout: Optional[float] = None):
+        """
+        Запускает worker-процессы и ждёт, пока каждый загрузит модели.
+
+        Args:
+            timeout: Максимальное время ожидания готовности всех процессов
+
+        Raises:
+            RuntimeError: если процесс завершился при старте или не успел
+        """
+        for index in range(self.num_workers):
+            requests = self._ctx.Queue()
+            results, process = self._spawn(index, requests)
+            self._requests.append(requests)
+            self._results.append(results)
+            self._processes.append(process)
+            self._started_at.append(time.monotonic())
+
+        self._reader = threading.Thread(
+            target=self._read_results, name="rag-results", daemon=True
+        )
+        self._reader.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ready = 0
+        while ready < self.num_workers:
+            if self._ready.acquire(timeout=1.0):
+                ready += 1
+                continue
+            if self._restarts:
+                raise RuntimeError("RAG worker exited during startup")
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError("RAG worker did not become ready in time")
+        logger.info("ShardedWorkerPool started: workers=%d", self.num_workers)
+
+    def shard_for(self, user_id: int) -> int:
+        """Номер процесса, обслуживающего пользователя."""
+        return hash(user_id) % self.num_workers
+
+    async def process(self, user_id: int, text: str, history: History) -> str:
+        """
+        Отправляет сообщение в процесс пользователя и ждёт ответ.
+
+        Args:
+            user_id: ID пользователя
+            text: Текст сообщения
+            history: История диалога в виде пар (role, text)
+
+        Returns:
+            Ответ агента
+
+        Raises:
+            WorkerUnavailableError: процесс завершился или не ответил за request_timeout
+        """
+        return await self._submit(
+            self.shard_for(user_id), user_id, text, history, self.request_timeout
+        )
+
+    async def run_command(self, command: str) -> List[Dict[str, Any]]:
+        """
+        Выполняет служебную команду (профилирование памяти, перезагрузка базы
+        знаний — см. commands.run_command) в каждом процессе пула.
+
+        Returns:
+            Результаты процессов
+        """
+        return list(
+            await asyncio.gather(
+                *(
+                    self._submit(index, None, command, [])
+                    for index in range(self.num_workers)
+                )
+            )
+        )
+
+    async def _submit(
+        self,
+        shard: int,
+        user_id: Optional[int],
+        text: str,
+        history: History,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._futures_lock:
+            if self._stopping:
+                raise WorkerUnavailableError("RAG worker pool is stopped")
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self._futures[request_id] = (loop, future, shard)
+            # Под блокировкой: при перезапуске запрос не попадёт в очередь
+            # завершившегося процесса после того, как его запросы отменены
+            self._requests[shard].put((request_id, user_id, text, history))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._futures_lock:
+                self._futures.pop(request_id, None)
+            raise WorkerUnavailableError(
+                f"RAG worker {shard} did not answer in {timeout:.0f}s"
+            ) from None
+
+    def _read_results(self):
+        while len(self._stopped) < self.num_workers:
+            with self._futures_lock:
+                workers = list(enumerate(zip(self._results, self._processes)))
+                skipped = self._respawning | self._stopped
+            waitables = {}
+            for index, (results, process) in workers:
+                if index not in skipped:
+                    waitables[results] = index
+                    waitables[process.sentinel] = index
+            for ready in wait(list(waitables), timeout=0.5):
+                index = waitables[ready]
+                results = self._results[index]
+                if index in self._respawning or ready not in (
+                    results,
+                    self._processes[index].sentinel,
+                ):
+                    # Канал и sentinel завершившегося процесса готовы одновременно:
+                    # его завершение уже обработано при разборе первого из них
+                    continue
+                try:
+                    if ready is results:
+                        self._dispatch(results.recv())
+                        continue
+                except (EOFError, OSError):
+                    # Канал закрыт: процесс завершился или вот-вот завершится
+                    pass
+                self._on_exit(index)
+        self._fail_pending(None, "RAG worker pool is stopped")
+
+    def _dispatch(self, message: Tuple[str, Any, Any]):
+        kind, key, payload = message
+        if kind == "ready":
+            self._ready.release()
+            return
+        with self._futures_lock:
+            entry = self._futures.pop(key, None)
+        if entry is None:
+            # Ответ на запрос, ожидание которого уже завершилось по таймауту
+            return
+        loop, future, _ = entry
+        if kind == "ok":
+            loop.call_soon_threadsafe(_set_result, future, payload)
+        else:
+            loop.call_soon_threadsafe(_set_exception, future, RuntimeError(payload))
+
+    def _on_exit(self, index: int):
+        """
+        Обрабатывает завершение процесса: дочитывает его ответы, завершает ошибкой
+        оставшиеся запросы и перезапускает процесс, если пул не останавливается.
+        """
+        process, results = self._processes[index], self._results[index]
+        if process.is_alive() and not self._stopping:
+            process.join(1.0)
+            if process.is_alive():
+                logger.error("RAG worker %s closed its channel, killing", process.name)
+                process.kill()
+        process.join()
+        # Ответы, отправленные до завершения, ещё лежат в канале
+        try:
+            while results.poll():
+                self._dispatch(results.recv())
+        except (EOFError, OSError):
+            pass
+        results.close()
+        if self._stopping:
+            self._finish_stopped(index)
+            return
+
+        logger.error(
+            "RAG worker %s exited with code %s, restarting",
+            process.name,
+            process.exitcode,
+        )
+        # Новые запросы копятся в очереди нового процесса, пока он запускается
+        with self._futures_lock:
+            old_requests = self._requests[index]
+            self._requests[index] = self._ctx.Queue()
+            self._respawning.add(index)
+            self._fail_pending_locked(
+                index, f"RAG worker {index} exited with code {process.exitcode}"
+            )
+        old_requests.close()
+        old_requests.cancel_join_thread()
+        if time.monotonic() - self._started_at[index] < MIN_UPTIME_S:
+            # Пауза — в отдельном потоке: ответы остальных процессов читаются без задержки
+            timer = threading.Timer(RESPAWN_DELAY_S, self._respawn, (index,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._respawn(index)
+
+    def _respawn(self, index: int):
+        """Запускает новый процесс шарда index вместо завершившегося."""
+        with self._futures_lock:
+            stopping = self._stopping
+            requests = self._requests[index]
+        if stopping:
+            self._finish_stopped(index)
+            return
+        new_results, new_process = self._spawn(index, requests)
+        with self._futures_lock:
+            self._results[index] = new_results
+            self._processes[index] = new_process
+            self._started_at[index] = time.monotonic()
+            self._respawning.discard(index)
+            self._restarts += 1
+
+    def _finish_stopped(self, index: int):
+        """Процесс шарда index завершился при остановке пула и не перезапускается."""
+        with self._futures_lock:
+            self._respawning.discard(index)
+            self._stopped.add(index)
+            self._fail_pending_locked(index, f"RAG worker {index} stopped")
+
+    def _fail_pending(self, shard: Optional[int], reason: str):
+        with self._futures_lock:
+            self._fail_pending_locked(shard, reason)
+
+    def _fail_pending_locked(self, shard: Optional[int], reason: str):
+        failed = [
+            request_id
+            for request_id, (_, _, request_shard) in self._futures.items()
+            if shard is None or request_shard == shard
+        ]
+        for request_id in failed:
+            loop, future, _ = self._futures.pop(request_id)
+            loop.call_soon_threadsafe(
+                _set_exception, future, WorkerUnavailableError(reason)
+            )
+        if failed:
+            logger.warning("Failed %d pending RAG requests: %s", len(failed), reason)
+
+    def stop(self, timeout: float = 30.0):
+        """
+        Останавливает процессы, дождавшись обработки уже отправленных сообщений.
+        Запросы, не получившие ответа, завершаются WorkerUnavailableError.
+        """
+        with self._futures_lock:
+            self._stopping = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Terminating RAG worker %s", process.name)
+                process.terminate()
+                process.join()
+        if self._reader is not None:
+            self._reader.join(timeout)
+        self._fail_pending(None, "RAG worker pool is stopped")
+        logger.info("ShardedWorkerPool stopped")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает состояние пула.
+
+        Returns:
+            Словарь со статистикой
+        """
+        with self._futures_lock:
+            pending = len(self._futures)
+            processes = list(self._processes)
+        return {
+            "workers": self.num_workers,
+            "alive": sum(process.is_alive() for process in processes),
+            "pending": pending,
+            "restarts": self._restarts,
+        }
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Модули бота импортируются без пакета (как при запуске chat_rag/bot/bot.py)
+for path in (ROOT, os.path.join(ROOT, "chat_rag", "bot")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,80 @@
+import pytest
+
+from chat_rag.rag.dedup import dedup_chunks, dedup_courses, name_numbers
+
+
+def course(name: str, semesters, credits: int = 3):
+    return {"name": name, "semesters": semesters, "credits": credits, "hours": 108}
+
+
+def test_same_course_in_several_semesters_is_merged():
+    courses = [
+        course("Глубокое обучение / Deep Learning", [1]),
+        course("Машинное обучение", [1]),
+        course("Глубокое обучение / Deep Learning", [2]),
+        course("Глубокое обучение/Deep Learning.", [3], credits=4),
+    ]
+    result, report = dedup_courses(courses)
+    assert [c["name"] for c in result] == [
+        "Глубокое обучение / Deep Learning",
+        "Машинное обучение",
+    ]
+    assert result[0]["semesters"] == [1, 2, 3]
+    # Отличающиеся поля сохраняются в variants
+    assert result[0]["variants"] == [
+        {
+            "name": "Глубокое обучение/Deep Learning.",
+            "credits": 4,
+            "hours": 108,
+            "semesters": [3],
+        }
+    ]
+    assert report.removed == 2 and report.merged_groups == 1
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (
+            "Научно-исследовательская работа / Research Work",
+            "Научно-исследовательская работа / Research Work 2",
+        ),
+        ("Иностранный язык I", "Иностранный язык II"),
+        ("Производственная практика 1", "Производственная практика 2"),
+    ],
+)
+def test_numbered_courses_are_not_merged(first, second):
+    courses = [course(first, [1], credits=6), course(second, [2], credits=9)]
+    result, report = dedup_courses(courses)
+    assert result == courses
+    assert report.merged_groups == 0
+
+
+def test_name_numbers():
+    assert name_numbers("Иностранный язык II (B2)") == ("II",)
+    assert name_numbers("Research Work") == ()
+
+
+def test_near_duplicate_chunks_keep_longest_with_metadata():
+    text = "Стоимость обучения на программе составляет 599 000 рублей в год."
+    chunks = [
+        {"text": text, "source": "page"},
+        {"text": "Программа длится два года, обучение очное.", "source": "page"},
+        {"text": text + "!", "source": "faq"},
+        {"text": text + " В год.", "source": "pdf"},
+    ]
+    result, report = dedup_chunks(chunks, threshold=0.8)
+    assert len(result) == 2
+    assert result[0]["source"] == "pdf"
+    assert [d["source"] for d in result[0]["duplicates"]] == ["page", "faq"]
+    assert result[1]["text"].startswith("Программа длится")
+    assert report.removed == 2
+
+
+def test_different_chunks_are_kept():
+    chunks = [
+        {"text": "Вступительные испытания: экзамен по математике и портфолио."},
+        {"text": "Вступительные испытания: собеседование и мотивационное письмо."},
+    ]
+    result, report = dedup_chunks(chunks, threshold=0.8)
+    assert result == chunks and report.merged_groups == 0
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from chat_rag.rag.embeddings import BatchingEmbeddings
+
+
+class GatedEmbeddings(Embeddings):
+    """Модель-заглушка: вектор [len(text)], ждёт gate, падает на "bad"."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls: List[List[str]] = []
+        self.short = False
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.gate.wait()
+        self.calls.append(list(texts))
+        if "bad" in texts:
+            raise RuntimeError("model failed")
+        vectors = [[float(len(text))] for text in texts]
+        return vectors[:-1] if self.short else vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def model():
+    return GatedEmbeddings()
+
+
+def test_concurrent_queries_are_batched(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=8, max_wait_ms=50)
+    with ThreadPoolExecutor(8) as pool:
+        vectors = list(pool.map(embeddings.embed_query, ["a" * n for n in range(8)]))
+    assert vectors == [[float(n)] for n in range(8)]
+    assert embeddings.get_stats()["batches"] < 8
+
+
+def test_cancelled_query_does_not_stop_batcher(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=1, max_wait_ms=0)
+    model.gate.clear()
+    blocked = embeddings._submit("first")
+    cancelled = embeddings._submit("cancelled")
+    assert cancelled.cancel()
+    model.gate.set()
+    assert blocked.result(5) == [5.0]
+    assert embeddings.embed_query("next") == [4.0]
+    assert ["cancelled"] not in model.calls
+
+
+def test_async_timeout_cancels_waiting_query(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=1, max_wait_ms=0)
+
+    async def scenario():
+        model.gate.clear()
+        first = asyncio.ensure_future(embeddings.aembed_query("first"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(embeddings.aembed_query("late"), 0.1)
+        model.gate.set()
+        return await first, await embeddings.aembed_query("after")
+
+    assert asyncio.run(scenario()) == ([5.0], [5.0])
+    assert ["late"] not in model.calls
+
+
+def test_model_error_is_raised_to_batch(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=4, max_wait_ms=0)
+    with pytest.raises(RuntimeError, match="model failed"):
+        embeddings.embed_query("bad")
+    assert embeddings.embed_query("ok") == [2.0]
+
+
+def test_wrong_vector_count_fails_queries_not_batcher(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=4, max_wait_ms=0)
+    model.short = True
+    with pytest.raises(ValueError, match="returned 0 vectors"):
+        embeddings.embed_query("x")
+    model.short = False
+    assert embeddings.embed_query("xy") == [2.0]
+
+
+def test_sync_query_times_out(model):
+    embeddings = BatchingEmbeddings(model, max_batch_size=1, max_wait_ms=0, timeout=0.1)
+    model.gate.clear()
+    with pytest.raises(TimeoutError):
+        embeddings.embed_query("stuck")
+    model.gate.set()
+    assert embeddings.embed_query("ok") == [2.0]
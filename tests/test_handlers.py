@@ -0,0 +1,66 @@
+import asyncio
+import os
+from typing import List, Optional
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+
+import handlers  # noqa: E402
+from scheduler import QUICK, RECOMMEND, JobScheduler  # noqa: E402
+
+from chat_rag.rag.history import DialogHistory, History  # noqa: E402
+
+CLARIFY = "Для какой программы: ai или ai_product? И кратко: опыт, интересы, цели."
+PLAN = "План: 1 семестр — Машинное обучение, Глубокое обучение."
+
+
+class FakeMessage:
+    """Входящее сообщение: ответы бота запоминаются в replies."""
+
+    def __init__(self, text: str, replies: List[str]):
+        self.text = text
+        self.from_user = None
+        self.replies = replies
+
+    async def answer(self, text: str):
+        self.replies.append(text)
+
+
+def test_profile_after_clarifying_question_is_recommendation(monkeypatch):
+    seen: List[History] = []
+
+    async def fake_agent(text: str, history: Optional[History] = None) -> str:
+        seen.append(list(history or []))
+        if "посоветуй" in text.lower():
+            return CLARIFY
+        return PLAN if seen[-1] and seen[-1][-1][1] == CLARIFY else "Ответ"
+
+    monkeypatch.setattr(handlers, "aprocess_message", fake_agent)
+
+    async def main():
+        scheduler = JobScheduler({QUICK: 1, RECOMMEND: 1})
+        history = DialogHistory()
+        replies: List[str] = []
+        for text in (
+            "Посоветуй курсы",
+            "ai, бэкенд-разработчик 3 года, хочу стать ML-инженером",
+            "Сколько стоит обучение?",
+        ):
+            await handlers.common_messages_handler(
+                FakeMessage(text, replies),
+                user_memory=history,
+                update_memory=history.add_exchange,
+                scheduler=scheduler,
+            )
+            assert await scheduler.drain(timeout=1)
+        return replies, scheduler.get_stats()
+
+    replies, stats = asyncio.run(main())
+    # Ответ с профилем запускает подбор курсов: он идёт в очереди рекомендаций
+    assert replies == [
+        handlers.PLAN_ACK,
+        CLARIFY,
+        handlers.PLAN_ACK,
+        PLAN,
+        "Ответ",
+    ]
+    assert stats[RECOMMEND]["submitted"] == 2 and stats[QUICK]["submitted"] == 1
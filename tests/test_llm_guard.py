@@ -0,0 +1,326 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from chat_rag.devtools.fake_openai import FakeOpenAIServer
+from chat_rag.rag import programs, rag_agent
+from chat_rag.rag.llm_guard import (
+    CircuitBreaker,
+    GuardedChatOpenAI,
+    LLMGuard,
+    LLMUnavailableError,
+)
+from chat_rag.rag.programs import ProgramRegistry, set_registry
+
+
+def make_guard(**kwargs) -> LLMGuard:
+    params = dict(
+        timeout_s=1.0,
+        hedge_percentile=0,
+        failure_threshold=2,
+        reset_timeout_s=0.2,
+        hedge_min_samples=3,
+    )
+    params.update(kwargs)
+    return LLMGuard("test", **params)
+
+
+def fail():
+    raise RuntimeError("model failed")
+
+
+def test_breaker_opens_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=0.1)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    time.sleep(0.15)
+    # После паузы пропускается только один пробный вызов
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.15)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_errors_open_breaker_and_reject_calls():
+    guard = make_guard()
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError, match="error") as info:
+            guard.call(fail)
+        assert isinstance(info.value.__cause__, RuntimeError)
+    with pytest.raises(LLMUnavailableError, match="circuit open"):
+        guard.call(lambda: "ok")
+    time.sleep(0.25)
+    assert guard.call(lambda: "ok") == "ok"
+    stats = guard.get_stats()
+    assert stats["error"] == 2 and stats["rejected"] == 1 and stats["success"] == 1
+    assert stats["breaker_state"] == CircuitBreaker.CLOSED
+
+
+def test_sync_timeout_counts_as_failure():
+    guard = make_guard(timeout_s=0.1, failure_threshold=1)
+    release = threading.Event()
+    with pytest.raises(LLMUnavailableError, match="timeout"):
+        guard.call(lambda: release.wait(5))
+    release.set()
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+
+def test_async_timeout_cancels_attempt():
+    guard = make_guard(timeout_s=0.1)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        with pytest.raises(LLMUnavailableError, match="timeout"):
+            await guard.acall(slow)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+    assert guard.get_stats()["timeout"] == 1
+
+
+def test_async_caller_cancellation_cancels_attempt():
+    guard = make_guard()
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        call = asyncio.create_task(guard.acall(slow))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+
+
+def test_cancelled_half_open_probe_releases_breaker():
+    guard = make_guard(failure_threshold=1, reset_timeout_s=0.05)
+
+    async def main():
+        async def afail():
+            fail()
+
+        with pytest.raises(LLMUnavailableError):
+            await guard.acall(afail)
+        await asyncio.sleep(0.1)
+        # Пробный вызов отменён вызывающим до ответа модели
+        probe = asyncio.create_task(guard.acall(lambda: asyncio.sleep(5)))
+        await asyncio.sleep(0.01)
+        assert guard.breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert guard.breaker.state == CircuitBreaker.OPEN
+        await asyncio.sleep(0.1)
+        return await guard.acall(lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(main()) == "ok"
+    stats = guard.get_stats()
+    assert stats["cancelled"] == 1 and stats["breaker_state"] == CircuitBreaker.CLOSED
+
+
+def warm_up(guard: LLMGuard, latency_s: float):
+    for _ in range(guard.hedge_min_samples):
+        with guard._lock:
+            guard._latencies.append(latency_s)
+
+
+def test_hedge_wins_when_first_attempt_hangs():
+    guard = make_guard(hedge_percentile=50)
+    warm_up(guard, 0.05)
+    calls = []
+    release = threading.Event()
+
+    def call():
+        calls.append(None)
+        if len(calls) == 1:
+            release.wait(5)
+            return "first"
+        return "hedge"
+
+    assert guard.call(call) == "hedge"
+    release.set()
+    stats = guard.get_stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_async_hedge_survives_failed_attempt():
+    guard = make_guard(hedge_percentile=50)
+    warm_up(guard, 0.05)
+    calls = []
+
+    async def call():
+        calls.append(None)
+        if len(calls) == 1:
+            await asyncio.sleep(0.1)
+            raise RuntimeError("first attempt failed")
+        await asyncio.sleep(0.2)
+        return "hedge"
+
+    assert asyncio.run(guard.acall(call)) == "hedge"
+    assert len(calls) == 2
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_async_all_attempts_fail():
+    guard = make_guard(hedge_percentile=50)
+    warm_up(guard, 0.01)
+
+    async def call():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("model failed")
+
+    with pytest.raises(LLMUnavailableError, match="error"):
+        asyncio.run(guard.acall(call))
+    assert guard.get_stats()["error"] == 1
+
+
+def test_degraded_answer_links_registry_programs(tmp_path, monkeypatch):
+    for code in ("ai", "data_science"):
+        (tmp_path / f"{code}_chunks.json").write_text("[]")
+    monkeypatch.setattr(programs, "_registry", ProgramRegistry(str(tmp_path)))
+    answer = rag_agent.degraded_answer()
+    assert "https://abit.itmo.ru/program/master/data_science" in answer
+    assert "ai_product" not in answer
+    # Пока данных нет, ссылки ведут на исходные программы
+    set_registry(ProgramRegistry(str(tmp_path / "missing")))
+    answer = rag_agent.degraded_answer()
+    assert "https://abit.itmo.ru/program/master/ai_product" in answer
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_with_fake_openai(scenario, guard: LLMGuard, **server_params):
+    """
+    Запускает scenario(server, llm) с GuardedChatOpenAI, подключённым
+    к фейковому OpenAI-серверу.
+    """
+
+    async def main():
+        server = FakeOpenAIServer(port=free_port(), **server_params)
+        await server.start()
+        try:
+            llm = GuardedChatOpenAI(
+                guard=guard, model="fake", api_key="test", base_url=server.base_url
+            )
+            return await scenario(server, llm)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+QUESTION = [HumanMessage("Сколько стоит обучение?")]
+
+
+def test_fake_openai_timeout_closes_request():
+    guard = make_guard(timeout_s=0.2)
+
+    async def scenario(server, llm):
+        with pytest.raises(LLMUnavailableError, match="timeout"):
+            await llm.ainvoke(QUESTION)
+        await asyncio.sleep(0.1)
+        return server.stats
+
+    stats = run_with_fake_openai(scenario, guard, latency_ms=2000)
+    assert stats["received"] == 1 and stats["cancelled"] == 1
+    assert guard.get_stats()["timeout"] == 1
+
+
+def test_fake_openai_errors_open_breaker_until_recovery():
+    guard = make_guard(failure_threshold=2, reset_timeout_s=0.2)
+
+    async def scenario(server, llm):
+        for _ in range(2):
+            with pytest.raises(LLMUnavailableError, match="error"):
+                await llm.ainvoke(QUESTION)
+        with pytest.raises(LLMUnavailableError, match="circuit open"):
+            await llm.ainvoke(QUESTION)
+        received = server.stats["received"]
+        server.configure(error_rate=0)
+        await asyncio.sleep(0.25)
+        answer = await llm.ainvoke(QUESTION)
+        return received, answer.content
+
+    received, answer = run_with_fake_openai(
+        scenario, guard, latency_ms=10, error_rate=1
+    )
+    # Отклонённый breaker'ом вызов не дошёл до сервера
+    assert received == 2
+    assert answer == "Ответ на вопрос: Сколько стоит обучение?"
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_fake_openai_hedge_answers_past_slow_request():
+    guard = make_guard(timeout_s=2, hedge_percentile=50)
+    warm_up(guard, 0.1)
+
+    async def scenario(server, llm):
+        started = time.monotonic()
+        answer = await llm.ainvoke(QUESTION)
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(0.1)
+        return answer.content, elapsed, server.stats
+
+    # seed=1: первый запрос медленный, дубликат — обычный
+    answer, elapsed, stats = run_with_fake_openai(
+        scenario, guard, latency_ms=20, slow_rate=0.5, slow_ms=5000, seed=1
+    )
+    assert answer.startswith("Ответ на вопрос")
+    assert elapsed < 1
+    assert stats["received"] == 2 and stats["slow"] == 1 and stats["cancelled"] == 1
+    assert guard.get_stats()["hedge_wins"] == 1
+
+
+def test_fake_openai_cancelled_probe_does_not_wedge_breaker():
+    guard = make_guard(failure_threshold=1, reset_timeout_s=0.1)
+
+    async def scenario(server, llm):
+        with pytest.raises(LLMUnavailableError):
+            await llm.ainvoke(QUESTION)
+        server.configure(error_rate=0, latency_ms=2000)
+        await asyncio.sleep(0.15)
+        probe = asyncio.create_task(llm.ainvoke(QUESTION))
+        await asyncio.sleep(0.1)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        server.configure(latency_ms=10)
+        await asyncio.sleep(0.15)
+        return (await llm.ainvoke(QUESTION)).content
+
+    answer = run_with_fake_openai(scenario, guard, latency_ms=10, error_rate=1)
+    assert answer.startswith("Ответ на вопрос")
+    assert guard.breaker.state == CircuitBreaker.CLOSED
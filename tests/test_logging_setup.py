@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+import pytest
+
+from chat_rag.rag.logging_setup import (
+    TEXT_FORMAT,
+    DeferredQueueHandler,
+    JsonFormatter,
+    SamplingFilter,
+    parse_levels,
+)
+
+
+@pytest.fixture
+def make_logger():
+    listeners = []
+
+    def make(formatter: logging.Formatter):
+        output = io.StringIO()
+        stream = logging.StreamHandler(output)
+        stream.setFormatter(formatter)
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        listener = QueueListener(log_queue, stream)
+        listener.start()
+        listeners.append(listener)
+        logger = logging.getLogger(f"test_logging_setup.{len(listeners)}")
+        logger.handlers = [DeferredQueueHandler(log_queue)]
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        return logger, listener, output
+
+    yield make
+    for listener in listeners:
+        if listener._thread is not None:
+            listener.stop()
+
+
+def log_error(logger: logging.Logger):
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Request %s failed", 42, extra={"user": 7})
+
+
+def test_json_keeps_traceback_in_exc_field(make_logger):
+    logger, listener, output = make_logger(JsonFormatter())
+    log_error(logger)
+    listener.stop()
+    data = json.loads(output.getvalue())
+    assert data["msg"] == "Request 42 failed"
+    assert data["user"] == 7
+    assert "Traceback" in data["exc"] and "ValueError: boom" in data["exc"]
+
+
+def test_text_format_appends_traceback(make_logger):
+    logger, listener, output = make_logger(logging.Formatter(TEXT_FORMAT))
+    log_error(logger)
+    listener.stop()
+    lines = output.getvalue().splitlines()
+    assert lines[0].endswith("Request 42 failed")
+    assert lines[-1] == "ValueError: boom"
+
+
+def test_args_are_substituted_on_calling_thread(make_logger):
+    logger, listener, output = make_logger(JsonFormatter())
+    items = ["before"]
+    logger.info("items=%s", items)
+    items.append("after")
+    listener.stop()
+    assert json.loads(output.getvalue())["msg"] == "items=['before']"
+
+
+def test_sampling_filter_keeps_warnings():
+    record = logging.makeLogRecord(
+        {"levelno": logging.WARNING, "levelname": "WARNING", "sample": 0.0}
+    )
+    assert SamplingFilter().filter(record)
+    record = logging.makeLogRecord({"levelno": logging.INFO, "sample": 0.0})
+    assert not SamplingFilter().filter(record)
+
+
+def test_parse_levels():
+    assert parse_levels("httpx=info, chat_rag.rag.retriever=DEBUG,bad") == {
+        "httpx": "INFO",
+        "chat_rag.rag.retriever": "DEBUG",
+    }
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from chat_rag.rag.embedding_benchmark import agreement
+from chat_rag.rag.onnx_embeddings import MODEL_FILE, onnx_model_dir
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Документы на разные темы: у каждого запроса один явно подходящий документ
+DOCS = [
+    "Стоимость обучения на контрактной основе составляет 599 000 рублей в год.",
+    "Иногородним студентам предоставляется место в общежитии.",
+    "Вступительное испытание проводится в форме устного собеседования.",
+    "Выпускники работают ML-инженерами и продакт-менеджерами в IT-компаниях.",
+    "Срок обучения в магистратуре — два года, форма обучения очная.",
+    "Количество бюджетных мест на программе — 51.",
+    "Партнёры программы: Яндекс, Сбер, МТС и Ozon.",
+    "Курс глубокого обучения включает свёрточные сети и трансформеры.",
+]
+QUERIES = [
+    "сколько стоит обучение",
+    "есть ли общежитие",
+    "какие вступительные экзамены",
+    "кем работают выпускники",
+    "сколько лет учиться",
+    "сколько бюджетных мест",
+    "компании-партнёры",
+    "нейронные сети",
+]
+
+
+def embed(embeddings):
+    return {
+        "query_vectors": np.asarray(
+            [embeddings.embed_query(query) for query in QUERIES], dtype=np.float32
+        ),
+        "doc_vectors": np.asarray(embeddings.embed_documents(DOCS), dtype=np.float32),
+    }
+
+
+@pytest.fixture(scope="module")
+def backends():
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    model_dir = onnx_model_dir(MODEL_NAME)
+    if not os.path.exists(os.path.join(model_dir, MODEL_FILE)):
+        pytest.skip(
+            f"ONNX model not exported to {model_dir} "
+            "(python -m chat_rag.rag.onnx_embeddings)"
+        )
+    pytest.importorskip("langchain_huggingface")
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+    from chat_rag.rag.onnx_embeddings import OnnxEmbeddings
+
+    try:
+        reference = HuggingFaceEmbeddings(model_name=MODEL_NAME)
+    except Exception as e:
+        pytest.skip(f"HuggingFace model {MODEL_NAME} is not available: {e}")
+    return embed(reference), embed(OnnxEmbeddings(model_dir))
+
+
+def test_onnx_matches_huggingface(backends):
+    reference, onnx = backends
+    result = agreement(reference, onnx, k=3)
+    # int8-веса сдвигают векторы, но не меняют соседей
+    assert result["cosine_min"] >= 0.95
+    assert result["cosine_mean"] >= 0.98
+    assert result["top1_agreement"] >= 0.875
+    assert result["topk_agreement"] >= 0.8
+
+
+def test_onnx_vectors_are_normalized(backends):
+    _, onnx = backends
+    vectors = np.concatenate([onnx["query_vectors"], onnx["doc_vectors"]])
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-4)
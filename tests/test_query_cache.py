@@ -0,0 +1,144 @@
+import asyncio
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from chat_rag.rag.embeddings import CachedQueryEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """Модель-заглушка, различающая регистр: вектор из кодов первых символов."""
+
+    def __init__(self):
+        self.queries: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries.append(text)
+        return [float(ord(char)) for char in text[:4].ljust(4)]
+
+
+@pytest.fixture
+def model():
+    return CountingEmbeddings()
+
+
+def make_cache(model, **kwargs):
+    kwargs.setdefault("max_size", 16)
+    kwargs.setdefault("path", "")
+    return CachedQueryEmbeddings(model, "stub-model", **kwargs)
+
+
+def test_key_is_exact_text(model):
+    cache = make_cache(model)
+    assert cache.embed_query("ИИ") == cache.embed_query("ИИ")
+    lower = cache.embed_query("ии")
+    assert model.queries == ["ИИ", "ии"]
+    assert lower != cache.embed_query("ИИ")
+    assert lower == model.embed_query("ии")
+
+
+def test_normalization_is_opt_in(model):
+    cache = make_cache(model, normalize=True)
+    first = cache.embed_query("Какие  экзамены")
+    assert cache.embed_query("какие экзамены\n") == first
+    assert model.queries == ["Какие  экзамены"]
+    assert cache.get_stats()["normalize"] is True
+
+
+def test_normalization_from_env(model, monkeypatch):
+    monkeypatch.setenv("EMBED_CACHE_NORMALIZE", "true")
+    assert make_cache(model).normalize
+    monkeypatch.delenv("EMBED_CACHE_NORMALIZE")
+    assert not make_cache(model).normalize
+
+
+def test_hit_and_miss_accounting(model):
+    cache = make_cache(model)
+    cache.embed_query("общежитие")
+    cache.embed_query("общежитие")
+    asyncio.run(cache.aembed_query("общежитие"))
+    asyncio.run(cache.aembed_query("стоимость"))
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+    assert stats["hit_rate"] == 0.5
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 2 * 4 * np.dtype(np.float32).itemsize
+    assert model.queries == ["общежитие", "стоимость"]
+
+
+def test_lru_bound_evicts_least_recently_used(model):
+    cache = make_cache(model, max_size=2)
+    cache.embed_query("a")
+    cache.embed_query("b")
+    # Обращение к "a" делает вытесняемым "b"
+    cache.embed_query("a")
+    cache.embed_query("c")
+    stats = cache.get_stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    cache.embed_query("a")
+    cache.embed_query("b")
+    assert model.queries == ["a", "b", "c", "b"]
+
+
+def test_zero_size_disables_cache(model):
+    cache = make_cache(model, max_size=0)
+    cache.embed_query("a")
+    cache.embed_query("a")
+    assert model.queries == ["a", "a"]
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_persists_across_restarts(model, tmp_path):
+    path = str(tmp_path / "cache" / "queries.npz")
+    cache = make_cache(model, path=path)
+    vectors = {text: cache.embed_query(text) for text in ("ИИ", "ии", "план")}
+    cache.save()
+
+    restored_model = CountingEmbeddings()
+    restored = make_cache(restored_model, path=path)
+    assert restored.get_stats()["loaded_from_disk"] == 3
+    for text, vector in vectors.items():
+        assert restored.embed_query(text) == vector
+    assert restored_model.queries == []
+
+
+def test_persisted_cache_keeps_lru_bound(model, tmp_path):
+    path = str(tmp_path / "queries.npz")
+    cache = make_cache(model, path=path)
+    for text in ("a", "b", "c"):
+        cache.embed_query(text)
+    cache.save()
+
+    restored = make_cache(CountingEmbeddings(), path=path, max_size=2)
+    assert restored.get_stats()["entries"] == 2
+    # Сохраняются самые свежие записи
+    restored.embed_query("b")
+    restored.embed_query("c")
+    assert restored.get_stats()["hits"] == 2
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"model_id": "other-model"}, {"normalize": True}],
+    ids=["other-model", "other-keys"],
+)
+def test_incompatible_cache_file_is_ignored(model, tmp_path, kwargs):
+    path = str(tmp_path / "queries.npz")
+    cache = make_cache(model, path=path)
+    cache.embed_query("a")
+    cache.save()
+
+    other = CachedQueryEmbeddings(
+        CountingEmbeddings(),
+        kwargs.pop("model_id", "stub-model"),
+        max_size=16,
+        path=path,
+        **kwargs,
+    )
+    assert other.get_stats()["loaded_from_disk"] == 0
+    assert other.get_stats()["entries"] == 0
@@ -0,0 +1,136 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel
+
+from chat_rag.rag import programs, rag_agent
+from chat_rag.rag.history import AI, HUMAN, DialogHistory, to_messages
+from chat_rag.rag.programs import ProgramCode, ProgramRegistry
+
+
+class FakeAgent:
+    """Агент-заглушка: запоминает входы хода и отвечает после паузы."""
+
+    def __init__(self):
+        self.inputs: List[Dict[str, Any]] = []
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        self.inputs.append(inputs)
+        await asyncio.sleep(0.05)
+        return {"output": f"answer {len(inputs.get('chat_history', []))}"}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    fake = FakeAgent()
+    monkeypatch.setattr(rag_agent, "_agent", fake)
+    monkeypatch.setattr(rag_agent, "_answer_cache", type(rag_agent._answer_cache)())
+    return fake
+
+
+def test_history_is_passed_as_chat_history(agent):
+    history = DialogHistory(4)
+    history.add_exchange("Что за программа?", "Магистратура по ИИ")
+    answer = asyncio.run(rag_agent.aprocess_message("А стоимость?", history.pairs()))
+    assert answer == "answer 2"
+    assert agent.inputs[0]["chat_history"] == [
+        HumanMessage("Что за программа?"),
+        AIMessage("Магистратура по ИИ"),
+    ]
+    # История только читается: ответ добавляет вызывающий код
+    assert len(history) == 2
+
+
+def test_only_context_free_answers_are_cached(agent):
+    asyncio.run(rag_agent.aprocess_message("А стоимость?", [(HUMAN, "q"), (AI, "a")]))
+    assert not rag_agent._answer_cache
+    asyncio.run(rag_agent.aprocess_message("Сколько стоит обучение?"))
+    assert "chat_history" not in agent.inputs[-1]
+    assert list(rag_agent._answer_cache.values()) == ["answer 0"]
+
+
+def test_same_question_with_different_history_is_not_coalesced(agent):
+    async def main():
+        return await asyncio.gather(
+            rag_agent.aprocess_message("А стоимость?"),
+            rag_agent.aprocess_message("А стоимость?"),
+            rag_agent.aprocess_message("А стоимость?", [(HUMAN, "q"), (AI, "a")]),
+        )
+
+    assert asyncio.run(main()) == ["answer 0", "answer 0", "answer 2"]
+    assert len(agent.inputs) == 2
+
+
+def test_timed_out_turn_stops_agent(agent, monkeypatch):
+    cancelled = []
+
+    async def hang(inputs):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        answer = await rag_agent.aprocess_message("Сколько стоит обучение?")
+        await asyncio.sleep(0)
+        # Ход остановлен до конца loop, а не при его закрытии
+        assert cancelled == [True]
+        return answer
+
+    monkeypatch.setattr(agent, "ainvoke", hang)
+    monkeypatch.setattr(rag_agent, "AGENT_TURN_TIMEOUT_S", 0.05)
+    assert asyncio.run(main()) == rag_agent.degraded_answer()
+
+
+def test_to_messages_keeps_order():
+    history = DialogHistory(2)
+    history.add_exchange("old", "old answer")
+    history.add_exchange("new", "new answer")
+    assert to_messages(history.pairs()) == [
+        HumanMessage("new"),
+        AIMessage("new answer"),
+    ]
+
+
+class ProgramArgs(BaseModel):
+    program: ProgramCode
+
+
+class ProgramTool(BaseTool):
+    name: str = "program_tool"
+    description: str = "Инструмент с полем program"
+    args_schema: type = ProgramArgs
+
+    def _run(self, program: str) -> str:
+        return program
+
+
+def tool_program_enum(agent) -> List[str]:
+    """Список программ в схеме инструмента, отправляемой модели."""
+    for step in agent.agent.runnable.steps:
+        tools = getattr(step, "kwargs", {}).get("tools")
+        if tools:
+            return tools[0]["function"]["parameters"]["properties"]["program"]["enum"]
+    raise AssertionError("tools are not bound")
+
+
+def test_reload_builds_tool_schema_from_new_registry(tmp_path, monkeypatch):
+    for code in ("ai", "ai_product"):
+        (tmp_path / f"{code}_chunks.json").write_text("[]")
+    monkeypatch.setenv("CHUNKS_DIR", str(tmp_path))
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    registry = ProgramRegistry()
+    monkeypatch.setattr(programs, "_registry", registry)
+    monkeypatch.setattr(rag_agent, "_kb_version", None)
+    monkeypatch.setattr(
+        rag_agent, "_agent", rag_agent._build_agent([ProgramTool()], registry)
+    )
+
+    (tmp_path / "newprog_chunks.json").write_text("[]")
+    result = rag_agent.reload_knowledge_base()
+    assert result["programs"] == ["ai", "ai_product", "newprog"]
+    assert tool_program_enum(rag_agent._agent) == ["ai", "ai_product", "newprog"]
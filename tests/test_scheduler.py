@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+from scheduler import QUICK, RECOMMEND, JobScheduler, classify_message
+
+from chat_rag.rag.history import AI, HUMAN
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Посоветуй курсы: я бэкенд-разработчик, хочу стать ML-инженером",
+        "Какие курсы выбрать аналитику данных?",
+        "Подберите элективы по компьютерному зрению",
+        "Какие выборные дисциплины мне лучше взять во втором семестре?",
+        "Помоги составить учебный план",
+        "Составь мне индивидуальную траекторию",
+        "Что лучше выбрать, если я хочу в продуктовую аналитику?",
+        "Дай рекомендации по курсам для NLP",
+    ],
+)
+def test_recommendation_requests(text):
+    assert classify_message(text) == RECOMMEND
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "На каком курсе практика?",
+        "Какие курсы есть на программе?",
+        "Сколько кредитов за элективы?",
+        "Есть ли выборные дисциплины на первом курсе?",
+        "Какая траектория обучения у программы?",
+        "Сколько стоит обучение?",
+        "Нужны ли рекомендательные письма?",
+    ],
+)
+def test_faq_questions_are_quick(text):
+    assert classify_message(text) == QUICK
+
+
+def test_answer_to_clarifying_question_continues_recommendation():
+    clarify = "Для какой программы: ai или ai_product? И кратко: опыт, интересы, цели."
+    profile = "ai, бэкенд 3 года, хочу в ML"
+    history = [(HUMAN, "Посоветуй курсы"), (AI, clarify)]
+    assert classify_message(profile, history) == RECOMMEND
+    # Второй уточняющий вопрос подряд
+    history += [(HUMAN, "ai"), (AI, "Какой у вас опыт?")]
+    assert classify_message("бэкенд 3 года", history) == RECOMMEND
+    # План выдан — дальше обычные вопросы
+    history += [(HUMAN, "бэкенд 3 года"), (AI, "План: ...")]
+    assert classify_message("Сколько стоит обучение?", history) == QUICK
+    # Вопрос агента не относился к рекомендациям
+    history = [(HUMAN, "Сколько стоит обучение?"), (AI, "Для какой программы?")]
+    assert classify_message("ai", history) == QUICK
+
+
+def make_scheduler() -> JobScheduler:
+    return JobScheduler({QUICK: 1, RECOMMEND: 1}, max_running=1)
+
+
+def test_priority_and_limits():
+    order = []
+
+    async def main():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+
+        async def job(name, wait=False):
+            order.append(name)
+            if wait:
+                await gate.wait()
+
+        first = asyncio.ensure_future(scheduler.run(RECOMMEND, lambda: job("r1", True)))
+        await asyncio.sleep(0)
+        later = [
+            asyncio.ensure_future(scheduler.run(RECOMMEND, lambda: job("r2"))),
+            asyncio.ensure_future(scheduler.run(QUICK, lambda: job("q1"))),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()[RECOMMEND]["queued"] == 1
+        gate.set()
+        await asyncio.gather(first, *later)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(main())
+    # Освободившийся слот получает старший класс (QUICK — первый в limits)
+    assert order == ["r1", "q1", "r2"]
+    assert stats[QUICK]["running"] == stats[RECOMMEND]["running"] == 0
+
+
+def test_failed_job_releases_slot():
+    async def main():
+        scheduler = make_scheduler()
+
+        async def fail():
+            raise ValueError("boom")
+
+        async def ok():
+            return "ok"
+
+        with pytest.raises(ValueError):
+            await scheduler.run(QUICK, fail)
+        return await asyncio.wait_for(scheduler.run(QUICK, ok), 1)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_cancelled_jobs_release_slots():
+    async def main():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+
+        async def ok():
+            return "ok"
+
+        running = asyncio.ensure_future(scheduler.run(QUICK, gate.wait))
+        waiting = asyncio.ensure_future(scheduler.run(QUICK, ok))
+        await asyncio.sleep(0)
+        # Отмена в очереди и во время выполнения
+        waiting.cancel()
+        running.cancel()
+        for task in (waiting, running):
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        stats = scheduler.get_stats()[QUICK]
+        assert stats["running"] == 0 and stats["queued"] == 0
+        return await asyncio.wait_for(scheduler.run(QUICK, ok), 1)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_unknown_class():
+    with pytest.raises(ValueError, match="Unknown job class"):
+        asyncio.run(make_scheduler().run("batch", asyncio.sleep))
+
+
+def test_drain_waits_for_background_jobs():
+    async def main():
+        scheduler = make_scheduler()
+        scheduler.spawn(RECOMMEND, lambda: asyncio.sleep(0.05))
+        assert await scheduler.drain(timeout=1)
+        scheduler.spawn(RECOMMEND, lambda: asyncio.sleep(5))
+        assert not await scheduler.drain(timeout=0.05)
+
+    asyncio.run(main())
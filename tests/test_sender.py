@@ -0,0 +1,184 @@
+import asyncio
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import pytest
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.methods import SendMessage
+from sender import OutboundSender, split_message
+
+
+class FakeBot:
+    """
+    Бот-заглушка: запоминает отправленные сообщения; failures[chat_id] —
+    ошибки, которые поднимут очередные отправки в этот чат.
+    """
+
+    def __init__(self):
+        self.sent: List[Tuple[int, str, float]] = []
+        self.failures: Dict[int, List[BaseException]] = {}
+        self.hang = asyncio.Event()
+        self.hang.set()
+
+    async def send_message(self, chat_id: int, text: str):
+        await self.hang.wait()
+        failures = self.failures.get(chat_id)
+        if failures:
+            raise failures.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+def method(chat_id: int = 1) -> SendMessage:
+    return SendMessage(chat_id=chat_id, text="")
+
+
+async def run_sender(bot: FakeBot, messages, timeout: float = 10, **kwargs):
+    sender = OutboundSender(
+        **{"global_rate": 1000, "chat_interval": 0.01, "concurrency": 4, **kwargs}
+    )
+    await sender.start()
+    try:
+        for chat_id, text in messages:
+            sender.send(bot, chat_id, text)
+        assert await sender.drain(timeout)
+    finally:
+        await sender.stop()
+    return sender.get_stats()
+
+
+def texts(bot: FakeBot, chat_id: int) -> List[str]:
+    return [text for chat, text, _ in bot.sent if chat == chat_id]
+
+
+def test_split_message():
+    text = "первый абзац\n\n" + "слово " * 10 + "\n" + "x" * 25
+    parts = split_message(text, limit=20)
+    assert all(len(part) <= 20 for part in parts)
+    assert parts[0] == "первый абзац"
+    assert "".join(parts).replace(" ", "") == text.replace(" ", "").replace("\n", "")
+    # Слово длиннее лимита режется
+    assert parts[-2:] == ["x" * 20, "x" * 5]
+    assert split_message("") == [""]
+
+
+def test_messages_of_one_chat_keep_order():
+    bot = FakeBot()
+    long_text = "\n".join(f"строка {i}" for i in range(1000))
+    stats = asyncio.run(run_sender(bot, [(1, long_text), (2, "other"), (1, "after")]))
+    parts = split_message(long_text)
+    assert len(parts) > 1
+    assert texts(bot, 1) == parts + ["after"]
+    assert texts(bot, 2) == ["other"]
+    assert stats["sent"] == stats["enqueued"] == len(parts) + 2
+    assert stats["queued"] == 0 and stats["chats_waiting"] == 0
+
+
+def test_flood_wait_pauses_all_chats():
+    bot = FakeBot()
+    bot.failures[1] = [TelegramRetryAfter(method(), "flood", retry_after=1)]
+    started = time.monotonic()
+    # Одна задача отправки: "c" берётся после ответа 429 на "a"
+    stats = asyncio.run(run_sender(bot, [(1, "a"), (1, "b"), (2, "c")], concurrency=1))
+    assert texts(bot, 1) == ["a", "b"]
+    assert texts(bot, 2) == ["c"]
+    sent_at = {text: at for _, text, at in bot.sent}
+    assert sent_at["a"] - started >= 1
+    assert sent_at["c"] - started >= 1
+    assert stats["flood_waits"] == 1 and stats["retries"] == 1
+    assert stats["failed"] == 0
+
+
+def test_waiting_chat_does_not_poll_and_new_chat_is_not_delayed(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def counting_sleep(delay, *args, **kwargs):
+        if sys._getframe(1).f_code.co_filename.endswith("sender.py"):
+            sleeps.append(delay)
+        return await real_sleep(delay, *args, **kwargs)
+
+    monkeypatch.setattr(asyncio, "sleep", counting_sleep)
+
+    async def main():
+        bot = FakeBot()
+        sender = OutboundSender(global_rate=1000, chat_interval=1, concurrency=4)
+        await sender.start()
+        try:
+            started = time.monotonic()
+            # "b" ждёт интервала чата 1
+            sender.send(bot, 1, "a")
+            sender.send(bot, 1, "b")
+            await real_sleep(0.3)
+            sender.send(bot, 2, "c")
+            assert await sender.drain(5)
+        finally:
+            await sender.stop()
+        return started, {text: at for _, text, at in bot.sent}
+
+    started, sent_at = asyncio.run(main())
+    assert sent_at["b"] - started >= 1
+    assert sent_at["c"] - started < 0.6
+    # Свободные задачи спят до времени готовности чата, а не опрашивают очередь
+    assert sleeps == []
+
+
+def test_network_error_is_retried_with_backoff():
+    bot = FakeBot()
+    bot.failures[1] = [TelegramNetworkError(method(), "connection reset")]
+    started = time.monotonic()
+    stats = asyncio.run(run_sender(bot, [(1, "a")]))
+    assert texts(bot, 1) == ["a"]
+    # Первый повтор — через 2 секунды
+    assert bot.sent[0][2] - started >= 2
+    assert stats["network_errors"] == 1 and stats["retries"] == 1
+
+
+def test_message_is_dropped_after_max_retries():
+    bot = FakeBot()
+    bot.failures[1] = [
+        TelegramRetryAfter(method(), "flood", retry_after=0),
+        TelegramRetryAfter(method(), "flood", retry_after=0),
+    ]
+    stats = asyncio.run(run_sender(bot, [(1, "dropped"), (1, "next")], max_retries=1))
+    assert texts(bot, 1) == ["next"]
+    assert stats["flood_waits"] == 2 and stats["retries"] == 1
+    assert stats["failed"] == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [TelegramForbiddenError(method(), "bot was blocked"), ValueError("bug")],
+)
+def test_permanent_errors_drop_message_without_retry(error):
+    bot = FakeBot()
+    bot.failures[1] = [error]
+    stats = asyncio.run(run_sender(bot, [(1, "dropped"), (1, "next"), (2, "other")]))
+    assert texts(bot, 1) == ["next"]
+    assert texts(bot, 2) == ["other"]
+    assert stats["failed"] == 1 and stats["retries"] == 0
+
+
+def test_drain_timeout_and_stop_while_sending():
+    async def main():
+        bot = FakeBot()
+        bot.hang.clear()
+        sender = OutboundSender(global_rate=1000, chat_interval=0.01, concurrency=2)
+        await sender.start()
+        sender.send(bot, 1, "stuck")
+        assert not await sender.drain(0.1)
+        assert sender.get_stats()["sending"] == 1
+        await sender.stop()
+        stats = sender.get_stats()
+        assert stats["sending"] == 0 and stats["queued"] == 1
+        assert bot.sent == []
+
+    asyncio.run(main())
+
+
+def test_drain_without_messages():
+    assert asyncio.run(OutboundSender().drain(0.01))
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from chat_rag.rag.singleflight import SingleFlight, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  Какие   ЭКЗАМЕНЫ\n") == "какие экзамены"
+
+
+def test_concurrent_calls_share_one_execution():
+    group = SingleFlight("test")
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(group.ado("key", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+    stats = group.get_stats()
+    assert stats["executed"] == 1 and stats["coalesced"] == 4
+    assert stats["in_flight"] == 0
+
+
+def test_async_failure_releases_key():
+    group = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        results = await asyncio.gather(
+            group.ado("key", fail), group.ado("key", fail), return_exceptions=True
+        )
+        assert [type(result) for result in results] == [ValueError, ValueError]
+        assert group.get_stats()["in_flight"] == 0
+        return await group.ado("key", ok)
+
+    assert asyncio.run(main()) == "ok"
+    assert group.get_stats()["errors"] == 1
+
+
+def test_failure_creating_coroutine_releases_key():
+    group = SingleFlight("test")
+
+    def broken():
+        raise TypeError("not a coroutine")
+
+    async def main():
+        with pytest.raises(TypeError):
+            await group.ado("key", broken)
+
+    asyncio.run(main())
+    assert group.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_computation():
+    group = SingleFlight("test")
+
+    async def compute():
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(group.ado("key", compute))
+        follower = asyncio.ensure_future(group.ado("key", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+    assert group.get_stats()["in_flight"] == 0
+
+
+def test_last_waiter_timeout_cancels_computation():
+    group = SingleFlight("test")
+    cancelled = []
+
+    async def compute():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        waiters = [
+            asyncio.wait_for(group.ado("key", compute), timeout)
+            for timeout in (0.05, 0.1)
+        ]
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert [type(result) for result in results] == [asyncio.TimeoutError] * 2
+        # Ключ освобождается сразу: новый вызов не ждёт отменяемое вычисление
+        assert group.get_stats()["in_flight"] == 0
+        result = await group.ado("key", ok)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "ok"
+    assert cancelled == [True]
+    stats = group.get_stats()
+    assert stats["abandoned"] == 1 and stats["executed"] == 2
+
+
+def test_cancelled_computation_releases_key():
+    group = SingleFlight("test")
+
+    async def main():
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(5)
+
+        follower = asyncio.ensure_future(group.ado("key", compute))
+        await started.wait()
+        # Задача вычисления отменяется (например, при остановке loop)
+        for task in asyncio.all_tasks():
+            if task is not follower and task is not asyncio.current_task():
+                task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        assert group.get_stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_sync_failure_is_shared_and_releases_key():
+    group = SingleFlight("test")
+    entered = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        entered.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            group.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    entered.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while group.get_stats()["coalesced"] == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert group.do("key", lambda: "ok") == "ok"
+    assert group.get_stats()["in_flight"] == 0
@@ -0,0 +1,101 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from chat_rag.devtools.fake_embeddings import HashEmbeddings
+from chat_rag.rag.vector_store import (
+    build_index,
+    compute_fingerprint,
+    open_store,
+    read_manifest,
+    resolve_index_type,
+    save_store,
+)
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings(dim=16, latency_ms=0, per_text_ms=0)
+
+
+def make_docs(version: int):
+    return [
+        Document(page_content=f"версия {version} документ {i}", metadata={"v": version})
+        for i in range(5)
+    ]
+
+
+def save(directory, embeddings, version):
+    docs = make_docs(version)
+    save_store(directory, docs, embeddings, "hash", compute_fingerprint(docs, "hash"))
+
+
+def test_save_publishes_version_behind_symlink(tmp_path, embeddings):
+    directory = str(tmp_path / "ai")
+    for version in range(3):
+        save(directory, embeddings, version)
+    assert os.path.islink(directory)
+    # Текущая и предыдущая версии, старые удалены
+    versions = sorted(p.name for p in tmp_path.iterdir() if ".v" in p.name)
+    assert len(versions) == 2
+    store = open_store(directory, embeddings)
+    assert store.docstore.search("0").metadata == {"v": 2}
+
+
+def test_readers_never_see_missing_index(tmp_path, embeddings):
+    directory = str(tmp_path / "ai")
+    save(directory, embeddings, 0)
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            try:
+                store = open_store(directory, embeddings)
+                manifest = read_manifest(directory)
+                assert manifest is not None
+                assert len(store.docstore) == manifest["count"]
+            except Exception as e:  # pragma: no cover - сообщение в assert ниже
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for version in range(1, 30):
+        save(directory, embeddings, version)
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert not errors
+
+
+def test_legacy_directory_is_migrated(tmp_path, embeddings):
+    directory = str(tmp_path / "ai")
+    save(directory, embeddings, 0)
+    # Индекс старого формата — обычный каталог
+    target = os.path.realpath(directory)
+    os.remove(directory)
+    os.rename(target, directory)
+    save(directory, embeddings, 1)
+    assert os.path.islink(directory)
+    assert open_store(directory, embeddings).docstore.search("0").metadata == {"v": 1}
+    assert not [p for p in tmp_path.iterdir() if "legacy" in p.name]
+
+
+@pytest.mark.parametrize(
+    "count, expected",
+    [(100, "flat"), (10_000, "flat"), (10_001, "hnsw"), (5_000_000, "hnsw")],
+)
+def test_auto_index_type_never_picks_ivfpq(count, expected):
+    assert resolve_index_type("auto", count) == expected
+
+
+def test_ivfpq_on_small_corpus_fails_clearly():
+    with pytest.raises(ValueError, match="at least 9984 documents"):
+        resolve_index_type("ivfpq", 500)
+    with pytest.raises(ValueError, match="at least 9984 documents"):
+        build_index(np.zeros((500, 16), dtype=np.float32), "ivfpq")
+    assert resolve_index_type("ivf", 500) == "ivf"
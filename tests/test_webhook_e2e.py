@@ -0,0 +1,137 @@
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+from chat_rag.devtools.fake_openai import FakeOpenAIServer
+from chat_rag.devtools.fake_telegram import FakeTelegramServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BOT_SCRIPT = os.path.join(ROOT, "chat_rag", "bot", "bot.py")
+SECRET = "e2e-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"Timed out waiting for {what}")
+        await asyncio.sleep(0.05)
+
+
+def replies_to(telegram: FakeTelegramServer, chat_id: int) -> List[str]:
+    return [m["text"] for m in telegram.sent_messages if m["chat"]["id"] == chat_id]
+
+
+async def run_bot_in_webhook_mode(tmp_path) -> Dict[str, Any]:
+    # Время отправки ответа в каждый чат
+    replied_at: Dict[int, float] = {}
+    telegram = FakeTelegramServer(
+        port=free_port(),
+        on_message=lambda m: replied_at.setdefault(m["chat"]["id"], time.monotonic()),
+    )
+    openai = FakeOpenAIServer(port=free_port(), latency_ms=10)
+    await telegram.start()
+    await openai.start()
+    webapp_port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "BOT_MODE": "webhook",
+        "TELEGRAM_BOT_TOKEN": "123456:E2E",
+        "TELEGRAM_API_URL": telegram.base_url,
+        "WEBHOOK_BASE_URL": f"http://127.0.0.1:{webapp_port}",
+        "WEBHOOK_SECRET": SECRET,
+        "WEBAPP_HOST": "127.0.0.1",
+        "WEBAPP_PORT": str(webapp_port),
+        "SHUTDOWN_DEREGISTER_DELAY": "1",
+        "SHUTDOWN_DRAIN_TIMEOUT": "20",
+        "SEND_CHAT_INTERVAL_S": "0",
+        "RAG_WORKERS": "0",
+        "OPENAI_BASE_URL": openai.base_url,
+        "OPENAI_API_KEY": "e2e",
+        "EMBEDDINGS_BACKEND": "hash",
+        "RETRIEVER_INDEX_DIR": str(tmp_path / "index"),
+    }
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_SCRIPT, cwd=ROOT, env=env
+    )
+    base_url = f"http://127.0.0.1:{webapp_port}"
+    result: Dict[str, Any] = {}
+    try:
+        async with aiohttp.ClientSession() as client:
+
+            async def status(path: str) -> int:
+                async with client.get(base_url + path) as response:
+                    return response.status
+
+            await wait_for(lambda: telegram.webhook_url, 60, "setWebhook")
+            assert telegram.webhook_url == base_url + "/webhook"
+            assert telegram.webhook_secret == SECRET
+            result["healthz"] = await status("/healthz")
+            result["readyz"] = await status("/readyz")
+
+            # Обычный ход: апдейт через webhook, ответ агента через sendMessage
+            assert (
+                await telegram.push_update(
+                    telegram.make_message_update(1, "Сколько стоит обучение?")
+                )
+                == 200
+            )
+            await wait_for(lambda: replies_to(telegram, 1), 60, "reply")
+
+            # Остановка во время хода: ответ досылается до выхода процесса
+            openai.configure(latency_ms=1500)
+            assert (
+                await telegram.push_update(
+                    telegram.make_message_update(2, "Какие вступительные испытания?")
+                )
+                == 200
+            )
+            await asyncio.sleep(0.3)
+            bot.send_signal(signal.SIGTERM)
+            result["signal_at"] = time.monotonic()
+            await asyncio.sleep(0.3)
+            result["readyz_stopping"] = await status("/readyz")
+            result["healthz_stopping"] = await status("/healthz")
+            # Апдейт, пришедший до вывода из ротации, ещё обрабатывается
+            result["late_update"] = await telegram.push_update(
+                telegram.make_message_update(3, "Сколько мест?")
+            )
+            result["exit_code"] = await asyncio.wait_for(bot.wait(), 60)
+            result["replied_at"] = replied_at
+            result["replies"] = {
+                chat_id: replies_to(telegram, chat_id) for chat_id in (1, 2, 3)
+            }
+    finally:
+        if bot.returncode is None:
+            bot.kill()
+            await bot.wait()
+        await openai.stop()
+        await telegram.stop()
+    return result
+
+
+def test_webhook_mode_end_to_end(tmp_path):
+    result = asyncio.run(run_bot_in_webhook_mode(tmp_path))
+    assert result["healthz"] == result["readyz"] == 200
+    assert result["readyz_stopping"] == 503 and result["healthz_stopping"] == 200
+    assert result["late_update"] == 200
+    assert result["exit_code"] == 0
+    replies = result["replies"]
+    assert replies[1] == ["Ответ на вопрос: Сколько стоит обучение?"]
+    assert replies[2] == ["Ответ на вопрос: Какие вступительные испытания?"]
+    assert replies[3] == ["Ответ на вопрос: Сколько мест?"]
+    # Ответы на апдейты, принятые до остановки, отправлены уже после SIGTERM
+    assert result["replied_at"][2] > result["signal_at"]
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from chat_rag.rag import worker_pool
+from chat_rag.rag.worker_pool import ShardedWorkerPool, WorkerUnavailableError
+
+
+def fake_agent(text: str, history) -> str:
+    """Агент-заглушка worker-процесса: команды в тексте сообщения."""
+    if text == "crash":
+        os._exit(3)
+    if text == "fail":
+        raise ValueError("boom")
+    if text.startswith("sleep"):
+        time.sleep(float(text.split()[1]))
+    return f"{text}:{len(history)}"
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(num_workers: int = 1, **kwargs) -> ShardedWorkerPool:
+        pool = ShardedWorkerPool(num_workers, 2, process_fn=fake_agent, **kwargs)
+        pool.start(timeout=60)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.stop(timeout=5)
+
+
+def test_process_returns_answer(make_pool):
+    pool = make_pool()
+    answer = asyncio.run(pool.process(1, "hello", [("human", "hi"), ("ai", "hey")]))
+    assert answer == "hello:2"
+
+
+def test_worker_error_is_raised(make_pool):
+    pool = make_pool()
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(pool.process(1, "fail", []))
+    assert asyncio.run(pool.process(1, "ok", [])) == "ok:0"
+
+
+def test_crashed_worker_fails_pending_and_restarts(make_pool):
+    pool = make_pool(request_timeout=30)
+
+    async def scenario():
+        # Сообщение другого пользователя ждёт в том же процессе
+        slow = asyncio.ensure_future(pool.process(2, "sleep 5", []))
+        await asyncio.sleep(0.5)
+        with pytest.raises(WorkerUnavailableError, match="exited with code 3"):
+            await pool.process(1, "crash", [])
+        with pytest.raises(WorkerUnavailableError):
+            await slow
+        return await pool.process(1, "after", [])
+
+    assert asyncio.run(scenario()) == "after:0"
+    stats = pool.get_stats()
+    assert stats["restarts"] == 1
+    assert stats["alive"] == 1
+    assert stats["pending"] == 0
+
+
+def test_respawn_delay_does_not_stall_other_workers(make_pool, monkeypatch):
+    monkeypatch.setattr(worker_pool, "RESPAWN_DELAY_S", 3.0)
+    pool = make_pool(num_workers=2, request_timeout=60)
+    crashed, healthy = 0, 1
+    assert pool.shard_for(crashed) != pool.shard_for(healthy)
+
+    async def scenario():
+        with pytest.raises(WorkerUnavailableError, match="exited"):
+            await pool.process(crashed, "crash", [])
+        # Процесс только что запущен: перезапуск отложен на RESPAWN_DELAY_S
+        started = time.monotonic()
+        assert await pool.process(healthy, "ok", []) == "ok:0"
+        healthy_s = time.monotonic() - started
+        # Сообщение ждёт в очереди нового процесса
+        return healthy_s, await pool.process(crashed, "after", [])
+
+    healthy_s, answer = asyncio.run(scenario())
+    assert healthy_s < 1.0
+    assert answer == "after:0"
+    assert pool.get_stats()["restarts"] == 1
+
+
+def test_stop_finishes_queued_messages_of_user():
+    pool = ShardedWorkerPool(1, 2, process_fn=fake_agent)
+    pool.start(timeout=60)
+
+    async def scenario():
+        # Второе сообщение пользователя ждёт в его очереди внутри процесса
+        answers = asyncio.gather(
+            pool.process(1, "sleep 1", []),
+            pool.process(1, "second", []),
+            return_exceptions=True,
+        )
+        await asyncio.sleep(0.3)
+        stopper = threading.Thread(target=pool.stop, args=(10,))
+        stopper.start()
+        result = await asyncio.wait_for(answers, 15)
+        stopper.join()
+        return result
+
+    assert asyncio.run(scenario()) == ["sleep 1:0", "second:0"]
+    assert pool.get_stats()["alive"] == 0
+
+
+def test_process_timeout(make_pool):
+    pool = make_pool(request_timeout=0.5)
+
+    async def scenario():
+        with pytest.raises(WorkerUnavailableError, match="did not answer"):
+            await pool.process(1, "sleep 2", [])
+        # Процесс жив и обслуживает других пользователей; поздний ответ отброшен
+        answer = await pool.process(2, "next", [])
+        await asyncio.sleep(2)
+        return answer
+
+    assert asyncio.run(scenario()) == "next:0"
+    assert pool.get_stats()["pending"] == 0
+
+
+def test_stop_fails_unanswered_requests():
+    pool = ShardedWorkerPool(1, 1, process_fn=fake_agent)
+    pool.start(timeout=60)
+
+    async def scenario():
+        pending = asyncio.ensure_future(pool.process(1, "sleep 30", []))
+        await asyncio.sleep(0.5)
+        stopper = threading.Thread(target=pool.stop, args=(0.5,))
+        stopper.start()
+        with pytest.raises(WorkerUnavailableError):
+            await asyncio.wait_for(pending, 10)
+        stopper.join()
+        with pytest.raises(WorkerUnavailableError, match="stopped"):
+            await pool.process(1, "late", [])
+
+    asyncio.run(scenario())
+    assert pool.get_stats()["alive"] == 0